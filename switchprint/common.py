@@ -49,6 +49,22 @@ def __populate_etc(config_path):
     os.mkdir(config_path)
 
 
+def get_config_path():
+    """Returns the path of the configuration directory, creating it
+    if need be.  Worker subprocesses don't run bootstrap, so this
+    settles on the same directory bootstrap would have."""
+
+    global __ENV
+    if not __ENV["config"]:
+        if sys.platform == "linux2" and os.getuid() == 0:
+            __ENV["config"] = "/etc/voxelpress"
+        else:
+            __ENV["config"] = os.path.expanduser("~/.voxelpress")
+    if not os.path.isdir(__ENV["config"]):
+        __populate_etc(__ENV["config"])
+    return __ENV["config"]
+
+
 def bootstrap():
     """Determines environmental information that will be useful for
     the switchprint daemon."""
@@ -16,12 +16,18 @@
 # along with Switchprint.  If not, see <http://www.gnu.org/licenses/>.
 
 
+import time, argparse, multiprocessing
 import gobject
 import dbus, dbus.service
 from dbus.mainloop.glib import DBusGMainLoop
 
 import monitors
-from switchprint.workers.common import list_printers
+from switchprint import workers
+from probes import ProbeScheduler, PROBE_LIMIT, PROBE_TIMEOUT
+from registry import PrinterRegistry
+from switchprint.workers.common import list_printers, list_hosts, \
+    name_from_uuid, path_from_uuid, uuid_from_name, uuid_from_path, \
+    PRINTER_PREFIX, PRINTER_PATH_PREFIX
 from switchprint import common
 
 
@@ -34,38 +40,177 @@ class SwitchBoard(dbus.service.Object):
             "org.voxelpress.hardware", bus=self.__bus)
         dbus.service.Object.__init__(
             self, bus_name, "/org/voxelpress/hardware")
+        self.probes = None
+        self.printers = PrinterRegistry(self.printer_added, self.printer_removed)
 
-    @dbus.service.method("org.voxelpress.hardware", in_signature='s')
-    def worker_new_printer(self, printer_uuid):
+        self.__bus.add_signal_receiver(
+            self.__name_owner_changed, signal_name="NameOwnerChanged",
+            dbus_interface="org.freedesktop.DBus")
+        self.__bus.add_signal_receiver(
+            self.__state_changed, signal_name="on_state_change",
+            dbus_interface="org.voxelpress.hardware", path_keyword="path")
+
+        # printers may have outlived a previous daemon
+        for name in list_printers():
+            printer_uuid = uuid_from_name(name)
+            try:
+                prox = self.__bus.get_object(name, path_from_uuid(printer_uuid))
+                self.printers.add(
+                    printer_uuid, device_path=prox.get_device_path(),
+                    state=prox.get_state())
+            except dbus.DBusException:
+                continue
+            self.__fetch_class_info(printer_uuid)
+
+    def __name_owner_changed(self, name, old_owner, new_owner):
+        if not str(name).startswith(PRINTER_PREFIX):
+            return
+        if new_owner:
+            self.printers.add(uuid_from_name(name))
+        else:
+            self.printers.remove(uuid_from_name(name))
+
+    def __state_changed(self, state, path=None):
+        if path and str(path).startswith(PRINTER_PATH_PREFIX):
+            self.printers.update(uuid_from_path(path), state=state)
+
+    def __fetch_class_info(self, printer_uuid):
+        def fetched(class_info):
+            self.printers.update(printer_uuid, class_info=class_info)
+        def failed(error):
+            pass
+        prox = self.__bus.get_object(
+            name_from_uuid(printer_uuid), path_from_uuid(printer_uuid))
+        prox.get_class_info(reply_handler=fetched, error_handler=failed)
+
+    def device_removed(self, device_path):
+        """Tells the printer on the device that it's gone, if any is.
+        Returns False if there wasn't one."""
+
+        printer_uuid = self.printers.find_device(device_path)
+        if printer_uuid is None:
+            return False
+        self.printers.update(printer_uuid, device_path="")
+        def claimed(result):
+            pass
+        def failed(error):
+            print "Unable to disconnect %s: %s" % (printer_uuid, error)
+        prox = self.__bus.get_object(
+            name_from_uuid(printer_uuid), path_from_uuid(printer_uuid))
+        prox.verify_disconnect(
+            device_path, reply_handler=claimed, error_handler=failed)
+        return True
+
+    @dbus.service.method("org.voxelpress.hardware", in_signature='ss')
+    def worker_new_printer(self, printer_uuid, device_path):
         """Called by a worker subprocess when it creates a new
         PrintServer instance."""
+        self.printers.add(printer_uuid, device_path=device_path, state="ready")
+        self.__fetch_class_info(printer_uuid)
+        if self.probes:
+            self.probes.announce(device_path, printer_uuid)
         self.new_printer_notification(printer_uuid)
+
+    @dbus.service.method("org.voxelpress.hardware", in_signature='ss')
+    def worker_reconnected_printer(self, printer_uuid, device_path):
+        """Called by a worker subprocess when it finds a printer that
+        already has a PrintServer, once it has reconnected."""
+        self.printers.add(printer_uuid, device_path=device_path, state="ready")
+        self.__fetch_class_info(printer_uuid)
+        if self.probes:
+            self.probes.announce(device_path, printer_uuid)
+
+    @dbus.service.method("org.voxelpress.hardware", in_signature='s', out_signature='s')
+    def find_printer(self, device_path):
+        """Returns the uuid of the printer on the device, or an empty
+        string if there isn't one."""
+        return self.printers.find_device(device_path) or ""
+
+    @dbus.service.method("org.voxelpress.hardware", in_signature='s', out_signature='a{ss}')
+    def get_printer_info(self, printer_uuid):
+        """Returns what the daemon knows of a printer: its uuid, state,
+        device path and pickled class info.  Empty if it doesn't know
+        the printer."""
+        printer = self.printers.printers.get(str(printer_uuid), {})
+        return dbus.Dictionary(printer, signature="ss")
         
     @dbus.service.signal(dbus_interface='org.voxelpress.hardware', signature='s')
     def new_printer_notification(self, printer_uuid):
         """Signals when a new printer is available."""
         pass
 
+    @dbus.service.signal(dbus_interface='org.voxelpress.hardware', signature='s')
+    def printer_added(self, printer_uuid):
+        """Signals when a printer first appears in the registry."""
+        pass
+
+    @dbus.service.signal(dbus_interface='org.voxelpress.hardware', signature='s')
+    def printer_removed(self, printer_uuid):
+        """Signals when a printer's server has gone away."""
+        pass
+
+    @dbus.service.signal(dbus_interface='org.voxelpress.hardware', signature='as')
+    def all_printers_online(self, printer_uuids):
+        """Signals when every device found at startup, or plugged in
+        together since, has been probed.  Carries the uuids of the
+        printers that came online."""
+        pass
+
     @dbus.service.method("org.voxelpress.hardware", out_signature='as')
     def get_printers(self):
-        """Called by a worker subprocess when it creates a new
-        PrintServer instance."""
-        printers = []
-        for namespace in list_printers():
-            printers.append(namespace.split(".")[-1][1:].replace("_", "-"))
-        return dbus.Array(printers)
+        """Returns the uuids of every printer, from the registry
+        rather than by scanning the bus."""
+        return dbus.Array(sorted(self.printers.printers.keys()), signature="s")
         
 
+# How long to wait, in seconds, for printer hosts to come up before
+# looking for printers to hand them.
+HOST_STARTUP = 10
+
+
+def start_hosts(count):
+    """Starts 'count' printer hosts, and waits for them to appear on
+    the bus.  See switchprint.workers.host."""
+
+    hosts = [workers.create("host", index) for index in range(count)]
+    give_up = time.time() + HOST_STARTUP
+    while len(list_hosts()) < count and time.time() < give_up:
+        time.sleep(0.1)
+    return hosts
+
+
 def start_daemon():
     """
     Creates the switchprint daemon.
     """
     # TODO: daemonize this
+    parser = argparse.ArgumentParser(description="The switchprint daemon.")
+    parser.add_argument("--probe-limit", type=int, default=PROBE_LIMIT,
+                        help="devices to probe at once")
+    parser.add_argument("--probe-timeout", type=float, default=PROBE_TIMEOUT,
+                        help="seconds to wait for a device to come online")
+    parser.add_argument("--no-zygote", action="store_true",
+                        help="start a new interpreter for every worker")
+    parser.add_argument("--hosts", type=int, nargs="?", default=0,
+                        const=multiprocessing.cpu_count(),
+                        help="run printers in this many shared processes, "
+                        "rather than one each (default with no number: "
+                        "one per core)")
+    args = parser.parse_args()
+
+    # the zygote has to be forked before anything touches the bus
+    if not args.no_zygote:
+        workers.start_zygote()
+
     main_loop = gobject.MainLoop()
     DBusGMainLoop(set_as_default=True)
 
     common.bootstrap()
 
     switchboard = SwitchBoard()
-    hardwaremon = monitors.HardwareMonitor()
+    hosts = start_hosts(args.hosts)
+    switchboard.probes = ProbeScheduler(
+        args.probe_limit, args.probe_timeout,
+        lambda online: switchboard.all_printers_online(dbus.Array(online, "s")))
+    hardwaremon = monitors.HardwareMonitor(switchboard)
     main_loop.run()
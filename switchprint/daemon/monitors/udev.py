@@ -17,7 +17,6 @@
 
 
 import os
-from switchprint import workers
 import gudev
 
 
@@ -25,7 +24,8 @@ class HardwareMonitor():
     """This class implements the hardware monitor for systems in which
     udev is available.  Presumably that means just Linux."""
     
-    def __init__(self):
+    def __init__(self, switchboard):
+        self.__switchboard = switchboard
         self.__udev = gudev.Client(["tty", "usb/usb_device"])
         self.__udev.connect("uevent", self.__udev_callback, None)
         self.__scan()
@@ -44,10 +44,11 @@ class HardwareMonitor():
             self.__on_disconnect("usbACM", usb_path)
 
     def __on_connect(self, hint, usb_path, tty_path, hw_info):
-        workers.create("on_connect", hint, usb_path, tty_path, hw_info)
+        self.__switchboard.probes.submit(hint, usb_path, tty_path, hw_info)
 
     def __on_disconnect(self, hint, usb_path):
-        workers.create("on_disconnect", hint, usb_path)
+        self.__switchboard.probes.cancel(usb_path)
+        self.__switchboard.device_removed(usb_path)
 
     def __scan(self):
         """Iterate over available serial ports and try to find repraps."""
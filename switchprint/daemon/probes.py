@@ -0,0 +1,135 @@
+
+
+# This file is part of Switchprint.
+#
+# Switchprint is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Switchprint is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Switchprint.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import time
+import gobject
+from switchprint import workers
+
+
+# Probing a device can take most of a minute when it has to try every
+# baud rate, so only so many are allowed at once and none forever.
+PROBE_LIMIT = 4
+PROBE_TIMEOUT = 60
+
+# How often, in milliseconds, running probes are checked on.
+POLL_INTERVAL = 250
+
+
+class ProbeScheduler(object):
+    """Runs the on_connect workers for devices the hardware monitor
+    finds, no more than 'limit' at a time, queueing the rest.  A
+    device is only probed once at a time, and a probe that hasn't
+    brought its printer online after 'timeout' seconds is killed.
+
+    A probe is finished when its worker announces a printer through
+    the switchboard, or when the worker exits: with status 0 if it
+    handed the device to a printer that was already online, otherwise
+    because nothing claimed it.  Once a burst of probes, such as the
+    scan at startup, is finished, 'on_settled' is called with the
+    uuids of the printers that came online during it."""
+
+    def __init__(self, limit=PROBE_LIMIT, timeout=PROBE_TIMEOUT,
+                 on_settled=None):
+        self.limit = max(limit, 1)
+        self.timeout = timeout
+        self.on_settled = on_settled
+        self.online = {} # device path -> printer uuid, None if unknown
+        self.failed = set() # device paths
+        self.__queue = [] # (hint, device path, worker args)
+        self.__running = {} # device path -> (process, deadline)
+        self.__burst = None # uuids brought online since the last settle
+        self.__watch = None
+
+    def pending(self):
+        """Returns the number of probes queued or running."""
+        return len(self.__queue) + len(self.__running)
+
+    def submit(self, hint, device_path, *args):
+        """Queues a probe of the device at 'device_path'.  Returns
+        False if one is already queued or running for it."""
+
+        if device_path in self.__running or \
+           [i for i in self.__queue if i[1] == device_path]:
+            return False
+        self.online.pop(device_path, None)
+        self.failed.discard(device_path)
+        if self.__burst is None:
+            self.__burst = []
+        self.__queue.append((hint, device_path, args))
+        self.__start()
+        return True
+
+    def cancel(self, device_path):
+        """Drops any probe of the device, which has gone away."""
+
+        self.__queue = [i for i in self.__queue if i[1] != device_path]
+        if device_path in self.__running:
+            process, deadline = self.__running.pop(device_path)
+            self.__kill(process)
+        self.online.pop(device_path, None)
+        self.__start()
+
+    def announce(self, device_path, printer_uuid):
+        """Called when a worker has brought a printer online."""
+
+        self.__running.pop(device_path, None)
+        self.online[device_path] = printer_uuid
+        self.failed.discard(device_path)
+        if self.__burst is not None:
+            self.__burst.append(printer_uuid)
+        self.__start()
+
+    def __start(self):
+        while self.__queue and len(self.__running) < self.limit:
+            hint, device_path, args = self.__queue.pop(0)
+            process = workers.create("on_connect", hint, device_path, *args)
+            self.__running[device_path] = (process, time.time() + self.timeout)
+        if self.__running and self.__watch is None:
+            self.__watch = gobject.timeout_add(POLL_INTERVAL, self.__poll)
+        if not self.pending() and self.__burst is not None:
+            online, self.__burst = self.__burst, None
+            print "All printers online:", len(online)
+            if self.on_settled:
+                self.on_settled(online)
+
+    def __kill(self, process):
+        try:
+            process.kill()
+            process.wait()
+        except OSError:
+            pass
+
+    def __poll(self):
+        now = time.time()
+        for device_path, (process, deadline) in self.__running.items():
+            if process.poll() is not None:
+                del self.__running[device_path]
+                if process.returncode == 0:
+                    self.online[device_path] = None
+                else:
+                    self.failed.add(device_path)
+            elif now > deadline:
+                print "Probe timed out:", device_path
+                del self.__running[device_path]
+                self.__kill(process)
+                self.failed.add(device_path)
+        self.__start()
+        if not self.__running:
+            self.__watch = None
+            return False
+        return True
@@ -0,0 +1,90 @@
+
+
+# This file is part of Switchprint.
+#
+# Switchprint is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Switchprint is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Switchprint.  If not, see <http://www.gnu.org/licenses/>.
+
+
+class PrinterRegistry(object):
+    """The daemon's record of every printer with a PrintServer, so
+    that nothing need scan the bus to find them.  Each printer is a
+    dictionary with its "uuid", "state", "device_path" and pickled
+    "class_info", the latter two empty until known.  'on_added' and
+    'on_removed' are called with the uuid of a printer the first
+    time it is recorded and when it goes away."""
+
+    def __init__(self, on_added=None, on_removed=None):
+        self.printers = {} # uuid -> printer
+        self.__devices = {} # device path -> uuid
+        self.on_added = on_added
+        self.on_removed = on_removed
+
+    def add(self, printer_uuid, **fields):
+        """Records the printer, or updates it with 'fields' if it is
+        already known."""
+
+        printer_uuid = str(printer_uuid)
+        printer = self.printers.get(printer_uuid)
+        added = printer is None
+        if added:
+            printer = self.printers[printer_uuid] = {
+                "uuid" : printer_uuid,
+                "state" : "ready",
+                "device_path" : "",
+                "class_info" : "",
+                }
+        self.update(printer_uuid, **fields)
+        if added and self.on_added:
+            self.on_added(printer_uuid)
+        return printer
+
+    def update(self, printer_uuid, **fields):
+        """Changes what is known about a printer.  Returns False if it
+        isn't known."""
+
+        printer = self.printers.get(str(printer_uuid))
+        if printer is None:
+            return False
+        if "device_path" in fields:
+            self.__move(printer, str(fields.pop("device_path")))
+        for key, value in fields.items():
+            assert key in printer, key
+            printer[key] = str(value)
+        return True
+
+    def __move(self, printer, device_path):
+        if self.__devices.get(printer["device_path"]) == printer["uuid"]:
+            del self.__devices[printer["device_path"]]
+        printer["device_path"] = device_path
+        if device_path:
+            # a device only has one printer on it
+            other = self.__devices.get(device_path)
+            if other in self.printers:
+                self.printers[other]["device_path"] = ""
+            self.__devices[device_path] = printer["uuid"]
+
+    def remove(self, printer_uuid):
+        printer = self.printers.get(str(printer_uuid))
+        if printer is None:
+            return False
+        self.__move(printer, "")
+        del self.printers[printer["uuid"]]
+        if self.on_removed:
+            self.on_removed(printer["uuid"])
+        return True
+
+    def find_device(self, device_path):
+        """Returns the uuid of the printer on the device, or None."""
+
+        return self.__devices.get(device_path)
@@ -0,0 +1,146 @@
+
+
+# This file is part of Switchprint.
+#
+# Switchprint is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Switchprint is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Switchprint.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import time
+from .. import probes
+from ..probes import ProbeScheduler
+
+
+class FakeProcess(object):
+    """Stands in for an on_connect worker, which exits when the test
+    sets its returncode."""
+
+    def __init__(self, device_path):
+        self.device_path = device_path
+        self.returncode = None
+        self.killed = False
+
+    def poll(self):
+        return self.returncode
+
+    def kill(self):
+        self.killed = True
+        self.returncode = -9
+
+    def wait(self):
+        return self.returncode
+
+
+class FakeLoop(object):
+    """Takes the place of both the workers module and gobject, so
+    that workers aren't really started, and the test decides when
+    running probes are checked on."""
+
+    def __init__(self):
+        self.started = []
+        self.__poll = None
+
+    def create(self, event, hint, device_path, *args):
+        assert event == "on_connect"
+        process = FakeProcess(device_path)
+        self.started.append(process)
+        return process
+
+    def timeout_add(self, interval, callback):
+        self.__poll = callback
+        return 1
+
+    def poll(self):
+        return self.__poll()
+
+    def install(self):
+        self.__saved = (probes.workers, probes.gobject)
+        probes.workers = probes.gobject = self
+
+    def remove(self):
+        probes.workers, probes.gobject = self.__saved
+
+
+def limit_test():
+    loop = FakeLoop()
+    loop.install()
+    try:
+        settled = []
+        scheduler = ProbeScheduler(2, 60, settled.append)
+        for name in ("a", "b", "c"):
+            assert scheduler.submit("hint", "/dev/" + name)
+        # only two at once, and the third waits its turn
+        assert [i.device_path for i in loop.started] == ["/dev/a", "/dev/b"]
+        assert scheduler.pending() == 3
+        # a device is only probed once at a time, queued or running
+        assert not scheduler.submit("hint", "/dev/a")
+        assert not scheduler.submit("hint", "/dev/c")
+
+        scheduler.announce("/dev/a", "uuid-a")
+        assert [i.device_path for i in loop.started][-1] == "/dev/c"
+        # b was handed to a printer that was already online, and
+        # nothing claimed c
+        loop.started[1].returncode = 0
+        loop.started[2].returncode = 1
+        assert not loop.poll()
+        assert scheduler.pending() == 0
+        assert scheduler.online == {"/dev/a" : "uuid-a", "/dev/b" : None}
+        assert scheduler.failed == set(["/dev/c"])
+        assert settled == [["uuid-a"]]
+
+        # probing a device again forgets how it went last time
+        assert scheduler.submit("hint", "/dev/c")
+        assert "/dev/c" not in scheduler.failed
+    finally:
+        loop.remove()
+
+
+def timeout_test():
+    loop = FakeLoop()
+    loop.install()
+    try:
+        scheduler = ProbeScheduler(1, 0)
+        scheduler.submit("hint", "/dev/a")
+        scheduler.submit("hint", "/dev/b")
+        time.sleep(0.01)
+        # a is killed for taking too long, which makes room for b
+        assert loop.poll()
+        assert loop.started[0].killed
+        assert scheduler.failed == set(["/dev/a"])
+        assert loop.started[1].device_path == "/dev/b"
+        time.sleep(0.01)
+        assert not loop.poll()
+        assert loop.started[1].killed
+        assert scheduler.failed == set(["/dev/a", "/dev/b"])
+    finally:
+        loop.remove()
+
+
+def cancel_test():
+    loop = FakeLoop()
+    loop.install()
+    try:
+        settled = []
+        scheduler = ProbeScheduler(1, 60, settled.append)
+        scheduler.submit("hint", "/dev/a")
+        scheduler.submit("hint", "/dev/b")
+        # b goes away before its turn, then a while it is probed
+        scheduler.cancel("/dev/b")
+        assert scheduler.pending() == 1
+        scheduler.cancel("/dev/a")
+        assert loop.started[0].killed
+        assert len(loop.started) == 1
+        assert scheduler.pending() == 0
+        assert settled == [[]]
+    finally:
+        loop.remove()
@@ -0,0 +1,68 @@
+
+
+# This file is part of Switchprint.
+#
+# Switchprint is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Switchprint is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Switchprint.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from ..registry import PrinterRegistry
+
+
+def device_move_test():
+    registry = PrinterRegistry()
+    registry.add("a", device_path="/dev/ttyACM0")
+    assert registry.find_device("/dev/ttyACM0") == "a"
+
+    # another printer turning up on the device takes it over
+    registry.add("b", device_path="/dev/ttyACM0")
+    assert registry.find_device("/dev/ttyACM0") == "b"
+    assert registry.printers["a"]["device_path"] == ""
+
+    # moving a printer that lost its device leaves the new owner be
+    registry.update("a", device_path="/dev/ttyACM1")
+    assert registry.find_device("/dev/ttyACM0") == "b"
+    assert registry.find_device("/dev/ttyACM1") == "a"
+
+    # and moving one that still has it frees the old device
+    registry.update("b", device_path="/dev/ttyACM2")
+    assert registry.find_device("/dev/ttyACM0") is None
+    assert registry.find_device("/dev/ttyACM2") == "b"
+
+    registry.remove("a")
+    assert registry.find_device("/dev/ttyACM1") is None
+    assert registry.find_device("/dev/ttyACM2") == "b"
+
+
+def registry_test():
+    added = []
+    removed = []
+    registry = PrinterRegistry(added.append, removed.append)
+    printer = registry.add(u"a", state="offline")
+    assert printer == {"uuid" : "a", "state" : "offline",
+                       "device_path" : "", "class_info" : ""}
+    assert type(printer["uuid"]) is str
+
+    # adding a known printer only updates it
+    registry.add("a", state="ready", class_info="pickled")
+    assert registry.printers["a"]["state"] == "ready"
+    assert registry.printers["a"]["class_info"] == "pickled"
+    assert added == ["a"]
+
+    assert not registry.update("b", state="ready")
+    assert "b" not in registry.printers
+
+    assert registry.remove("a")
+    assert not registry.remove("a")
+    assert registry.printers == {}
+    assert removed == ["a"]
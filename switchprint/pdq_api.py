@@ -24,12 +24,14 @@ from switchprint.common import get_bus
 
 def get_printers():
     bus = get_bus()
+    switchboard = bus.get_object(
+        "org.voxelpress.hardware", "/org/voxelpress/hardware")
     printers = {}
-    for namespace in _common.list_printers():
-        printer_uuid = uuid.UUID(namespace.split(".")[-1][1:].replace("_", "-"))
-        object_path = "/" + namespace.replace(".", "/")
-        proxy = bus.get_object(namespace, object_path)
-        printers[printer_uuid] = PrinterInterface(printer_uuid, proxy)
+    for printer_uuid in switchboard.get_printers():
+        proxy = bus.get_object(_common.name_from_uuid(printer_uuid),
+                               _common.path_from_uuid(printer_uuid))
+        printers[uuid.UUID(printer_uuid)] = PrinterInterface(
+            uuid.UUID(printer_uuid), proxy)
     return printers
                       
 
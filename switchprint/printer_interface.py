@@ -35,6 +35,9 @@ class PrinterInterface:
         self.__proxy.connect_to_signal(
             "on_report",
             self.on_report)
+        self.__proxy.connect_to_signal(
+            "on_telemetry",
+            self.on_telemetry)
         self.on_state_change("ready")
         self.__proxy.connect_to_signal(
             "on_pdq_print_progress",
@@ -58,6 +61,25 @@ class PrinterInterface:
         """Signals when there is new information availble from a printer."""
         pass
 
+    def on_telemetry(self, printer_state, values):
+        """Signals the printer's temperatures, as a dictionary of
+        floats, when they have changed."""
+        pass
+
+    def get_history(self, since=0, fields=()):
+        """Returns the timestamps of the printer's telemetry samples
+        taken after 'since', and a dictionary of lists of their
+        values for each of 'fields', or for every field."""
+        stamps, values = self.__proxy.get_history(since, list(fields),
+                                                  signature="das")
+        return ([float(i) for i in stamps],
+                dict((str(k), [float(i) for i in v]) for k, v in values.items()))
+
+    def set_telemetry(self, max_rate, threshold):
+        """Limits how often on_telemetry is signalled, and how much a
+        temperature must change to be signalled again."""
+        self.__proxy.set_telemetry(max_rate, threshold)
+
     def home(self, x_axis=False, y_axis=False, z_axis=False):
         self.__proxy.home(x_axis, y_axis, z_axis)
 
@@ -73,12 +95,37 @@ class PrinterInterface:
     def motors_off(self):
         self.__proxy.motors_off()
 
+    def send_batch(self, commands):
+        """Queues many commands in one round trip, and returns the
+        number of lines queued.  Each command is either a string of
+        gcode, or a tuple of the name of a method of this class and
+        its arguments, eg ("move", 1, 2, 0)."""
+        batch = []
+        for command in commands:
+            if isinstance(command, basestring):
+                batch.append(("gcode", [command]))
+            else:
+                batch.append((command[0], list(command[1:])))
+        return int(self.__proxy.send_batch(batch, signature="a(sav)"))
+
     def set_tool_temp(self, tool, target):
         self.__proxy.set_tool_temp(tool, target)
 
     def set_bed_temp(self, target):
         self.__proxy.set_bed_temp(target)
 
+    def dump_trace(self):
+        return self.__proxy.dump_trace()
+
+    def set_trace_level(self, level):
+        self.__proxy.set_trace_level(level)
+
+    def start_capture(self, path):
+        self.__proxy.start_capture(path)
+
+    def stop_capture(self):
+        self.__proxy.stop_capture()
+
     #### FIXME: The following "pdq" method and signals were added to
     #### facilitate a demonstration and enable rudementry printing
     #### functionality.  They exist for demonstration, and should not
@@ -87,6 +134,9 @@ class PrinterInterface:
     def pdq_request_print(self, path):
         self.__proxy.pdq_request_print(path)
 
+    def pdq_resume_print(self):
+        return self.__proxy.pdq_resume_print()
+
     def on_pdq_print_progress(self, progress):
         pass
 
@@ -37,6 +37,11 @@ class SwitchBoard:
         self.__proxy.connect_to_signal(
             "new_printer_notification",
             new_printer_callback)
+        def printer_removed_callback(printer_uuid):
+            self.__printer_removed_handler(str(printer_uuid))
+        self.__proxy.connect_to_signal(
+            "printer_removed",
+            printer_removed_callback)
 
     def __new_printer_handler(self, printer_uuid):
         """Used internally."""
@@ -45,6 +50,24 @@ class SwitchBoard:
             self.__printers[printer_uuid] = printer
             self.on_new_printer(printer)
              
+    def __printer_removed_handler(self, printer_uuid):
+        """Used internally."""
+        printer = self.__printers.pop(printer_uuid, None)
+        if printer:
+            self.on_printer_removed(printer)
+
+    def get_printer_info(self, printer_uuid):
+        """Returns what the daemon knows of a printer, without asking
+        the printer: its "uuid", "state", "device_path" and pickled
+        "class_info"."""
+        return dict((str(k), str(v)) for k, v in
+                    self.__proxy.get_printer_info(printer_uuid).items())
+
+    def on_printer_removed(self, printer):
+        """Override this method to be notified when a printer goes
+        away."""
+        print "Printer Removed:", printer.uuid
+
     def on_new_printer(self, printer):
         """Override this method to be notified of the presence of a
         new printer."""
@@ -20,11 +20,28 @@ import os
 import subprocess
 
 
+__zygote = None
+
+
+def start_zygote():
+    """Forks a zygote that workers will be forked from from now on,
+    rather than each starting a new interpreter.  See zygote.py."""
+
+    global __zygote
+    from zygote import Zygote
+    __zygote = Zygote()
+
+
 def create(event, *args):
     """Creates a worker subprocess to handle a particular event so
-    they can be handled outside of the main process."""
+    they can be handled outside of the main process.  Returns the
+    subprocess."""
 
-    assert event in ("on_connect", "on_disconnect")
+    assert event in ("on_connect", "host")
+    if __zygote:
+        worker = __zygote.create(event, *map(str, list(args)))
+        if worker:
+            return worker
     script = os.path.join(os.path.split(__file__)[0], event+".py")
     _args = ["python", script] + map(str, list(args))
-    subprocess.Popen(_args)
+    return subprocess.Popen(_args)
@@ -27,10 +27,10 @@ def checksum_uuid(text):
 
 def assign_uuid(driver, hw_path, other_info):
     """This function deterministically generates a uuid for a given
-    hardware entity.  This function is called on at least on_connect
-    and on_disconnect to determine the relevant service identifier,
-    and therefor must generate the same uuid for a given device each
-    time it is connected."""
+    hardware entity.  This function is called on on_connect to
+    determine the relevant service identifier, and therefor must
+    generate the same uuid for a given device each time it is
+    connected."""
 
     printer_uuid = None
     if driver.uuid:
@@ -46,18 +46,32 @@ def assign_uuid(driver, hw_path, other_info):
     return printer_uuid
 
 
+PRINTER_PREFIX = "org.voxelpress.hardware._"
+PRINTER_PATH_PREFIX = "/org/voxelpress/hardware/_"
+
+
 def path_from_uuid(printer_uuid):
     """Generates a DBUS object path from a uuid."""
 
-    base_path = "/org/voxelpress/hardware/_"
-    return base_path + str(printer_uuid).replace("-", "_")
+    return PRINTER_PATH_PREFIX + str(printer_uuid).replace("-", "_")
     
 
 def name_from_uuid(printer_uuid):
     """Generates a DBUS namespace from a uuid."""
 
-    namespace = "org.voxelpress.hardware._"
-    return namespace + str(printer_uuid).replace("-", "_")
+    return PRINTER_PREFIX + str(printer_uuid).replace("-", "_")
+
+
+def uuid_from_name(name):
+    """The reverse of name_from_uuid."""
+
+    return str(name)[len(PRINTER_PREFIX):].replace("_", "-")
+
+
+def uuid_from_path(path):
+    """The reverse of path_from_uuid."""
+
+    return str(path)[len(PRINTER_PATH_PREFIX):].replace("_", "-")
     
 
 def list_printers():
@@ -65,3 +79,23 @@ def list_printers():
 
     return [str(v) for v in common.get_bus().list_names()
             if str(v).startswith("org.voxelpress.hardware.")]
+
+
+def host_name(index):
+    """Generates the DBUS namespace of a printer host process."""
+
+    return "org.voxelpress.host._%d" % int(index)
+
+
+def host_path(index):
+    """Generates the DBUS object path of a printer host process."""
+
+    return "/org/voxelpress/host/_%d" % int(index)
+
+
+def list_hosts():
+    """List the indices of all currently running printer hosts."""
+
+    prefix = "org.voxelpress.host._"
+    return [int(str(v)[len(prefix):]) for v in common.get_bus().list_names()
+            if str(v).startswith(prefix)]
@@ -16,35 +16,131 @@
 # along with Switchprint.  If not, see <http://www.gnu.org/licenses/>.
 
 
+"""The registry of printer drivers.
+
+Drivers are packages with a METADATA dictionary describing what they
+drive.  Those here are found by looking for packages in this
+directory; others may be installed separately and registered with a
+"switchprint.drivers" setuptools entry point naming the package:
+
+    entry_points = {
+        "switchprint.drivers" : [
+            "my_driver = my_package.my_driver",
+            ],
+        }
+
+Only a driver's package is imported to read its metadata, so it should
+keep its Driver class in a "driver" module within the package rather
+than importing it there.  The class is only imported when it is first
+asked for."""
+
+
 import os, glob
 
 
-def all_drivers():
-    """Returns a dictionary of available drivers and their metadata."""
+ENTRY_POINT_GROUP = "switchprint.drivers"
+
+
+class DriverEntry(object):
+    """A driver known to the registry."""
+
+    def __init__(self, name, package):
+        self.name = name
+        self.package = package
+        self.metadata = package.METADATA
+        self.__driver = None
+
+    def load(self):
+        """Returns the driver's Driver class, importing it if need
+        be."""
+
+        if self.__driver is None:
+            self.__driver = getattr(self.package, "Driver", None)
+            if self.__driver is None:
+                module = __import__(self.package.__name__ + ".driver",
+                                    fromlist=["Driver"])
+                self.__driver = module.Driver
+        return self.__driver
+
+
+class DriverRegistry(object):
+    """Every available driver, indexed by its metadata."""
+
+    def __init__(self):
+        self.drivers = {}
+        self.__index = {} # key -> value -> [driver names]
 
-    driver_dir = os.path.split(__file__)[0]
-    search = glob.glob(os.path.join(driver_dir, "*", "__init__.py"))
-    drivers = {}
-    
-    for found in search:
-        driver_path = os.path.split(found)[0]
-        driver_name = os.path.split(driver_path)[1]
-        imported = __import__("switchprint.workers.drivers."+driver_name,
-                          fromlist=["Driver", "METADATA"])
-        drivers[driver_name] = imported.METADATA
-        drivers[driver_name]["driver"] = imported.Driver
+    def add(self, name, package):
+        if name in self.drivers:
+            return
+        entry = DriverEntry(name, package)
+        self.drivers[name] = entry
+        for key, values in entry.metadata.items():
+            if not isinstance(values, (list, tuple)):
+                values = [values]
+            for value in values:
+                try:
+                    self.__index.setdefault(key, {}).setdefault(
+                        value, []).append(name)
+                except TypeError:
+                    pass # unhashable, so can't be searched for
 
-    return drivers
+    def find(self, key, value):
+        """Returns the entries of the drivers whose metadata has 'value'
+        for 'key', or has it amongst a list of values, by name."""
+
+        names = self.__index.get(key, {}).get(value, [])
+        return dict((name, self.drivers[name]) for name in names)
+
+    def scan(self):
+        """Adds the drivers in this directory, then those registered
+        by entry points."""
+
+        driver_dir = os.path.split(__file__)[0]
+        search = glob.glob(os.path.join(driver_dir, "*", "__init__.py"))
+        for found in sorted(search):
+            driver_path = os.path.split(found)[0]
+            driver_name = os.path.split(driver_path)[1]
+            package = __import__("switchprint.workers.drivers." + driver_name,
+                                 fromlist=["METADATA"])
+            self.add(driver_name, package)
+
+        try:
+            import pkg_resources
+        except ImportError:
+            return
+        for entry_point in pkg_resources.iter_entry_points(ENTRY_POINT_GROUP):
+            try:
+                package = entry_point.load()
+            except ImportError as error:
+                print "Unable to load driver %s: %s" % (entry_point.name, error)
+                continue
+            self.add(entry_point.name, package)
+
+
+__registry = None
+
+
+def registry():
+    """Returns the registry, built on first use."""
+
+    global __registry
+    if __registry is None:
+        __registry = DriverRegistry()
+        __registry.scan()
+    return __registry
+
+
+def all_drivers():
+    """Returns a dictionary of available drivers and their
+    metadata."""
+
+    return dict((name, entry.metadata)
+                for name, entry in registry().drivers.items())
 
 
 def find(key, value):
-    """Search for drivers based on their metadata dictionary."""
-
-    drivers = all_drivers()
-    found = {}
-    for name, meta in drivers.items():
-        if meta.has_key(key):
-            if meta[key] == value or meta[key].count(value):
-                found[name] = meta
-    
-    return found
+    """Search for drivers based on their metadata dictionary.  Returns
+    DriverEntry objects by name."""
+
+    return registry().find(key, value)
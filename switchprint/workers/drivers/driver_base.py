@@ -36,7 +36,40 @@ class DriverBase:
     def auto_detect(self, *args, **kargs):
         """Called by a hardware monitor durring a hardware connect
         event.  Return True if this driver claims the device.
-        This function should also set self.uuid."""
+        This function should also set self.uuid.  A device id may be
+        passed along, which stays the same for a device between
+        connections."""
+        raise NotImplementedError()
+
+    def adopt(self, device_id, *reconnect_args):
+        """Called on a fresh driver in a printer host process, to take
+        over a device another driver instance detected and let go of.
+        The arguments after 'device_id' are what that driver's
+        inform_reconnect returned.  Return True if the device is
+        connected.  See host.py."""
+        raise NotImplementedError()
+
+    def release(self):
+        """Lets go of the device without reporting the printer as
+        disconnected, so that a printer host may adopt it."""
+        raise NotImplementedError()
+
+    def send_batch(self, commands):
+        """Queues a list of (name, args) pairs as a single request,
+        where each name is that of one of the control functions
+        above, or "gcode" with raw gcode as its argument.  Returns the
+        number of lines queued."""
+        raise NotImplementedError()
+
+    def set_telemetry(self, max_rate, threshold):
+        """Limits how often the printer's telemetry is reported, and
+        how much a value must change to be reported again."""
+        raise NotImplementedError()
+
+    def get_history(self, since, fields):
+        """Returns the timestamps of the telemetry samples kept since
+        'since', and a dictionary of the samples' values for each of
+        'fields', or for every field if 'fields' is empty."""
         raise NotImplementedError()
 
     def inform_reconnect(self):
@@ -48,11 +81,19 @@ class DriverBase:
         function in it's driver instance."""
         raise NotImplementedError()
 
+    def prepare_reconnect(self):
+        """Called on the main loop before informed_reconnect.  This
+        causes the driver to disconnect from whatever device it thinks
+        it is connected to, keeping anything it will want again once
+        connect_events is called on the new one."""
+        raise NotImplementedError()
+
     def informed_reconnect(self, *args):
         """The arguments for this function should match what is
         returned by inform_reconnect.  This causes the driver to
-        disconnect from whatever device it thinks it is connected to,
-        and attach to whatever ostensibly new device is described."""
+        attach to whatever ostensibly new device is described.  It is
+        called in a thread of its own, since connecting may block, and
+        connect_events is called on the main loop once it returns."""
         raise NotImplementedError()
 
     def debug(self, command):
@@ -75,8 +116,32 @@ class DriverBase:
         temperature."""
         raise NotImplementedError()
         
+    def dump_trace(self):
+        """Returns the recent traffic with the printer as text, for
+        debugging."""
+        raise NotImplementedError()
+
+    def set_trace_level(self, level):
+        """Sets how much of the traffic with the printer is kept for
+        dump_trace; zero turns tracing off."""
+        raise NotImplementedError()
+
+    def start_capture(self, path):
+        """Starts recording everything sent to and received from the
+        printer to the file at 'path', for replay later."""
+        raise NotImplementedError()
+
+    def stop_capture(self):
+        raise NotImplementedError()
+
     def pdq_request_print(self, file_path):
         """Request to start a printer job.  This method is being added
         for demonstrational purposes, and does not implement features
         like queueing or validation.  USE AT OWN RISK"""
         raise NotImplementedError()
+
+    def pdq_resume_print(self):
+        """Resume a print job that was interrupted, eg by the printer
+        being disconnected, from where it left off.  Returns False if
+        there is no such job."""
+        raise NotImplementedError()
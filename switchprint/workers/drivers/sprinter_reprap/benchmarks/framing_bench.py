@@ -0,0 +1,91 @@
+
+
+# This file is part of Switchprint.
+#
+# Switchprint is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Switchprint is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Switchprint.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Compares the line numbering and checksum stage against the
+per-line wrapping StreamCache used to do on the send path.
+
+Run with:
+$ python -m switchprint.workers.drivers.sprinter_reprap.benchmarks.framing_bench
+"""
+
+
+import time
+from .. import framing
+
+
+def legacy_wrap(num, line):
+    """StreamCache.__wrap as it was before the framing stage."""
+    numbered = "N{0} {1}".format(num, line.strip())
+    checksum = reduce(lambda x, y:x^y, map(ord, numbered))
+    return num, numbered + "*{0}\n".format(checksum)
+
+
+def synthetic_job(count):
+    """Returns 'count' lines of plausible slicer output."""
+    return ["G1 X%.3f Y%.3f E%.5f" % (i*0.013, i*0.029, i*0.00071)
+            for i in range(count)]
+
+
+def bench_legacy(lines):
+    start = time.time()
+    for num, line in enumerate(lines):
+        legacy_wrap(num+1, line)
+    return time.time() - start
+
+
+def bench_framing(lines, batch=100):
+    """Encodes in batches the way print_step feeds the cache, then
+    frames each line as it enters the send window."""
+    start = time.time()
+    num = 0
+    for i in range(0, len(lines), batch):
+        for body, body_sum in framing.encode(lines[i:i+batch]):
+            num += 1
+            framing.frame(num, body, body_sum)
+    return time.time() - start
+
+
+def bench_send_path(lines):
+    """Just the part of the framing stage left on the send path."""
+    encoded = framing.encode(lines)
+    start = time.time()
+    for num, (body, body_sum) in enumerate(encoded):
+        framing.frame(num+1, body, body_sum)
+    return time.time() - start
+
+
+def main(count=200000):
+    lines = synthetic_job(count)
+    results = [("legacy __wrap", bench_legacy(lines)),
+               ("encode + frame", bench_framing(lines)),
+               ("frame only (send path)", bench_send_path(lines))]
+    if framing.numpy is not None:
+        hold = framing.numpy
+        framing.numpy = None
+        try:
+            results.append(("encode + frame, no numpy", bench_framing(lines)))
+        finally:
+            framing.numpy = hold
+
+    print "%d lines" % count
+    for name, seconds in results:
+        print "  %-28s %8.3fs  %10.0f lines/s" % (name, seconds, count/seconds)
+
+
+if __name__ == "__main__":
+    main()
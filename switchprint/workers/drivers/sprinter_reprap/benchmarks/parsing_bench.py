@@ -0,0 +1,113 @@
+
+
+# This file is part of Switchprint.
+#
+# Switchprint is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Switchprint is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Switchprint.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Compares tokenize_response against the way SprinterProtocol used
+to look at each line of firmware output.
+
+Run with:
+$ python -m switchprint.workers.drivers.sprinter_reprap.benchmarks.parsing_bench [traffic]
+
+where 'traffic' is an optional file of recorded firmware output, one
+response per line.  Without it, a representative mix of Marlin output
+from a print is used.
+"""
+
+
+import sys, time
+from ..gcode_common import tokenize_response, parse_tool_temp, parse_bed_temp
+
+
+def sample_traffic(count=100000):
+    """Mostly acks, with the odd temperature report, busy message and
+    resend, roughly as seen while printing."""
+
+    traffic = []
+    for i in range(count):
+        if i % 500 == 0:
+            traffic.append(
+                "ok T:210.3 /210.0 B:60.1 /60.0 T0:210.3 /210.0 @:64 B@:0\n")
+        elif i % 997 == 0:
+            traffic.append("echo:busy: processing\n")
+        elif i % 5003 == 0:
+            traffic.append("Error:checksum mismatch, Last Line: %d\n" % i)
+            traffic.append("Resend: %d\n" % (i+1))
+        else:
+            traffic.append("ok\n")
+    return traffic
+
+
+def legacy_parse(results):
+    """The checks __advance and __process_response used to make."""
+
+    cut = 0
+    for result in results:
+        if result.startswith("ok"):
+            cut += 1
+        elif result.startswith("Resend"):
+            int(result.split(":")[-1].strip())
+    for line in results:
+        simple = line.lower().strip()
+        if simple.startswith("echo:"):
+            if simple.count("active extruder:"):
+                int(simple.split(":")[-1].strip())
+        elif line.startswith("Error"):
+            pass
+        elif line.startswith("DEBUG_"):
+            pass
+        else:
+            parse_tool_temp(simple)
+            parse_bed_temp(simple)
+    return cut
+
+
+def tokenized_parse(results):
+    cut = 0
+    for result in results:
+        for event in tokenize_response(result):
+            if event[0] == "ok":
+                cut += 1
+    return cut
+
+
+def bench(parse, traffic, batch=4):
+    """Feeds the traffic through in batches, like successive reads of
+    the serial port."""
+
+    start = time.time()
+    for i in range(0, len(traffic), batch):
+        parse(traffic[i:i+batch])
+    return time.time() - start
+
+
+def main(argv):
+    if len(argv) > 1:
+        with open(argv[1], "r") as src:
+            traffic = src.readlines()
+    else:
+        traffic = sample_traffic()
+
+    print "%d lines of firmware output" % len(traffic)
+    for name, parse in (("legacy", legacy_parse),
+                        ("tokenize_response", tokenized_parse)):
+        seconds = bench(parse, traffic)
+        print "  %-20s %8.3fs  %10.0f lines/s" % (
+            name, seconds, len(traffic)/seconds)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,62 @@
+
+
+# This file is part of Switchprint.
+#
+# Switchprint is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Switchprint is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Switchprint.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Replays serial captures against SprinterProtocol as fast as
+possible, to time flow control, resend handling and response parsing
+on real traffic.
+
+Run with:
+$ python -m switchprint.workers.drivers.sprinter_reprap.benchmarks.replay_bench [capture ...]
+
+Captures are recorded with the start_capture D-Bus method, and trace
+dumps work too.  Without any, the captures from the tests are used.
+"""
+
+
+import os, sys, time
+from ..replay import load_capture, replay
+
+
+TEST_CAPTURES = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)), "tests", "captures")
+
+
+def bench(entries, rounds):
+    start = time.time()
+    for i in range(rounds):
+        connection = replay(entries)
+    return time.time() - start, connection
+
+
+def main(argv):
+    paths = argv[1:] or [os.path.join(TEST_CAPTURES, i)
+                         for i in sorted(os.listdir(TEST_CAPTURES))]
+    for path in paths:
+        entries = load_capture(path)
+        frames = len([i for i in entries if i[1] in ("tx", "rx")])
+        rounds = max(1, 100000 / max(frames, 1))
+        seconds, connection = bench(entries, rounds)
+        diverged = connection.divergence()
+        print "%s: %d frames x %d" % (os.path.basename(path), frames, rounds)
+        print "  %8.3fs  %10.0f frames/s  %s" % (
+            seconds, frames*rounds/seconds,
+            "matches" if diverged is None else "diverged at %d" % diverged)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,322 @@
+
+
+# This file is part of Switchprint.
+#
+# Switchprint is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Switchprint is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Switchprint.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Throughput of the sprinter_reprap stack, checked against stored
+baselines.
+
+Run with:
+$ python -m switchprint.workers.drivers.sprinter_reprap.benchmarks.suite [options]
+
+Each case reports lines per second and host CPU time per line, and
+the results are printed as json.  With --save, they become the new
+baseline; otherwise any case costing more than --threshold (default
+25%) more per line than its baseline is reported as a regression, and
+the exit status is 1.  Costs are compared relative to a calibration
+loop run alongside each case, which takes out most of the difference
+between machines and between runs, but baselines are best saved on
+the machine the suite is run on.
+
+By default the G-code is synthetic.  --gcode uses a sliced file
+instead, and captures from the tests (or --capture) are replayed.
+"""
+
+
+import os, sys, json, time, platform
+import argparse
+from ..protocol import StreamCache, SprinterProtocol
+from ..gcode_common import clean, parse_tool_temp, parse_bed_temp, \
+    parse_capabilities, tokenize_response
+from ..replay import load_capture, replay
+from switchprint.workers.drivers.capabilities import FFFInfo
+
+
+HERE = os.path.dirname(__file__)
+BASELINES = os.path.join(HERE, "baselines.json")
+TEST_CAPTURES = os.path.join(os.path.dirname(HERE), "tests", "captures")
+
+# Lines between injected resends, for the cases that have them.
+RESEND_INTERVAL = 200
+
+
+def synthetic_gcode(count):
+    """Returns 'count' lines of plausible slicer output as text, with
+    the odd comment and layer change."""
+
+    soup = ["; generated by the benchmark suite", "G21", "G90", "M82",
+            "G28", "G92 E0"]
+    for i in range(count - len(soup)):
+        if i % 500 == 0:
+            soup.append("G1 Z%.2f F3000 ; layer %d" % (0.2 + i/500*0.2, i/500))
+        elif i % 37 == 0:
+            soup.append("G1 F1800 X%.3f Y%.3f" % (i*0.011 % 200, i*0.017 % 200))
+        else:
+            soup.append("G1 X%.3f Y%.3f E%.5f" % (
+                i*0.013 % 200, i*0.029 % 200, i*0.00071))
+    return "\n".join(soup) + "\n"
+
+
+def firmware_traffic(count):
+    """Mostly acks, with the odd temperature report and resend."""
+
+    traffic = []
+    for i in range(count):
+        if i % 500 == 0:
+            traffic.append(
+                "ok T:210.3 /210.0 B:60.1 /60.0 T0:210.3 /210.0 @:64 B@:0\n")
+        elif i % 997 == 0:
+            traffic.append("echo:busy: processing\n")
+        elif i % RESEND_INTERVAL == 0:
+            traffic.append("Error:checksum mismatch, Last Line: %d\n" % i)
+            traffic.append("Resend: %d\n" % (i+1))
+        else:
+            traffic.append("ok\n")
+    return traffic
+
+
+class LoopbackSerial(object):
+    """Firmware that runs every line the moment it is written, as far
+    as SprinterProtocol can tell.  If 'resend_interval' is set, every
+    so many lines one is answered with a checksum error, and the rest
+    of that write is dropped the way Marlin flushes its buffer."""
+
+    def __init__(self, resend_interval=None):
+        self.info = FFFInfo()
+        self.reported = {}
+        self.resend_interval = resend_interval
+        self.expected = 1
+        self.__failed = set()
+        self.__responses = []
+
+    def write(self, data):
+        for frame in data.splitlines():
+            num = int(frame[1:frame.index(" ")])
+            if num != self.expected:
+                continue
+            if self.resend_interval and num % self.resend_interval == 0 \
+               and num not in self.__failed:
+                self.__failed.add(num)
+                self.__responses += [
+                    "Error:checksum mismatch, Last Line: %d\n" % (num-1),
+                    "Resend: %d\n" % num, "ok\n"]
+                break
+            self.expected += 1
+            self.__responses.append("ok\n")
+
+    def inWaiting(self):
+        return len(self.__responses)
+
+    def readlines(self):
+        responses, self.__responses = self.__responses, []
+        return responses
+
+
+# Each round repeats a case until it has taken at least this much CPU
+# time, so that small cases still measure something.
+MIN_ROUND = 0.2
+
+
+def calibrate(count=20000):
+    """Returns the CPU time taken by a small, fixed bit of work much
+    like what the cases do, in microseconds.  The speed of a machine can
+    drift between runs and even within one, so each case is also
+    reported relative to this, and that is what's compared against
+    the baseline."""
+
+    start = time.clock()
+    counts = {}
+    for i in xrange(count):
+        line = "N%d G1 X%.3f" % (i, i * 0.013)
+        counts[line[-1]] = counts.get(line[-1], 0) + len(line.split(" "))
+    return (time.clock() - start) * 1e6 / count
+
+
+def measure(run, rounds):
+    """Calls 'run', which returns the number of lines it handled,
+    for 'rounds' rounds and keeps the fastest relative to the
+    calibration done alongside each round."""
+
+    best = None
+    for i in range(rounds):
+        calibration = min(calibrate(), calibrate())
+        lines = 0
+        wall, cpu = time.time(), time.clock()
+        while time.clock() - cpu < MIN_ROUND:
+            lines += run()
+        wall, cpu = time.time() - wall, time.clock() - cpu
+        relative = cpu * 1e6 / lines / calibration
+        if best is None or relative < best[0]:
+            best = (relative, lines, wall, cpu)
+    relative, lines, wall, cpu = best
+    return {
+        "lines" : lines,
+        "seconds" : round(wall, 4),
+        "lines_per_sec" : round(lines / wall),
+        "cpu_us_per_line" : round(cpu * 1e6 / lines, 3),
+        "relative_cost" : round(relative, 3),
+        }
+
+
+def cache_case(soup, resend_interval=None):
+    """StreamCache.feed and nudge, acknowledging a window at a time."""
+
+    def run():
+        cache = StreamCache()
+        lines = clean(soup)
+        cache.feed(lines)
+        cache.nudge()
+        failed = set()
+        while not cache.get_idle():
+            first = cache.send_buffer[0][0]
+            if resend_interval and first % resend_interval == 0 \
+               and first not in failed:
+                failed.add(first)
+                cache.nudge(req_num=first)
+            else:
+                cache.nudge(erase=len(cache.send_buffer))
+        return len(lines)
+    return run
+
+
+def protocol_case(soup, resend_interval=None):
+    """SprinterProtocol.__advance, against firmware that answers
+    instantly."""
+
+    def run():
+        serial = LoopbackSerial(resend_interval)
+        proto = SprinterProtocol(serial, None)
+        proto.trace.level = 0
+        lines = clean(soup)
+        proto.request(lines)
+        while proto.buffer_status() != "idle":
+            proto.execute_requests()
+        return len(lines)
+    return run
+
+
+def clean_case(soup):
+    def run():
+        return len(clean(soup))
+    return run
+
+
+def parse_case(traffic):
+    """The firmware output as SprinterProtocol tokenizes it, plus the
+    older parsing functions used when connecting."""
+
+    def run():
+        for line in traffic:
+            tokenize_response(line)
+            parse_tool_temp(line)
+            parse_bed_temp(line)
+        parse_capabilities("FIRMWARE_NAME:Marlin 1.1.9 PROTOCOL_VERSION:1.0 "
+                           "MACHINE_TYPE:Virtual EXTRUDER_COUNT:1")
+        return len(traffic)
+    return run
+
+
+def replay_case(entries):
+    def run():
+        replay(entries)
+        return len([i for i in entries if i[1] in ("tx", "rx")])
+    return run
+
+
+def cases(gcode=None, captures=()):
+    """Returns (name, run) for every case in the suite."""
+
+    source = "synthetic"
+    soup = synthetic_gcode(50000)
+    if gcode:
+        source = os.path.splitext(os.path.basename(gcode))[0]
+        with open(gcode, "r") as src:
+            soup = src.read()
+    found = [
+        ("cache.%s" % source, cache_case(soup)),
+        ("cache.%s.resends" % source, cache_case(soup, RESEND_INTERVAL)),
+        ("protocol.%s" % source, protocol_case(soup)),
+        ("protocol.%s.resends" % source,
+         protocol_case(soup, RESEND_INTERVAL)),
+        ("clean.%s" % source, clean_case(soup)),
+        ("parse.synthetic", parse_case(firmware_traffic(50000))),
+        ]
+    for path in captures:
+        name = os.path.splitext(os.path.basename(path))[0]
+        found.append(("replay.%s" % name, replay_case(load_capture(path))))
+    return found
+
+
+def compare(results, baselines, threshold):
+    """Returns a list of (name, baseline, result) for every case that
+    costs more per line, relative to the calibration, than its
+    baseline allows."""
+
+    regressions = []
+    for name, result in sorted(results.items()):
+        if name not in baselines:
+            continue
+        baseline = baselines[name]["relative_cost"]
+        if result["relative_cost"] > baseline * (1 + threshold):
+            regressions.append((name, baseline, result["relative_cost"]))
+    return regressions
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description="Benchmarks the sprinter_reprap stack.")
+    parser.add_argument("--gcode", help="sliced file to use as the job")
+    parser.add_argument("--capture", action="append", default=[],
+                        help="serial capture to replay; may be repeated")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--baseline", default=BASELINES)
+    parser.add_argument("--threshold", type=float, default=0.25)
+    parser.add_argument("--save", action="store_true",
+                        help="store the results as the baseline")
+    args = parser.parse_args(argv[1:])
+
+    captures = args.capture or [
+        os.path.join(TEST_CAPTURES, i) for i in sorted(os.listdir(TEST_CAPTURES))]
+    results = {}
+    for name, run in cases(args.gcode, captures):
+        results[name] = measure(run, args.rounds)
+
+    report = {
+        "python" : platform.python_version(),
+        "machine" : platform.machine(),
+        "results" : results,
+        }
+    print json.dumps(report, indent=2, sort_keys=True)
+
+    if args.save:
+        with open(args.baseline, "w") as out:
+            json.dump(report, out, indent=2, sort_keys=True)
+            out.write("\n")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        return 0
+    with open(args.baseline, "r") as src:
+        baselines = json.load(src)["results"]
+    regressions = compare(results, baselines, args.threshold)
+    for name, baseline, result in regressions:
+        sys.stderr.write("REGRESSION %s: relative cost %.3f, baseline %.3f\n"
+                         % (name, result, baseline))
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,117 @@
+
+
+# This file is part of Switchprint.
+#
+# Switchprint is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Switchprint is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Switchprint.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os, json
+from switchprint.common import get_config_path
+
+
+def checkpoint_path(printer_uuid):
+    """Returns the path where checkpoints for the given printer are
+    kept."""
+
+    checkpoint_dir = os.path.join(get_config_path(), "checkpoints")
+    if not os.path.isdir(checkpoint_dir):
+        os.mkdir(checkpoint_dir)
+    return os.path.join(checkpoint_dir, str(printer_uuid) + ".json")
+
+
+def save_checkpoint(path, checkpoint):
+    """Writes out a checkpoint.  The old checkpoint is only replaced
+    once the new one is completely written."""
+
+    temp_path = path + ".new"
+    with open(temp_path, "w") as out:
+        json.dump(checkpoint, out)
+    os.rename(temp_path, path)
+
+
+def load_checkpoint(path):
+    """Returns the checkpoint stored at 'path', or None if there
+    isn't a usable one."""
+
+    try:
+        with open(path, "r") as src:
+            return json.load(src)
+    except (IOError, ValueError):
+        return None
+
+
+def clear_checkpoint(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def find_resume_position(job, line):
+    """Scans backwards through a prepared job from 'line' to find the
+    last Z, E and F values given to the printer before it.  Returns a
+    dictionary with whichever of the keys 'Z', 'E' and 'F' were
+    found."""
+
+    found = {}
+    for num in range(min(line, len(job))-1, -1, -1):
+        command = job.line(num)
+        if not command.startswith(("G0 ", "G1 ", "G92 ")):
+            continue
+        for param in command.split()[1:]:
+            if param[:1] in "ZEF" and param[:1] not in found:
+                try:
+                    found[param[0]] = float(param[1:])
+                except ValueError:
+                    pass
+        if len(found) == 3:
+            break
+    return found
+
+
+def resume_gcode(checkpoint, position):
+    """Generates the commands needed to bring a freshly reset printer
+    back to the state described by 'checkpoint', with the axes at
+    'position' as returned by find_resume_position.  X and Y are
+    homed; Z is assumed not to have moved, since homing it would drive
+    the nozzle into the print, so its position is set with G92 before
+    anything moves."""
+
+    soup = []
+    bed = checkpoint["targets"]["b"]
+    tools = checkpoint["targets"]["t"]
+    if bed:
+        soup.append("M140 S%s" % bed)
+    for tool, target in enumerate(tools):
+        if target:
+            soup.append("M104 T%d S%s" % (tool, target))
+    if bed:
+        soup.append("M190 S%s" % bed)
+    for tool, target in enumerate(tools):
+        if target:
+            soup.append("M109 T%d S%s" % (tool, target))
+    if len(tools) > 1:
+        soup.append("T%d" % checkpoint["tool"])
+
+    soup.append("G90")
+    axes = ["Z%s" % position["Z"]] if "Z" in position else []
+    if "E" in position and not checkpoint["relative_extrusion"]:
+        axes.append("E%s" % position["E"])
+    if axes:
+        soup.append("G92 " + " ".join(axes))
+    soup.append("G28 X0 Y0")
+    soup.append("M83" if checkpoint["relative_extrusion"] else "M82")
+    if "F" in position:
+        soup.append("G1 F%s" % position["F"])
+    if checkpoint["relative"]:
+        soup.append("G91")
+    return "\n".join(soup)
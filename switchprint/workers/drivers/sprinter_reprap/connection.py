@@ -20,7 +20,52 @@ import sys, os, time
 import textwrap
 import serial
 from switchprint.workers.drivers.capabilities import FFFInfo
-from gcode_common import parse_capabilities, parse_bed_temp
+from gcode_common import parse_capabilities, parse_bed_temp, \
+    tokenize_response
+
+
+# Baud rates to try, most commonly used first.
+BAUDS = (115200, 250000, 57600, 38400, 19200, 9600, 2400)
+
+# Firmware that is already running answers a probe within a few
+# milliseconds, so every rate is first given a short time to answer,
+# twice over in case the board was reset by the port being opened and
+# needed time to boot.  Only then is each rate tried the slow way,
+# resetting the board and waiting for it to boot, and not at all if
+# the port stayed silent for longer than a board takes to boot.
+# However the port behaves, detection gives up once it has taken as
+# long as resetting the board at every rate would.
+QUICK_TIMEOUT = 0.4
+QUICK_PASSES = 2
+BOOT_TIMEOUT = 5
+
+# How long DTR is held to reset the board.
+RESET_TIME = 0.2
+
+# Sent until the firmware answers.  The leading newline ends whatever
+# the firmware might have half read, and M110 is answered with an ok.
+PROBE = "\nM110 N0\n"
+PROBE_INTERVAL = 0.25
+
+# A device with a stored profile is asked for its M115 report at the
+# rate it was last seen at, and given long enough to boot.
+CONFIRM_PROBE = "\nM115\n"
+CONFIRM_TIMEOUT = 2
+
+# Reading at the wrong baud rate gives mostly unprintable bytes.
+GARBAGE_SAMPLE = 16
+GARBAGE_RATIO = 0.25
+PRINTABLE = "\r\n\t" + "".join([chr(i) for i in range(32, 127)])
+
+
+def looks_like_garbage(data):
+    """Returns True if 'data' is unlikely to be text sent at the baud
+    rate it was read at."""
+
+    if len(data) < GARBAGE_SAMPLE:
+        return False
+    unprintable = len(data.translate(None, PRINTABLE))
+    return unprintable > len(data) * GARBAGE_RATIO
 
 
 class ConnectionException(Exception):
@@ -31,40 +76,49 @@ class SerialConnection:
     """Consolidates code pertaining to connecting to the serial port
     and some auto detection capabilities."""
 
-    def __init__(self, port, baud=None):
+    def __init__(self, port, baud=None, profile=None):
         self.__s = None
         self.__port = None
         self.__baud = None
+        self.__partial = ""
+        # True once anything at all has been read while probing
+        self.__heard = False
         self.post = ""
         self.reported = {}
         self.info = FFFInfo()
+        # True if the printer matched the profile it was connected with
+        self.confirmed = False
 
-        bauds = (250000, 115200, 57600, 38400, 19200, 9600, 2400)
-        assert baud in bauds or baud is None
+        assert baud in BAUDS or baud is None
 
         self.__control_ttyhup(port, True)
         error = None
-        if baud:
-            connected = self.__setup_port(port, baud)
+        connected = False
+        if profile and baud in (None, profile["baud"]):
+            connected = self.confirmed = self.__confirm(port, profile)
+        if connected:
+            pass
+        elif baud:
+            connected = self.__auto_detect(port, [baud])
             if not connected:
                 error = """
                 Initialization Error: Unable to initialize a
                 connection with manually provided parameters."""
         else:
-            connected = self.__auto_detect(port, bauds)
+            connected = self.__auto_detect(port, BAUDS)
             if not connected:
                 error = """
                 Initialization Error: SprinterProtocol's autodetection
                 capabilities failed to initialize the printer."""
-            else:
-                try:
-                    self.info.tools = int(self.reported["extruder_count"])
-                except KeyError:
-                    pass
-                try:
-                    self.info.heated_bed = self.reported["heated_bed"]
-                except KeyError:
-                    pass
+        if connected:
+            try:
+                self.info.tools = int(self.reported["extruder_count"])
+            except (KeyError, ValueError):
+                pass
+            try:
+                self.info.heated_bed = self.reported["heated_bed"]
+            except KeyError:
+                pass
         if error:
             error = textwrap.dedent(error).strip()
             error = textwrap.fill(error)
@@ -83,50 +137,169 @@ class SerialConnection:
         else:
             return False
 
+    def profile(self):
+        """Returns what was found out about the printer while
+        connecting, to be stored and passed back in as 'profile' the
+        next time it is connected."""
+
+        return {
+            "baud" : self.__baud,
+            "post" : self.post,
+            "reported" : self.reported,
+            "info" : vars(self.info),
+            }
+
+    def fileno(self):
+        """Returns the file descriptor of the serial port, so that it
+        may be watched by the main loop."""
+        return self.__s.fileno()
+
     def write(self, data):
         return self.__s.write(data)
 
     def readlines(self):
-        return self.__s.readlines()
+        """Returns the complete lines waiting on the serial port.  A
+        trailing partial line is held back until the rest of it
+        arrives."""
+
+        data = self.__partial + self.__s.read(self.__s.inWaiting())
+        lines = data.split("\n")
+        self.__partial = lines.pop()
+        return [line + "\n" for line in lines]
 
     def inWaiting(self):
         return self.__s.inWaiting()
 
     def __auto_detect(self, port, bauds):
         """Try to detect the appropriate baud rate for the printer."""
-        for baud in bauds:
+
+        start = time.time()
+        deadline = start + len(bauds) * (RESET_TIME + BOOT_TIMEOUT)
+        attempts = [(baud, False, QUICK_TIMEOUT) for baud in bauds]
+        attempts = attempts * QUICK_PASSES + \
+                   [(baud, True, BOOT_TIMEOUT) for baud in bauds]
+        for baud, reset, timeout in attempts:
+            now = time.time()
+            if reset and not self.__heard and now - start >= BOOT_TIMEOUT:
+                # a board reset by the port being opened would have
+                # said something by now, so nothing is listening
+                break
+            if reset:
+                timeout = min(timeout, deadline - now - RESET_TIME)
+            else:
+                timeout = min(timeout, deadline - now)
+            if timeout <= 0:
+                break
             try:
-                connected = self.__setup_port(port, baud)
-                if connected:
+                if self.__setup_port(port, baud, reset, timeout):
                     return True
             except ValueError:
                 continue
             except IOError:
                 continue
+        if self.__s:
+            self.__s.close()
+            self.__s = None
+        return False
 
-    def __setup_port(self, port, baud):
+    def __setup_port(self, port, baud, reset, timeout):
         """Connect to the serial port and divine some information."""
+        if self.__s:
+            self.__s.close()
         self.__s = serial.Serial(port, baud, timeout=0)
-        self.__reset()
-        giveup = 20 # poll the device for about five seconds before giving in
-        post = ""
-        while post == "" and giveup > 0:
-            # wait for the device to boot
-            time.sleep(.25)
-            post = "\n".join(self.__s.readlines()).strip()
-            giveup -= 1
+        if reset:
+            self.__reset()
+        post = self.__probe(timeout)
+        if post is None:
+            return False
+        self.post = post
+        soup = "\n".join(self.__querie("M115"))
+        self.reported = parse_capabilities(soup)
+        firmware = (post + str(self.reported.get("firmware_name"))).lower()
         for trigger in ("sprinter", "marlin"):
-            if post.lower().count(trigger):
+            if firmware.count(trigger):
                 self.__port = port
                 self.__baud = baud
-                self.post = post
-                soup = self.__querie("M115")[0]
-                self.reported = parse_capabilities(soup)
                 temp = parse_bed_temp(self.__querie("M105")[0])
                 self.reported["heated_bed"] = temp is not None
                 return True
         return False
 
+    def __confirm(self, port, profile):
+        """Checks with a single M115 that the printer on 'port' is the
+        one 'profile' was made for, at the rate it was last seen at.
+        If so, what the profile says about the printer is used rather
+        than probing for it again."""
+
+        try:
+            if self.__s:
+                self.__s.close()
+            self.__s = serial.Serial(port, profile["baud"], timeout=0)
+            answer = self.__probe(CONFIRM_TIMEOUT, CONFIRM_PROBE)
+        except (ValueError, IOError):
+            return False
+        if answer is None:
+            return False
+        if not answer.count("FIRMWARE_NAME:"):
+            return False
+        reported = parse_capabilities(answer)
+        cached = profile.get("reported", {})
+        if reported.get("firmware_name") != cached.get("firmware_name"):
+            return False
+        self.reported = dict(cached)
+        self.reported.update(reported)
+        self.post = profile.get("post", "")
+        self.__port = port
+        self.__baud = profile["baud"]
+        return True
+
+    def __probe(self, timeout, probe=PROBE):
+        """Sends probes until the firmware answers one, what comes back
+        is clearly garbage, or 'timeout' seconds pass.  Returns
+        whatever the firmware printed before it answered, which is
+        usually its boot banner, or None if it didn't answer."""
+
+        data = ""
+        now = time.time()
+        give_up = now + timeout
+        # however the board behaves, it gets no longer than this
+        limit = now + timeout + BOOT_TIMEOUT
+        booted = False
+        next_probe = now
+        while now < min(give_up, limit):
+            if now >= next_probe:
+                self.__s.write(probe)
+                next_probe = now + PROBE_INTERVAL
+            data += self.__s.read(self.__s.inWaiting())
+            if data:
+                self.__heard = True
+            if looks_like_garbage(data):
+                return None
+            lines = data.split("\n")
+            for num, line in enumerate(lines[:-1]):
+                if tokenize_response(line)[0][0] == "ok":
+                    self.__drain()
+                    return "\n".join(lines[:num]).strip()
+                elif line.strip() == "start" and not booted:
+                    # the board just booted at this rate; give it time
+                    # to answer, but only the once
+                    booted = True
+                    give_up = max(give_up, now + BOOT_TIMEOUT)
+            time.sleep(0.01)
+            now = time.time()
+        return None
+
+    def __drain(self, quiet=0.1):
+        """Discards input until none has arrived for 'quiet' seconds,
+        so that the answers to any extra probes aren't mistaken for
+        answers to what is sent next."""
+
+        last_heard = time.time()
+        while time.time() - last_heard < quiet:
+            if self.__s.read(self.__s.inWaiting()):
+                last_heard = time.time()
+            time.sleep(0.01)
+
     def __querie(self, command):
         self.__s.write(command+"\n")
         data = []
@@ -151,8 +324,13 @@ class SerialConnection:
         really understanding what it does."""
 
         if self.__s:
-            self.__s.setDTR(1)
-            time.sleep(0.2)
+            try:
+                self.__s.setDTR(1)
+            except IOError:
+                # Pseudo-terminals, such as the one the firmware
+                # emulator provides, have no DTR line to toggle.
+                return
+            time.sleep(RESET_TIME)
             self.__s.setDTR(0)
 
     def __control_ttyhup(self, port, disable_hup):
@@ -0,0 +1,266 @@
+
+
+# This file is part of Switchprint.
+#
+# Switchprint is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Switchprint is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Switchprint.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import json, pickle, time
+from switchprint.workers.drivers.driver_base import DriverBase
+from connection import SerialConnection, ConnectionException
+from monitor import SprinterMonitor
+from replay import RecordingConnection
+from printer_profile import load_profile, save_profile
+from gcode_common import clean
+
+
+def home_gcode(x_axis=False, y_axis=False, z_axis=False):
+    cmd = ["G28"]
+    if x_axis:
+        cmd.append("X0")
+    if y_axis:
+        cmd.append("Y0")
+    if z_axis:
+        cmd.append("Z0")
+    return " ".join(cmd)
+
+
+def move_gcode(x=0, y=0, z=0):
+    return "G0 X{0} Y{1} Z{2}".format(x, y, z)
+
+
+def tool_temp_gcode(tool, target):
+    return "T{0}\nM104 S{1}".format(tool, target)
+
+
+def bed_temp_gcode(target):
+    return "M140 S{0}".format(target)
+
+
+# The commands send_batch understands, and the gcode for each.
+BATCH_COMMANDS = {
+    "home" : home_gcode,
+    "relative_mode" : lambda: "G91",
+    "absolute_mode" : lambda: "G90",
+    "move" : move_gcode,
+    "motors_off" : lambda: "M84",
+    "set_tool_temp" : tool_temp_gcode,
+    "set_bed_temp" : bed_temp_gcode,
+    "gcode" : lambda soup: str(soup),
+    }
+
+
+class Driver(DriverBase):
+    """Driver for reprap-style printers running the sprinter
+    firmware."""
+
+    def __init__(self):
+        self.serial = None
+        self.monitor = None
+        self.recorder = None
+        self.device_id = None
+        self.__signals = None
+        # what prepare_reconnect kept of the last connection
+        self.__carried = None
+
+    def get_class_info(self):
+        """Returns a PrinterClassInfo object, as defined in
+        capabilities.py"""
+
+        return self.serial.info
+
+    def connect_events(self, server):
+        """Called when the driver is attached to a print server, so
+        that the driver may call signals on the server object."""
+
+        self.__signals = server
+        if self.device_id:
+            profile = self.serial.profile()
+            profile["uuid"] = server.uuid
+            try:
+                save_profile(self.device_id, profile)
+            except (IOError, OSError):
+                pass
+        self.recorder = RecordingConnection(self.serial)
+        self.monitor = SprinterMonitor(self.recorder, server)
+        if self.__carried:
+            trace, telemetry, history, checkpoint = self.__carried
+            self.__carried = None
+            self.monitor.proto.trace = trace
+            self.monitor.proto.cache.trace = trace
+            self.monitor.telemetry = telemetry
+            self.monitor.history = history
+            if checkpoint:
+                self.monitor.hold_print(checkpoint)
+        
+    def auto_detect(self, port, device_id=None):
+        """Called by a hardware monitor durring a hardware connect
+        event.  Return True if this driver claims the device.
+        This function should also set self.uuid.
+
+        If 'device_id' is given and a profile was stored for it the
+        last time it was connected, the printer is only asked to
+        confirm it is still what the profile describes, and keeps the
+        uuid it had then."""
+
+        profile = load_profile(device_id) if device_id else None
+        try:
+            self.serial = SerialConnection(port, profile=profile)
+            self.info = pickle.dumps(self.serial.info) ### HACK
+        except ConnectionException:
+            return False
+        self.device_id = device_id
+        if self.serial.confirmed and profile.get("uuid"):
+            self.uuid = profile["uuid"]
+        return True
+
+    def adopt(self, device_id, port, baud):
+        """Connects to a device another driver instance detected, at
+        the rate it found, so a printer host needn't probe it."""
+
+        profile = load_profile(device_id) if device_id else None
+        try:
+            self.serial = SerialConnection(port, baud, profile)
+            self.info = pickle.dumps(self.serial.info) ### HACK
+        except ConnectionException:
+            return False
+        self.device_id = device_id
+        return True
+
+    def release(self):
+        if self.monitor:
+            self.monitor.close()
+            self.recorder.stop_capture()
+            self.monitor = None
+        if self.serial:
+            self.serial.close()
+            self.serial = None
+
+    def inform_reconnect(self):
+        """This function is called by a worker subprocess when a
+        driver is detected, but the corresponding printer object
+        already exists.  In which case, this function should return a
+        simple argument list which can be pushed to the already
+        existing service, so that it may call the informed_reconnect
+        function in it's driver instance."""
+        return self.serial.connection_info()
+
+    def prepare_reconnect(self):
+        """Called on the main loop before informed_reconnect.  Lets go
+        of the device, keeping the trace, the telemetry and where any
+        print got to for connect_events to carry on with."""
+
+        if self.monitor:
+            # keep the trace going across the reconnect, since
+            # whatever led up to it is usually what's wanted
+            checkpoint = None
+            if self.monitor.printer_state == "printing" and \
+               self.monitor.job is not None:
+                # the printer has most likely been reset, so hold on
+                # to where the job got to until asked to resume it
+                checkpoint = self.monitor.checkpoint()
+            self.__carried = (self.monitor.proto.trace,
+                              self.monitor.telemetry,
+                              self.monitor.history, checkpoint)
+        self.release()
+
+    def informed_reconnect(self, port, baud):
+        """The arguments for this function should match what is
+        returned by inform_reconnect.  This causes the driver to
+        attach to whatever ostensibly new device is described.  It
+        blocks until the firmware answers, and doesn't touch the main
+        loop, so may be called from a thread of its own."""
+
+        profile = load_profile(self.device_id) if self.device_id else None
+        self.serial = SerialConnection(port, baud, profile)
+        self.info = pickle.dumps(self.serial.info) ### hack
+
+    #### printer control functions ###
+        
+
+    def home(self, x_axis=False, y_axis=False, z_axis=False):
+        """Moves the named axises until they trigger their
+        endstops."""
+
+        self.monitor.request(home_gcode(x_axis, y_axis, z_axis))
+
+    
+    def relative_mode(self):
+        self.monitor.request("G91")
+
+
+    def absolute_mode(self):
+        self.monitor.request("G90")
+
+
+    def move(self, x=0, y=0, z=0):
+        self.monitor.request(move_gcode(x, y, z))
+
+
+    def motors_off(self):
+        self.monitor.request("M84")
+
+
+    def set_tool_temp(self, tool, target):
+        """Requests the given tool to be set to the specified
+        temperature."""
+        #FIXME maybe there should be a monitor command for this so
+        #that it doesn't change the active tool?
+        self.monitor.request(tool_temp_gcode(tool, target))
+        
+    def set_bed_temp(self, target):
+        """Requests the print bed be set to the specified
+        temperature."""
+
+        self.monitor.request(bed_temp_gcode(target))
+
+    def send_batch(self, commands):
+        """Queues a list of (name, args) commands as one request, and
+        returns the number of lines queued.  Names are those of the
+        control functions above, or "gcode" for raw gcode.  Nothing is
+        queued if any command isn't understood."""
+
+        soup = []
+        for name, args in commands:
+            if name not in BATCH_COMMANDS:
+                raise ValueError("Unknown batch command: %s" % name)
+            soup += clean(BATCH_COMMANDS[name](*args))
+        if not soup:
+            return 0
+        return self.monitor.request("\n".join(soup))
+
+    def set_telemetry(self, max_rate, threshold):
+        self.monitor.telemetry.max_rate = max_rate
+        self.monitor.telemetry.threshold = threshold
+
+    def get_history(self, since, fields):
+        return self.monitor.history.query(since, fields)
+
+    def dump_trace(self):
+        return self.monitor.proto.trace.dump()
+
+    def set_trace_level(self, level):
+        self.monitor.proto.trace.level = level
+
+    def start_capture(self, path):
+        self.recorder.start_capture(path)
+
+    def stop_capture(self):
+        self.recorder.stop_capture()
+
+    def pdq_request_print(self, path):
+        self.monitor.print_file(path)
+
+    def pdq_resume_print(self):
+        return self.monitor.resume_print()
@@ -0,0 +1,453 @@
+
+
+# This file is part of Switchprint.
+#
+# Switchprint is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Switchprint is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Switchprint.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""A virtual Sprinter or Marlin printer on a pseudo-terminal, for
+testing the driver without any hardware.  SerialConnection can open
+the emulator's port like any other serial port.
+
+Run with:
+$ python -m switchprint.workers.drivers.sprinter_reprap.emulator [options]
+
+which prints the path of the port, and serves it until interrupted.
+This only works on Linux.
+"""
+
+
+import os, re, sys, time, errno, random, select, struct, fcntl, termios
+import argparse
+from collections import deque
+from threading import Thread
+from framing import checksum
+
+
+BANNERS = {
+    "marlin" : ["start", "echo:Marlin 1.1.9", "echo:Virtual printer"],
+    "sprinter" : ["start", "Sprinter", "Virtual printer"],
+    }
+
+# Linux specific, for reading speeds that termios has no constant for.
+TCGETS2 = 0x802C542A
+TERMIOS2 = "IIIIB19sII"
+BOTHER = 0o010000
+
+SPEEDS = dict([(getattr(termios, "B%d" % i), i) for i in (
+    2400, 9600, 19200, 38400, 57600, 115200, 230400, 460800)
+               if hasattr(termios, "B%d" % i)])
+
+# Marlin's default serial receive buffer, in bytes.
+RX_BUFFER_SIZE = 128
+
+FRAME = re.compile(r"^N(\d+)\s*(.*?)\s*\*(\d+)$")
+
+
+def host_baud(fd):
+    """Returns the baud rate the other end of the pseudo-terminal on
+    'fd' is set to."""
+
+    speed = termios.tcgetattr(fd)[5]
+    if speed == BOTHER:
+        termios2 = fcntl.ioctl(fd, TCGETS2, "\0"*struct.calcsize(TERMIOS2))
+        return struct.unpack(TERMIOS2, termios2)[-1]
+    return SPEEDS.get(speed)
+
+
+class VirtualPrinter(object):
+    """Emulates the serial side of reprap firmware.
+
+    The printer boots, printing its banner, whenever the port is
+    opened or its baud rate is changed.  If the baud rate doesn't
+    match, the printer can't make sense of what it is sent, and the
+    host can't make sense of what comes back.  Otherwise commands are
+    checked as Marlin does, and queued in a buffer of 'buffer_size'
+    commands.  Each command takes 'exec_time' seconds to run, after
+    which it is acknowledged.  Data moves no faster than the baud
+    rate allows, and each byte sent to the printer is corrupted with
+    the probability 'noise'."""
+
+    def __init__(self, flavor="marlin", baud=250000, buffer_size=4,
+                 exec_time=0.0, noise=0.0, tools=1, heated_bed=True,
+                 advanced_ok=False, rx_size=None, boot_time=0.2,
+                 seed=None, auto_report=False):
+        assert flavor in BANNERS
+        self.flavor = flavor
+        self.baud = baud
+        self.buffer_size = buffer_size
+        self.exec_time = exec_time
+        self.noise = noise
+        self.tools = tools
+        self.heated_bed = heated_bed
+        self.advanced_ok = advanced_ok
+        self.rx_size = rx_size
+        self.boot_time = boot_time
+        self.auto_report = auto_report
+        self.random = random.Random(seed)
+
+        # statistics
+        self.boots = 0
+        self.received = 0 # lines received
+        self.executed = 0 # commands executed
+        self.errors = 0 # lines rejected
+
+        self.__master, slave = os.openpty()
+        self.port = os.ttyname(slave)
+        # The emulator keeps no end of the slave open, so that it can
+        # tell when the port is opened and closed.
+        os.close(slave)
+        fcntl.fcntl(self.__master, fcntl.F_SETFL, os.O_NONBLOCK)
+        self.__poll = select.poll()
+        self.__poll.register(self.__master, select.POLLIN)
+        self.__thread = None
+        self.__running = False
+        self.__connected = False
+        self.__host_baud = None
+        self.__handlers = {
+            "M104" : lambda params: self.__set_tool_temp(params, False),
+            "M109" : lambda params: self.__set_tool_temp(params, True),
+            "M140" : lambda params: self.__set_bed_temp(params, False),
+            "M190" : lambda params: self.__set_bed_temp(params, True),
+            "M105" : self.__report_temps,
+            "M115" : self.__report_capabilities,
+            }
+        if auto_report:
+            self.__handlers["M155"] = self.__set_auto_report
+        self.__reset()
+
+    def __reset(self):
+        self.__booted_at = None
+        self.__rx = ""
+        self.__partial = False # drop input up to the next newline
+        self.__tx = ""
+        self.__queue = deque() # (line number, command)
+        self.__busy_until = 0
+        self.last_line = 0
+        # bytes each way that the baud rate allows to be moved now
+        self.__last_io = time.time()
+        self.__rx_credit = 0
+        self.__tx_credit = 0
+        self.tool = 0
+        self.temps = [20.0] * self.tools
+        self.targets = [0.0] * self.tools
+        self.bed_temp = 20.0
+        self.bed_target = 0.0
+        self.report_interval = 0 # seconds between reports, from M155
+        self.__next_report = None
+
+    def start(self):
+        """Serves the port from a background thread."""
+
+        self.__running = True
+        self.__thread = Thread(target=self.serve)
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def stop(self):
+        self.__running = False
+        if self.__thread:
+            self.__thread.join()
+            self.__thread = None
+        os.close(self.__master)
+
+    def serve(self):
+        """Serves the port until stopped."""
+
+        self.__running = True
+        while self.__running:
+            self.step()
+
+    def step(self):
+        """Waits briefly for something to happen, and then handles
+        it."""
+
+        events = self.__poll.poll(10)
+        revents = events[0][1] if events else 0
+        if revents & select.POLLHUP:
+            # nothing has the port open
+            if self.__connected:
+                self.__connected = False
+                self.__reset()
+            time.sleep(0.05)
+            return
+
+        baud = host_baud(self.__master)
+        if not self.__connected or baud != self.__host_baud:
+            # opening the port or changing its speed resets the board
+            self.__connected = True
+            self.__host_baud = baud
+            self.__reset()
+            self.__booted_at = time.time() + self.boot_time
+            self.boots += 1
+
+        now = time.time()
+        if self.__booted_at is not None and now >= self.__booted_at:
+            self.__booted_at = None
+            self.__tx += "".join([i + "\n" for i in BANNERS[self.flavor]])
+
+        # a serial port at 'baud' moves about baud/10 bytes a second
+        # each way; allow up to 50ms worth to build up
+        credit = (now - self.__last_io) * self.baud / 10.0
+        limit = self.baud / 200.0
+        self.__last_io = now
+        self.__rx_credit = min(self.__rx_credit + credit, limit)
+        self.__tx_credit = min(self.__tx_credit + credit, limit)
+        if self.__next_report is not None and now >= self.__next_report:
+            self.__next_report = now + self.report_interval
+            self.__tx += " " + self.__temps() + "\n"
+        busy = self.__read() + self.__execute(now) + self.__write()
+        if revents and not busy:
+            # data is waiting that can't be taken yet
+            time.sleep(0.001)
+
+    def __read(self):
+        """Takes commands from what the host has sent while there is
+        room in the command buffer, reading more no faster than the
+        baud rate allows.  Returns how much was done."""
+
+        done = 0
+        while "\n" in self.__rx and len(self.__queue) < self.buffer_size:
+            line, self.__rx = self.__rx.split("\n", 1)
+            self.__receive(line.strip())
+            done += 1
+
+        budget = int(self.__rx_credit)
+        if self.__booted_at is not None or "\n" in self.__rx or \
+           budget <= 0:
+            return done
+        try:
+            data = os.read(self.__master, budget)
+        except OSError, error:
+            if error.errno in (errno.EAGAIN, errno.EIO):
+                return done
+            raise
+        self.__rx_credit -= len(data)
+        if self.__host_baud != self.baud:
+            # whatever the firmware makes of it, it'll complain
+            self.__tx += "?" * len(data)
+        else:
+            if self.noise:
+                data = self.__corrupt(data)
+            if self.__partial and "\n" in data:
+                self.__partial = False
+                data = data.split("\n", 1)[1]
+            if not self.__partial:
+                self.__rx += data
+        return done + len(data)
+
+    def __write(self):
+        """Writes out responses, no faster than the baud rate.  Returns
+        the number of bytes written."""
+
+        budget = int(self.__tx_credit)
+        if not self.__tx or budget <= 0:
+            return 0
+        data = self.__tx[:budget]
+        if self.__host_baud != self.baud:
+            data = "".join([chr(self.random.randint(128, 255))
+                            for i in data])
+        try:
+            written = os.write(self.__master, data)
+        except OSError, error:
+            if error.errno in (errno.EAGAIN, errno.EIO):
+                return 0
+            raise
+        self.__tx = self.__tx[written:]
+        self.__tx_credit -= written
+        return written
+
+    def __corrupt(self, data):
+        data = bytearray(data)
+        for i in range(len(data)):
+            if self.random.random() < self.noise:
+                data[i] ^= 1 << self.random.randint(0, 7)
+        return str(data)
+
+    def __reject(self, message):
+        """Asks for the line after the last good one to be resent.
+        Like Marlin, this flushes the serial receive buffer, so that
+        the lines sent after the bad one don't each cause another
+        resend.  Unlike Marlin, the rest of any line cut short by the
+        flush is dropped as well, rather than being run as whatever
+        command the tail of it happens to look like."""
+
+        self.errors += 1
+        try:
+            self.__rx += os.read(self.__master, RX_BUFFER_SIZE)
+        except OSError, error:
+            if error.errno not in (errno.EAGAIN, errno.EIO):
+                raise
+        self.__partial = bool(self.__rx) and not self.__rx.endswith("\n")
+        self.__rx = ""
+        self.__tx += "Error:%s, Last Line: %d\n" % (message, self.last_line)
+        self.__tx += "Resend: %d\nok\n" % (self.last_line + 1)
+
+    def __receive(self, line):
+        """Checks a line from the host, and queues its command."""
+
+        if not line:
+            return
+        self.received += 1
+        num = None
+        if line.startswith("N"):
+            match = FRAME.match(line)
+            if not match:
+                return self.__reject("No Checksum with line number")
+            body = line[:line.rindex("*")]
+            if checksum(body) != int(match.group(3)):
+                return self.__reject("checksum mismatch")
+            num = int(match.group(1))
+            line = match.group(2)
+            if line.startswith("M110"):
+                params = [i for i in line.split()[1:] if i.startswith("N")]
+                self.last_line = int(params[0][1:]) if params else num
+            elif num != self.last_line + 1:
+                return self.__reject("Line Number is not Last Line Number+1")
+            else:
+                self.last_line = num
+        elif "*" in line:
+            return self.__reject("No Line Number with checksum")
+        self.__queue.append((num, line))
+
+    def __execute(self, now):
+        """Runs the next command if the last one is finished.  Returns
+        the number of commands run."""
+
+        if not self.__queue or now < self.__busy_until:
+            return 0
+        num, command = self.__queue.popleft()
+        self.__busy_until = now + self.exec_time
+        self.executed += 1
+        code = command.split(" ", 1)[0].upper()
+        params = dict([(i[:1].upper(), i[1:]) for i in command.split()[1:]])
+        report = ""
+        if re.match(r"^T\d+$", code):
+            report = self.__change_tool(int(code[1:]))
+        elif code in self.__handlers:
+            report = self.__handlers[code](params)
+        if self.advanced_ok and num is not None:
+            free = self.buffer_size - len(self.__queue)
+            ok = "ok N%d P15 B%d" % (num, free)
+        else:
+            ok = "ok"
+        if report.startswith(" "):
+            # temperature reports go on the same line as the ok
+            self.__tx += ok + report + "\n"
+        else:
+            self.__tx += report + ok + "\n"
+        return 1
+
+    def __temps(self):
+        """Moves each temperature halfway towards its target, and
+        returns the report M105 would make."""
+
+        for tool in range(self.tools):
+            self.temps[tool] += (self.targets[tool] - self.temps[tool]) / 2
+        self.bed_temp += (self.bed_target - self.bed_temp) / 2
+        report = ["T:%.1f /%.1f" % (self.temps[self.tool],
+                                    self.targets[self.tool])]
+        if self.heated_bed:
+            report.append("B:%.1f /%.1f" % (self.bed_temp, self.bed_target))
+        if self.tools > 1:
+            for tool in range(self.tools):
+                report.append("T%d:%.1f /%.1f" % (
+                    tool, self.temps[tool], self.targets[tool]))
+        report.append("@:0")
+        if self.heated_bed:
+            report.append("B@:0")
+        return " ".join(report)
+
+    def __set_tool_temp(self, params, wait):
+        tool = int(params.get("T", self.tool))
+        if 0 <= tool < self.tools and "S" in params:
+            self.targets[tool] = float(params["S"])
+            if wait:
+                self.temps[tool] = self.targets[tool]
+        return ""
+
+    def __set_bed_temp(self, params, wait):
+        if self.heated_bed and "S" in params:
+            self.bed_target = float(params["S"])
+            if wait:
+                self.bed_temp = self.bed_target
+        return ""
+
+    def __report_temps(self, params):
+        return " " + self.__temps()
+
+    def __report_capabilities(self, params):
+        report = ["FIRMWARE_NAME:%s (Virtual)" % self.flavor.capitalize(),
+                  "PROTOCOL_VERSION:1.0",
+                  "MACHINE_TYPE:Virtual",
+                  "EXTRUDER_COUNT:%d" % self.tools]
+        if self.rx_size:
+            report.append("RX_BUFFER_SIZE:%d" % self.rx_size)
+        report = " ".join(report) + "\n"
+        if self.flavor == "marlin":
+            report += "Cap:EEPROM:0\n"
+            report += "Cap:AUTOREPORT_TEMP:%d\n" % self.auto_report
+        return report
+
+    def __set_auto_report(self, params):
+        self.report_interval = int(params.get("S", 0))
+        self.__next_report = None
+        if self.report_interval:
+            self.__next_report = time.time() + self.report_interval
+        return ""
+
+    def __change_tool(self, tool):
+        if tool >= self.tools:
+            return "echo:T%d Invalid extruder\n" % tool
+        self.tool = tool
+        return "echo:Active Extruder: %d\n" % tool
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description="Serves a virtual printer on a pseudo-terminal.")
+    parser.add_argument("--flavor", choices=sorted(BANNERS),
+                        default="marlin")
+    parser.add_argument("--baud", type=int, default=250000)
+    parser.add_argument("--buffer-size", type=int, default=4,
+                        help="commands the firmware can queue")
+    parser.add_argument("--exec-time", type=float, default=0.0,
+                        help="seconds each command takes to run")
+    parser.add_argument("--noise", type=float, default=0.0,
+                        help="chance of each byte received being corrupted")
+    parser.add_argument("--tools", type=int, default=1)
+    parser.add_argument("--no-bed", action="store_true")
+    parser.add_argument("--advanced-ok", action="store_true")
+    parser.add_argument("--rx-size", type=int, default=None,
+                        help="serial buffer size to report in M115")
+    parser.add_argument("--auto-report", action="store_true",
+                        help="support M155 temperature auto-reporting")
+    args = parser.parse_args(argv[1:])
+
+    printer = VirtualPrinter(
+        args.flavor, args.baud, args.buffer_size, args.exec_time,
+        args.noise, args.tools, not args.no_bed, args.advanced_ok,
+        args.rx_size, auto_report=args.auto_report)
+    print printer.port
+    sys.stdout.flush()
+    try:
+        printer.serve()
+    except KeyboardInterrupt:
+        pass
+    print "%d lines received, %d executed, %d rejected" % (
+        printer.received, printer.executed, printer.errors)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,80 @@
+
+
+# This file is part of Switchprint.
+#
+# Switchprint is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Switchprint is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Switchprint.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import operator
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Batches smaller than this aren't worth the overhead of numpy.
+NUMPY_THRESHOLD = 64
+
+
+def checksum(data):
+    """Returns the xor of every byte in 'data', as used by the reprap
+    line checksum."""
+
+    return reduce(operator.xor, bytearray(data), 0)
+
+
+def __numpy_checksums(bodies):
+    """Checksums a batch of bodies in one go.  The running xor of the
+    whole batch is taken once, and the checksum of each body is the
+    difference between the running xor at either end of it."""
+
+    data = numpy.frombuffer("".join(bodies), dtype=numpy.uint8)
+    running = numpy.bitwise_xor.accumulate(data)
+    ends = running[numpy.cumsum([len(body) for body in bodies]) - 1]
+    starts = numpy.zeros_like(ends)
+    starts[1:] = ends[:-1]
+    return (ends ^ starts).tolist()
+
+
+def to_ascii(text):
+    """Returns 'text' as a plain string.  Commands that arrive over
+    dbus are unicode, which can't be checksummed byte by byte; anything
+    outside of ascii has no business in gcode anyway."""
+
+    if isinstance(text, unicode):
+        return text.encode("ascii", "replace")
+    return text
+
+
+def encode(lines):
+    """Prepares a batch of commands ahead of the send window.  Returns
+    a list of (body, checksum) pairs, where the body is the command as
+    it follows the line number and the checksum covers just the body.
+    Line numbers are assigned later by frame(), so that interrupts may
+    still jump the queue."""
+
+    bodies = [" " + to_ascii(line).strip() for line in lines]
+    if numpy is not None and len(bodies) >= NUMPY_THRESHOLD:
+        sums = __numpy_checksums(bodies)
+    else:
+        sums = [checksum(body) for body in bodies]
+    return zip(bodies, sums)
+
+
+def frame(num, body, body_sum):
+    """Numbers an encoded body and finishes its checksum, returning
+    the line as it is written to the printer."""
+
+    prefix = "N%d" % num
+    return "%s%s*%d\n" % (prefix, body, checksum(prefix) ^ body_sum)
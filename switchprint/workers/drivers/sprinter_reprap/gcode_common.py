@@ -31,14 +31,19 @@ def clean(soup):
     return commands
 
 
+__TEMP_EXPRS = {
+    "t" : re.compile(r"t:([0-9.]+)"),
+    "b" : re.compile(r"b:([0-9.]+)"),
+    }
+
+
 def __parse_temp(soup, key):
     """Parses a temperature param from the soup returned by M105."""
 
     temp = None
-    expr = key + r":[0-9.]+"
-    search = re.findall(expr, soup.lower())
+    search = __TEMP_EXPRS[key].search(soup.lower())
     if search:
-        temp = float(search[0].split(":")[-1])
+        temp = float(search.group(1))
     return temp
 
 
@@ -60,7 +65,9 @@ def parse_bed_temp(soup):
 def parse_capabilities(soup):
     """Called by autodetect to parse the soup returned by the M115
     command, to divine meaningful information from the printer as
-    reported by the firmware. """
+    reported by the firmware.  Marlin follows the report with lines
+    like "Cap:AUTOREPORT_TEMP:1", which are collected in a dictionary
+    under "capabilities"."""
 
     def clean(text):
         text = text.strip().lower()
@@ -75,9 +82,110 @@ def parse_capabilities(soup):
                 val = text
         return val
 
+    capabilities = {}
+    report = []
+    for line in soup.split("\n"):
+        line = line.strip()
+        if line.startswith("Cap:"):
+            name, sep, value = line[4:].partition(":")
+            capabilities[clean(name)] = clean(value)
+        elif line.count("FIRMWARE_NAME:"):
+            report = [line]
+        elif not report or not report[0].count("FIRMWARE_NAME:"):
+            report.append(line)
+    soup = " ".join(report)
+
     keys = map(clean, re.findall("[A-Z_]+:", soup))
     values = map(clean, re.split("[A-Z_]+:", soup)[1:])
     infodict = dict(zip(keys, values))
+    infodict["capabilities"] = capabilities
     if not infodict.has_key("extruder_count"):
         infodict["extruder_count"] = 1
     return infodict
+
+
+# Classifies a line of firmware output by how it starts.  Exactly one
+# of the named groups matches; 'other' catches everything else.
+__RESPONSE = re.compile(r"""
+    \s*(?:
+      (?P<ok>ok)\b
+        (?:\s+N(?P<ok_num>\d+)\s+P\d+\s+B(?P<ok_free>\d+))?
+    | (?P<resend>Resend|rs)\b\s*:?\s*N?(?P<resend_num>\d+)?
+    | echo:\s*(?:
+        (?P<busy>busy:.*)
+      | Active\s+Extruder:\s*(?P<extruder>\d+)
+      | (?P<echo>.*))
+    | (?P<error>Error:?.*)
+    | (?P<other>.*)
+    )""", re.VERBOSE | re.IGNORECASE)
+
+# One temperature reading, eg "T0:210.0 /215.0" or "B:60".  The tool
+# number is missing when the reading is for the active tool.
+__TEMPERATURE = re.compile(
+    r"(?<![\w@])([TB])(\d*):\s*(-?[0-9.]+)(?:\s*/\s*(-?[0-9.]+))?")
+
+
+def __parse_temps(line):
+    """Returns a temps event for the readings in 'line', or None if
+    there aren't any.  The event's value is a dictionary with the key
+    'b' for the bed's (temp, target) pair, and the key 't' for a
+    dictionary of (temp, target) pairs by tool number, in which None
+    is the active tool.  Targets are None if not reported."""
+
+    tools = {}
+    bed = None
+    for key, num, temp, target in __TEMPERATURE.findall(line):
+        try:
+            reading = (float(temp), float(target) if target else None)
+        except ValueError:
+            continue
+        if key in "Bb":
+            bed = reading
+        else:
+            tools[int(num) if num else None] = reading
+    if tools or bed:
+        return ("temps", {"t" : tools, "b" : bed})
+    return None
+
+
+def tokenize_response(line):
+    """Classifies a line of firmware output in a single pass, and
+    returns a list of the events found in it.  Each event is a tuple
+    of which the first item is its type:
+
+      ("ok", line_num, free_slots) -- acknowledgement; the line number
+          and free buffer slots are only present with ADVANCED_OK
+      ("resend", line_num) -- line_num is None if it was garbled
+      ("temps", readings) -- see __parse_temps
+      ("extruder", tool) -- the active extruder changed
+      ("busy", text)
+      ("error", text)
+      ("echo", text)
+      ("other", text)
+
+    An ok may be followed by a temps event from the same line."""
+
+    match = __RESPONSE.match(line)
+    kind = match.lastgroup
+    if kind in ("ok", "ok_num", "ok_free"):
+        num = match.group("ok_num")
+        events = [("ok",
+                   int(num) if num else None,
+                   int(match.group("ok_free")) if num else None)]
+        if ":" in line:
+            temps = __parse_temps(line)
+            if temps:
+                events.append(temps)
+        return events
+    elif kind in ("resend", "resend_num"):
+        num = match.group("resend_num")
+        return [("resend", int(num) if num else None)]
+    elif kind == "extruder":
+        return [("extruder", int(match.group("extruder")))]
+    elif kind == "other":
+        temps = __parse_temps(line)
+        if temps:
+            return [temps]
+        return [("other", line.strip())]
+    else:
+        return [(kind, match.group(kind).strip())]
@@ -0,0 +1,195 @@
+
+
+# This file is part of Switchprint.
+#
+# Switchprint is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Switchprint is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Switchprint.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os, mmap, struct
+from array import array
+from gcode_common import clean as clean_gcode
+
+
+# A prepared job is two files.  The first holds the cleaned commands,
+# one per line.  The second, with INDEX_SUFFIX appended to its name,
+# holds the offset just past the end of each line in the first, as an
+# array of native unsigned longs.
+INDEX_SUFFIX = ".idx"
+INDEX_TYPE = "L"
+INDEX_SIZE = array(INDEX_TYPE).itemsize
+
+# How much of the source file to clean at once, in bytes.
+CHUNK_SIZE = 1 << 18
+
+
+class JobWriter(object):
+    """Writes cleaned gcode out in the prepared job format.  Each
+    write is flushed, data before index, so that a PreparedJob may
+    read the job while it is still being written."""
+
+    def __init__(self, path):
+        self.path = path
+        self.length = 0 # number of commands written
+        self.size = 0 # number of bytes written
+        self.__data = open(path, "wb")
+        self.__index = open(path + INDEX_SUFFIX, "wb")
+
+    def write(self, commands):
+        """Appends a list of cleaned commands to the job."""
+
+        offsets = array(INDEX_TYPE)
+        for command in commands:
+            self.size += len(command) + 1
+            offsets.append(self.size)
+        self.__data.write("".join([i + "\n" for i in commands]))
+        self.__data.flush()
+        offsets.tofile(self.__index)
+        self.__index.flush()
+        self.length += len(commands)
+
+    def close(self):
+        self.__data.close()
+        self.__index.close()
+
+
+class PreparedJob(object):
+    """Provides random access by line number to a prepared job, via
+    memory maps of its files.  If the job is still being written,
+    call refresh to pick up the lines written since."""
+
+    def __init__(self, path):
+        self.path = path
+        self.__data_file = open(path, "rb")
+        self.__index_file = open(path + INDEX_SUFFIX, "rb")
+        self.__data = None
+        self.__index = None
+        self.size = 0
+        self.length = 0
+        self.refresh()
+
+    def refresh(self):
+        """Remaps the job if more lines have been written to it."""
+
+        index_size = os.fstat(self.__index_file.fileno()).st_size
+        if index_size/INDEX_SIZE <= self.length:
+            return
+        old = (self.__data, self.__index)
+        # The index is mapped first, so that all the lines it refers
+        # to are already in the data file when that is mapped.
+        self.__index = self.__map(self.__index_file)
+        self.__data = self.__map(self.__data_file)
+        for mapped in old:
+            if mapped:
+                mapped.close()
+        self.size = len(self.__data)
+        self.length = len(self.__index)/INDEX_SIZE
+
+    def __map(self, file_obj):
+        """Maps the file read only.  Empty files can't be mapped, in
+        which case None is returned."""
+
+        if os.fstat(file_obj.fileno()).st_size == 0:
+            return None
+        return mmap.mmap(file_obj.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return self.length
+
+    def offset(self, num):
+        """Returns the byte offset at which line 'num' starts.  Line
+        numbers count from zero, and the offset of the line after the
+        last is the size of the job."""
+
+        if num <= 0:
+            return 0
+        num = min(num, self.length)
+        return struct.unpack_from(
+            INDEX_TYPE, self.__index, (num-1)*INDEX_SIZE)[0]
+
+    def line(self, num):
+        """Returns the command on line 'num'."""
+
+        assert 0 <= num < self.length
+        return self.__data[self.offset(num):self.offset(num+1)-1]
+
+    def lines(self, start, count):
+        """Returns up to 'count' commands starting at line 'start', as
+        one block of text."""
+
+        begin = self.offset(start)
+        end = self.offset(start+count)
+        return self.__data[begin:end] if end > begin else ""
+
+    def close(self):
+        for mapped in (self.__data, self.__index):
+            if mapped:
+                mapped.close()
+        self.__data_file.close()
+        self.__index_file.close()
+
+    def remove(self):
+        """Closes the job and deletes its files."""
+
+        self.close()
+        os.remove(self.path)
+        os.remove(self.path + INDEX_SUFFIX)
+
+
+def build_job(src_path, job_path):
+    """Generator which cleans the gcode in 'src_path' and writes it
+    out as a prepared job at 'job_path', one chunk at a time.  Yields
+    the fraction of the source consumed after each chunk, so the
+    caller may do other work (such as printing the lines written so
+    far) in between.  If the source can't be read, whatever was
+    written of the job is removed before the error is raised."""
+
+    writer = None
+    try:
+        total = os.path.getsize(src_path)
+        consumed = 0
+        writer = JobWriter(job_path)
+        with open(src_path, "r") as src:
+            while True:
+                soup = src.readlines(CHUNK_SIZE)
+                if not soup:
+                    break
+                consumed += sum(map(len, soup))
+                writer.write(clean_gcode("".join(soup)))
+                yield float(consumed)/total
+    except (IOError, OSError):
+        if writer is not None:
+            writer.close()
+            writer = None
+        remove_job(job_path)
+        raise
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def remove_job(job_path):
+    """Deletes whichever of a prepared job's files exist."""
+
+    for path in (job_path, job_path + INDEX_SUFFIX):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def prepare_job(src_path, job_path):
+    """Cleans the gcode in 'src_path' and writes it out as a prepared
+    job at 'job_path'.  Returns the PreparedJob."""
+
+    for progress in build_job(src_path, job_path):
+        pass
+    return PreparedJob(job_path)
@@ -16,11 +16,25 @@
 # along with Switchprint.  If not, see <http://www.gnu.org/licenses/>.
 
 
-import time, json
+import os, time, json
 from tempfile import mkstemp
 import gobject
+from switchprint.common import get_config_path
 from protocol import SprinterProtocol
-from gcode_common import clean as clean_gcode
+from telemetry import TelemetryGate, TelemetryHistory, telemetry_values
+from job import build_job, PreparedJob, INDEX_SUFFIX
+from checkpoint import checkpoint_path, save_checkpoint, load_checkpoint, \
+     clear_checkpoint, find_resume_position, resume_gcode
+
+
+# How often to checkpoint a running print, in seconds.
+CHECKPOINT_INTERVAL = 10
+
+# How often firmware that can report temperatures by itself is asked
+# to, in seconds, and how many reports may go missing before it is
+# asked again.
+AUTO_REPORT_INTERVAL = 2
+AUTO_REPORT_MISSED = 3
 
 
 class Timeout(object):
@@ -69,6 +83,8 @@ class SprinterMonitor(object):
         self.__serial = serial
         self.__signals = server
         self.proto = SprinterProtocol(serial, self)
+        self.proto.trace.dump_path = os.path.join(
+            get_config_path(), "traces", server.uuid + ".log")
 
         # 'idle', 'job_done', 'printing', 'paused, 'error'
         self.printer_state = 'idle'
@@ -77,20 +93,81 @@ class SprinterMonitor(object):
 
         self.monitor_timer = Timeout(self.monitor_event_loop)
         self.report_timer = Timeout(self.report_status)
+        self.telemetry = TelemetryGate()
+        self.history = TelemetryHistory()
+        self.history_timer = Timeout(self.sample_history)
+        self.history_timer.set(self.history.interval)
         self.temp_timer = Timeout(self.query_temp)
 
-        self.proto.request_temps()
+        # service the serial port as soon as the printer says
+        # anything, rather than waiting for the next monitor tick
+        self.__io_watch = gobject.io_add_watch(
+            serial.fileno(),
+            gobject.IO_IN | gobject.IO_ERR | gobject.IO_HUP,
+            self.__on_serial_event)
+
+        capabilities = getattr(serial, "reported", {}).get("capabilities", {})
+        if capabilities.get("autoreport_temp"):
+            self.proto.start_auto_report(AUTO_REPORT_INTERVAL)
+        else:
+            self.proto.request_temps()
         self.__cue_monitor()
         self.query_temp()
 
         # used by pdq request print
         self.src_path = None
-        self.cache_path = None
-        self.cache_file = None
+        self.job = None
+        self.job_builder = None
+        self.__prep_id = None
         self.job_length = 0
         self.job_counter = 0
         self.job_dry = False
 
+        # The stream cache counts every normal command it's fed; job
+        # lines are counted from 'job_base'.
+        self.job_base = 0
+        self.checkpoint_path = checkpoint_path(server.uuid)
+        self.last_checkpoint = 0
+        # a checkpointed job waiting to be resumed
+        self.held = load_checkpoint(self.checkpoint_path)
+        # a checkpointed job to resume once it has been prepared
+        self.resuming = None
+        if self.held:
+            self.printer_state = "paused"
+
+    def close(self):
+        """Detaches the monitor from the main loop.  Called when the
+        serial connection it is watching is about to go away."""
+
+        if self.__io_watch is not None:
+            gobject.source_remove(self.__io_watch)
+            self.__io_watch = None
+        if self.__prep_id is not None:
+            gobject.source_remove(self.__prep_id)
+            self.__prep_id = None
+        self.monitor_timer.clear()
+        self.report_timer.clear()
+        self.history_timer.clear()
+        self.temp_timer.clear()
+        if self.job is not None:
+            self.job.close()
+
+    def __on_serial_event(self, source, condition):
+        """Called by the main loop when the serial port is readable.
+        Acks are processed and the next lines are written out
+        immediately."""
+
+        if condition & (gobject.IO_ERR | gobject.IO_HUP):
+            # the device went away; the disconnect handler will take
+            # care of the rest
+            self.__io_watch = None
+            return False
+
+        self.proto.execute_requests()
+        if self.printer_state == "printing" and self.job is not None:
+            self.print_step()
+        return True
+
     def get_max_temp_state(self):
         """The max temp returned is the highest of the set of all
         temperature states and temperature targets. If this number is
@@ -122,12 +199,29 @@ class SprinterMonitor(object):
         bed's target temperature is set, or when any tool or the bed's
         temperature is reported."""
 
-        self.report_timer.set(1)
+        self.report_timer.set(self.telemetry.wait())
 
     def report_status(self):
         """Generate a report of the temperature and tool states, and
-        push that info to the host via dbus signal."""
-
+        push that info to the host via dbus signal, if it has changed
+        enough since the last report and the last report was long
+        enough ago.  See telemetry.py.  Either way, this is called
+        again when the heartbeat is due, since an idle printer may
+        not report its temperatures by itself."""
+
+        values = telemetry_values(self.proto.temps, self.proto.targets)
+        if not self.telemetry.changed(values, self.printer_state):
+            self.report_timer.set(self.telemetry.until_heartbeat())
+            return
+        wait = self.telemetry.wait()
+        if wait > 0:
+            self.report_timer.set(wait)
+            return
+        self.telemetry.sent(values, self.printer_state)
+        self.__signals.on_telemetry(self.printer_state, values)
+        self.report_timer.set(self.telemetry.heartbeat)
+
+        # the older, untyped report
         status = {
             "thermistors" : {
                 "tools": [],
@@ -143,6 +237,18 @@ class SprinterMonitor(object):
             status["thermistors"]["tools"].append(state)
         self.__signals.on_report(json.dumps(status))
 
+    def sample_history(self):
+        """Adds the printer's temperatures, how many lines are waiting
+        to be acknowledged and how far the job has got to the history,
+        every 'interval' seconds whether or not anything is reported,
+        so that it stays evenly spaced."""
+
+        values = telemetry_values(self.proto.temps, self.proto.targets)
+        self.history.record(dict(
+            values, queue_depth=self.proto.cache.fed - self.proto.cache.acked,
+            progress=self.job_progress()))
+        self.history_timer.set(self.history.interval)
+
     def __change_monitor_state(self, new_state):
         """Changes the state of the monitor, and possibly initiates a
         timeout."""
@@ -158,74 +264,218 @@ class SprinterMonitor(object):
     def request(self, soup):
         """Takes a block of text, cleans it, and then adds it into the
         command queue.  Inferres where in the queue it should go from
-        context."""
+        context.  Returns the number of lines queued, which is none
+        while printing."""
 
+        queued = 0
         if self.printer_state == "idle":
-            self.proto.request(soup)
+            queued = self.proto.request(soup)
 
         elif self.printer_state in ("paused", "error"):
-            self.proto.request(soup, interrupt=True)
+            queued = self.proto.request(soup, interrupt=True)
 
         self.__change_monitor_state("active")
         self.__cue_monitor()
+        return queued
         
     def print_file(self, file_path):
         """Streams gcode from a file object to the printer."""
 
+        if self.held:
+            # a new job replaces the one that was waiting to resume
+            self.held = None
+            clear_checkpoint(self.checkpoint_path)
         self.src_path = file_path
         self.printer_state = "printing"
+        self.on_state_changed()
         self.__change_monitor_state("active")
 
-    def print_prep(self):
-        self.cache_path = mkstemp()[1]
-        self.cache_file = open(self.cache_path, "w")
-        src_file = open(self.src_path, "r")
-        self.job_length = 0
+    def print_prep(self, job_path=None):
+        """Starts preparing the job.  Only the first chunk of the file
+        is cleaned up front; the rest is cleaned when the main loop is
+        otherwise idle, while the first lines are already printing.
+        The job is written to a new temporary file unless 'job_path'
+        is given."""
+
+        try:
+            open(self.src_path, "r").close()
+        except IOError as error:
+            self.print_failed(error)
+            return
+        if job_path is None:
+            fd, job_path = mkstemp(suffix=".gcode")
+            os.close(fd)
+        self.job_builder = build_job(self.src_path, job_path)
+        self.job_base = self.proto.cache.fed
         self.job_counter = 0
-        for soup in src_file:
-            cleaned = clean_gcode(soup)
-            self.job_length += len(cleaned)
-            for gcode in cleaned:
-                self.cache_file.write(gcode + "\n")
-        self.cache_file.close()
-        self.cache_file = open(self.cache_path, "r")
         self.job_dry = False
+        self.__prep_step()
+        if self.printer_state == "error":
+            return
+        self.job = PreparedJob(job_path)
+        self.job_length = len(self.job)
+        if self.job_builder is not None:
+            self.__prep_id = gobject.idle_add(self.__prep_step)
+        elif self.resuming:
+            self.__resume()
+
+    def __prep_step(self):
+        """Cleans the next chunk of the job.  Returns True while there
+        is more to be done."""
+
+        try:
+            progress = self.job_builder.next()
+        except StopIteration:
+            self.job_builder = None
+            self.__prep_id = None
+            if self.job is not None:
+                self.job.refresh()
+                self.job_length = len(self.job)
+                if self.resuming:
+                    self.__resume()
+            return False
+        except (IOError, OSError) as error:
+            # the builder has already removed the job's files
+            self.job_builder = None
+            self.__prep_id = None
+            self.print_failed(error)
+            return False
+        if self.job is not None:
+            self.job.refresh()
+            # estimate the length of the job from how much of the
+            # source has been read so far
+            self.job_length = int(len(self.job) / max(progress, 0.01))
+        return True
+
+    def job_progress(self):
+        """Returns how far through the job the printer is, as a
+        percentage."""
+
+        return min((100.0/max(self.job_length, 1))*self.job_counter, 100.0)
 
     def print_step(self):
         if not self.job_dry and self.proto.get_appetite() < 50:
-            print "PRINT STEP", self.job_counter, self.job_length
-
-            percent = str(min((100.0/self.job_length)*self.job_counter, 100.0))
-            self.__signals.on_pdq_print_progress(percent)
+            self.proto.trace.debug(
+                "print step %s of %s" % (self.job_counter, self.job_length))
 
-            chunk = []
-            for i in range(100):
-                line = self.cache_file.readline()
-                if line != '':
-                    chunk.append(line.strip())
-                else:
-                    break
+            self.__signals.on_pdq_print_progress(str(self.job_progress()))
 
-            if len(chunk) == 0:
+            chunk = self.job.lines(self.job_counter, 100)
+            if chunk:
+                self.job_counter += chunk.count("\n")
+                self.proto.request(chunk)
+            elif self.job_builder is None:
                 # the job's almost done, I guess
                 self.job_dry = True
-            else:
-                self.job_counter += len(chunk)
-                self.proto.request("\n".join(chunk))
 
         if self.job_dry and self.proto.buffer_status() == "idle":
             self.print_finish()
+        elif time.time() - self.last_checkpoint > CHECKPOINT_INTERVAL:
+            save_checkpoint(self.checkpoint_path, self.checkpoint())
+            self.last_checkpoint = time.time()
             
     def print_finish(self):
         self.job_counter = self.job_length
         self.__signals.on_pdq_print_complete()
         self.printer_state = 'idle'
-        self.cache_file.close()
+        self.on_state_changed()
+        self.job.remove()
+        self.job = None
+        clear_checkpoint(self.checkpoint_path)
+
+    def print_failed(self, error):
+        """Abandons the job, which can't be printed because its source
+        couldn't be read."""
+
+        self.proto.trace.error("Can't print %s: %s" % (self.src_path, error))
+        if self.job is not None:
+            self.job.close()
+            self.job = None
+        self.job_builder = None
+        self.resuming = None
+        self.printer_state = "error"
+        self.on_state_changed()
+        clear_checkpoint(self.checkpoint_path)
+
+    def checkpoint(self):
+        """Returns a checkpoint of the running job, from which it may
+        be resumed after the printer has been reset."""
+
+        cache = self.proto.cache
+        return {
+            "src_path" : self.src_path,
+            "job_path" : self.job.path,
+            "prepared" : self.job_builder is None,
+            # job lines the printer has acknowledged
+            "job_line" : max(cache.acked - self.job_base, 0),
+            "line_num" : cache.backlog[-1][0] if cache.backlog else 0,
+            "targets" : self.proto.targets,
+            "tool" : self.proto.tool,
+            "relative" : self.proto.relative,
+            "relative_extrusion" : self.proto.relative_extrusion,
+            "time" : time.time(),
+            }
+
+    def hold_print(self, checkpoint):
+        """Pauses the monitor with a checkpointed job waiting to be
+        resumed."""
+
+        self.held = checkpoint
+        self.printer_state = "paused"
+        self.on_state_changed()
+        save_checkpoint(self.checkpoint_path, checkpoint)
+
+    def resume_print(self):
+        """Resumes the held job from the last line the printer
+        acknowledged.  Returns False if there is nothing to resume."""
+
+        if not self.held or self.job is not None:
+            return False
+        self.resuming = self.held
+        self.held = None
+        self.src_path = self.resuming["src_path"]
+        job_path = self.resuming["job_path"]
+        if self.resuming["prepared"] and \
+           os.path.exists(job_path + INDEX_SUFFIX):
+            self.job = PreparedJob(job_path)
+            self.job_builder = None
+            self.job_length = len(self.job)
+            self.__resume()
+        else:
+            # preparation was cut short, so it has to be redone; the
+            # job is resumed once that's finished
+            self.print_prep(job_path)
+        return True
+
+    def __resume(self):
+        """Brings the printer back to where the job being resumed
+        left off, and carries on printing from there."""
+
+        held = self.resuming
+        self.resuming = None
+        position = find_resume_position(self.job, held["job_line"])
+        self.proto.request(resume_gcode(held, position))
+        self.job_base = self.proto.cache.fed - held["job_line"]
+        self.job_counter = held["job_line"]
+        self.job_dry = False
+        self.printer_state = "printing"
+        self.on_state_changed()
+        self.__change_monitor_state("active")
+        self.__cue_monitor()
 
     def query_temp(self):
-        """Periodically is called to query for temperature changes."""
+        """Periodically is called to query for temperature changes.
+        If the firmware reports temperatures by itself, this only
+        checks that it still is."""
         
-        self.proto.request_temps()
+        if not self.proto.auto_report:
+            self.proto.request_temps()
+        elif time.time() - self.proto.temps_heard > \
+             self.proto.auto_report * AUTO_REPORT_MISSED:
+            # the firmware has stopped reporting, most likely because
+            # it was reset, so ask again
+            self.proto.start_auto_report(self.proto.auto_report)
+            self.proto.request_temps()
         delay = None
         if self.monitor_state == "active":
             if self.printer_state == "printing":
@@ -255,9 +505,10 @@ class SprinterMonitor(object):
 
         self.proto.execute_requests()
 
+        if self.printer_state == "printing" and self.job is None:
+            self.print_prep()
+
         if self.printer_state == "printing":
-            if not self.cache_file:
-                self.print_prep()
             self.print_step()
             self.__cue_monitor()
         
@@ -0,0 +1,64 @@
+
+
+# This file is part of Switchprint.
+#
+# Switchprint is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Switchprint is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Switchprint.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os, json, hashlib
+from switchprint.common import get_config_path
+
+
+def profile_path(device_id):
+    """Returns the path where the connection profile for a device is
+    kept.  'device_id' is whatever identifies the device, preferably
+    its udev ID_SERIAL, otherwise its USB path."""
+
+    profile_dir = os.path.join(get_config_path(), "profiles")
+    if not os.path.isdir(profile_dir):
+        os.mkdir(profile_dir)
+    name = hashlib.sha1(device_id).hexdigest()
+    return os.path.join(profile_dir, name + ".json")
+
+
+def load_profile(device_id):
+    """Returns the profile stored for the device, or None if there
+    isn't a usable one."""
+
+    try:
+        with open(profile_path(device_id), "r") as src:
+            profile = json.load(src)
+    except (IOError, ValueError):
+        return None
+    if profile.get("device") != device_id or "baud" not in profile:
+        return None
+    return profile
+
+
+def save_profile(device_id, profile):
+    """Stores the profile for the device.  The old profile is only
+    replaced once the new one is completely written."""
+
+    profile = dict(profile, device=device_id)
+    path = profile_path(device_id)
+    temp_path = path + ".new"
+    with open(temp_path, "w") as out:
+        json.dump(profile, out, indent=2, sort_keys=True)
+    os.rename(temp_path, path)
+
+
+def clear_profile(device_id):
+    path = profile_path(device_id)
+    if os.path.exists(path):
+        os.remove(path)
@@ -16,58 +16,163 @@
 # along with Switchprint.  If not, see <http://www.gnu.org/licenses/>.
 
 
-import time, types
-from gcode_common import parse_bed_temp, parse_tool_temp, clean
+import re, time, types
+from collections import deque
+from itertools import islice
+from gcode_common import tokenize_response
+from framing import encode, frame, to_ascii
+from serial_trace import SerialTrace, DEBUG
+
+
+# Commands that change state we keep track of, as they appear in a
+# block of wrapped lines.
+STATEFUL = re.compile(
+    r"^N\d+ ((?:M10[49]|M1[49]0|M110|G9[01]|M8[23])(?: [^*\n]*)?)\*", re.M)
+
+# Seconds to wait for any reply to unacknowledged lines before writing
+# them out again.
+STALL_TIMEOUT = 10
+
+# Target temperatures at or below this, in celsius (about 65
+# fahrenheit), are taken to mean the heater is off, whether they are
+# sent to the printer or reported by it.  Nothing prints that cold,
+# and the firmware itself reports a target of 0 for off.
+OFF_TEMP = 18
 
 
 class StreamCache(object):
     """Stores pending GCODE instructions.  Differenciates betweent sent
     and unsent commands, allowing for interjections to be added to the
-    stream."""
-
-    def __init__(self):
-        # pending interrupt commands
-        self.interrupts = []
-        # pending normal commands
-        self.pending = []
-        # cache of commands currently being negotiated with printer
-        self.send_buffer = []
-        # backlog of old commands
-        self.backlog = []
+    stream.  Anything amiss is recorded in 'trace', if it is given a
+    SerialTrace."""
+
+    def __init__(self, window=4, trace=None):
+        self.trace = trace
+        # pending interrupt commands, and pending normal commands,
+        # both stored as encoded (body, checksum) pairs
+        self.interrupts = deque()
+        self.pending = deque()
+        # cache of commands currently being negotiated with printer,
+        # stored as (line number, wrapped line) pairs
+        self.send_buffer = deque()
+        # backlog of old commands, oldest entries fall off the end
+        self.backlog = deque(maxlen=500)
 
         self.__linenum = 0
-        self.__magic_number = 4 # how many commands should be sent at once
+
+        # Flow control.  At most 'window' lines may be in flight at
+        # once.  If the size of the firmware's receive buffer is
+        # known, 'rx_size' is set and lines are instead counted by
+        # the bytes they occupy in that buffer.
+        self.window = window
+        self.rx_size = None
+        self.__in_flight = 0 # bytes in the send buffer
+        self.__sent = 0 # entries in the send buffer already written
+        self.__free_peak = -1 # most free slots reported by the firmware
+
+        # Normal commands are counted as they are fed and as they are
+        # acknowledged, so that a caller may tell how far through its
+        # own stream the printer has gotten.  Interrupts don't count.
+        self.fed = 0
+        self.acked = 0
+        self.__unacked_nums = deque() # line numbers of normal commands
+        self.__acked_nums = deque(maxlen=500) # in step with the backlog
 
     def feed(self, soup, interrupt=False):
         """Take a list of commands, a string of commands, etc, and add it to
         the queue to be sent."""
 
-        pending = [i for i in soup.strip().split("\n")] if type(soup) == str \
+        soup = to_ascii(soup)
+        pending = soup.strip().split("\n") if type(soup) == str \
                   else soup if type(soup) in (tuple, list) else None
         assert pending is not None
-        for command in pending:
-            if interrupt:
-                self.interrupts.append(command)
-            else:
-                self.pending.append(command)
+        encoded = encode(pending)
+        if interrupt:
+            self.interrupts.extend(encoded)
+        else:
+            self.pending.extend(encoded)
+            self.fed += len(encoded)
+        return len(encoded)
 
-    def __wrap(self, line):
-        """Adds the line number and checksum to give gcode soup."""
+    def __wrap(self, encoded):
+        """Adds the line number and finishes the checksum of an
+        encoded line to give gcode soup."""
         self.__linenum += 1
-        numbered = "N{0} {1}".format(self.__linenum, line.strip())
-        checksum = reduce(lambda x, y:x^y, map(ord, numbered))
-        return self.__linenum, numbered + "*{0}\n".format(checksum)
-
-    def __send_prep(self, line_buffer, count):
-        """Take 'count' lines from 'line_buffer', add line numbers to them,
-        and dump them into self.send_buffer.  Returns the number of
-        items actually added to the send buffer."""
-
-        take = len(line_buffer) if len(line_buffer) < count else count
-        for i in range(take):
-            self.send_buffer.append(self.__wrap(line_buffer.pop(0)))
+        return self.__linenum, frame(self.__linenum, *encoded)
+
+    def __has_room(self, encoded):
+        """Returns True if the 'encoded' line may be sent without
+        overrunning the firmware's buffers."""
+
+        if not self.send_buffer:
+            return True
+        elif self.rx_size is None:
+            return len(self.send_buffer) < self.window
+        else:
+            # Upper bound on the wrapped size: "N", "*", up to three
+            # checksum digits and the newline.
+            size = len(encoded[0]) + len(str(self.__linenum+1)) + 6
+            return self.__in_flight + size <= self.rx_size
+
+    def __send_prep(self, line_buffer):
+        """Take lines from 'line_buffer' while the firmware has room
+        for them, add line numbers to them, and dump them into
+        self.send_buffer.  Returns the number of items actually added
+        to the send buffer."""
+
+        take = 0
+        while line_buffer and self.__has_room(line_buffer[0]):
+            entry = self.__wrap(line_buffer.popleft())
+            self.send_buffer.append(entry)
+            self.__in_flight += len(entry[1])
+            take += 1
+            if line_buffer is self.pending:
+                self.__unacked_nums.append(entry[0])
         return take
 
+    def __count_acked(self, last_num):
+        """Counts the normal commands up to and including line
+        'last_num' as acknowledged."""
+
+        while self.__unacked_nums and self.__unacked_nums[0] <= last_num:
+            self.__acked_nums.append(self.__unacked_nums.popleft())
+            self.acked += 1
+
+    def __count_unacked(self, first_num):
+        """Takes back acknowledgements for the normal commands from line
+        'first_num' on, as they're being resent."""
+
+        while self.__acked_nums and self.__acked_nums[-1] >= first_num:
+            self.__unacked_nums.appendleft(self.__acked_nums.pop())
+            self.acked -= 1
+
+    def __warn(self, text):
+        if self.trace:
+            self.trace.error(text)
+
+    def set_rx_size(self, rx_size):
+        """Switch to counting bytes against the firmware's receive
+        buffer.  Passing None reverts to counting lines."""
+
+        self.rx_size = rx_size
+
+    def report_free_slots(self, free):
+        """Called with the number of free command buffer slots that
+        Marlin reports when built with ADVANCED_OK.  The slot of the
+        command being acknowledged is still occupied when the report
+        is made, so the buffer is one larger than the most free slots
+        ever seen.  The window only ever grows past its default."""
+
+        if free > self.__free_peak:
+            self.__free_peak = free
+            self.window = max(self.window, free + 1)
+
+    def rewind(self):
+        """Marks every line in the send buffer as unsent, so that the
+        next nudge will write all of them out again."""
+
+        self.__sent = 0
+
     def get_appetite(self):
         """Returns the number of statements pending to be sent."""
         return len(self.pending)
@@ -82,16 +187,30 @@ class StreamCache(object):
                   len(self.pending)
         return pending == 0
 
-    def nudge(self, req_num=None, erase=None):
+    def get_in_flight(self):
+        """Returns true if lines have been written to the printer that
+        have not been acknowledged yet."""
+        return self.__sent > 0
+
+    def nudge(self, req_num=None, erase=None, ack_num=None):
 
         """If 'req_num' is defined, it will drop all items in the sent cache
-        preceding the indicated line number.  If 'erase' is defined,
-        it will simply erase that many entries from the beginning of
-        the sent cache.  If req_num is defined, erase will not be honored.
+        preceding the indicated line number, and resend the rest.  If
+        'ack_num' is defined, it will drop all items up to and
+        including that line number.  If 'erase' is defined, it will
+        simply erase that many (more) entries from the beginning of
+        the sent cache.  If req_num is defined, neither ack_num nor
+        erase will be honored.
 
         This command returns the next set of commands to be sent to
-        the printer."""
-        
+        the printer, which is None if nothing new should be written."""
+
+        resend = False
+        if type(ack_num) is int and len(self.send_buffer) > 0:
+            # ADVANCED_OK tells us exactly which line was processed
+            acked = max(ack_num - self.send_buffer[0][0] + 1, 0)
+            erase = acked + (erase or 0)
+
         if type(req_num) is int and len(self.send_buffer) > 0:
             # This block cuts everything up to the given line number
             # out of the cache of sent lines.  It may have the side
@@ -104,41 +223,59 @@ class StreamCache(object):
                 # been sent and we accidentally resent a command that
                 # was already processed.  Thus, we ignore it and empty
                 # the queue.
-                self.send_buffer = []
+                self.__count_acked(end_num)
+                self.send_buffer.clear()
+                self.__in_flight = 0
+                self.__sent = 0
+                erase = None
             elif req_num < first_num:
                 fetch_size = first_num-req_num
                 if fetch_size < 10:
-                    print "WARNING: Pulling statements from backlog for resending."
-                    print "This means the queue is out of sync with the printer."
-                    print "This will correct itself, but it shouldn't happen at all."
-                    self.send_buffer = self.backlog[-fetch_size:] + self.send_buffer
-                    self.backlock = self.backlog[:-fetch_size]
-                    erase = None
+                    # This will correct itself, but it shouldn't
+                    # happen at all.
+                    self.__warn(
+                        "Pulling lines from the backlog for resending; "
+                        "the send buffer is out of sync with the printer.")
+                    fetch_size = min(fetch_size, len(self.backlog))
+                    for i in range(fetch_size):
+                        entry = self.backlog.pop()
+                        self.send_buffer.appendleft(entry)
+                        self.__in_flight += len(entry[1])
+                    self.__count_unacked(req_num)
                 else:
-                    print "WARNING: Resend command was probably corrupted."
-                    print "Resending from last known position."
-                    erase = None
+                    self.__warn(
+                        "Resend request was probably corrupted; "
+                        "resending from the last known position.")
+                erase = None
+                resend = True
             else:
                 # yes, this overrides the erase argument
                 erase = req_num - first_num
+                resend = True
                             
         if type(erase) is int and erase > 0:
-            # Append erased section to the backlog
-            self.backlog += self.send_buffer[:erase]
-            # Trim the backglog, if necessary
-            if len(self.backlog) > 500:
-                self.backlog = self.backlog[-500:]
-            # Erase the first part of the sent cache.
-            self.send_buffer = self.send_buffer[erase:]
-
-        grab_count = self.__magic_number - len(self.send_buffer)
-        if grab_count > 0:
-            grab_count -= self.__send_prep(self.interrupts, grab_count)
-            if grab_count > 0:
-                self.__send_prep(self.pending, grab_count)
-
-        if self.send_buffer:
-            return "".join([i[1] for i in self.send_buffer])
+            # Move the erased section of the sent cache onto the
+            # backlog.  The backlog trims itself as it fills up.
+            erase = min(erase, len(self.send_buffer))
+            for i in range(erase):
+                entry = self.send_buffer.popleft()
+                self.backlog.append(entry)
+                self.__in_flight -= len(entry[1])
+            self.__sent = max(self.__sent - erase, 0)
+            if erase:
+                self.__count_acked(self.backlog[-1][0])
+
+        if resend:
+            self.rewind()
+
+        self.__send_prep(self.interrupts)
+        if not self.interrupts:
+            self.__send_prep(self.pending)
+
+        if self.__sent < len(self.send_buffer):
+            unsent = islice(self.send_buffer, self.__sent, None)
+            self.__sent = len(self.send_buffer)
+            return "".join([i[1] for i in unsent])
         else:
             return None
 
@@ -151,9 +288,22 @@ class SprinterProtocol(object):
     def __init__(self, connection, callbacks):
         self.__callbacks = callbacks
         self.__serial = connection
-        self.cache = StreamCache()
+        self.trace = SerialTrace()
+        self.cache = StreamCache(trace=self.trace)
+        self.__last_heard = time.time()
+
+        # Some firmware advertises the size of its serial receive
+        # buffer in its M115 report, in which case we can keep that
+        # buffer full rather than going back and forth a few lines at
+        # a time.
+        reported = getattr(connection, "reported", {})
+        rx_size = reported.get("rx_buffer_size")
+        if type(rx_size) is int and rx_size > 0:
+            self.cache.set_rx_size(rx_size)
 
         self.tool = 0
+        self.relative = False # G91 positioning
+        self.relative_extrusion = False # M83 extrusion
         self.temps = {
             "b" : 0,
             "t" : [0],
@@ -163,7 +313,21 @@ class SprinterProtocol(object):
             "t" : [None],
             }
 
+        # Seconds between the temperature reports the firmware makes
+        # by itself, if it was asked to with M155, and when one was
+        # last heard.
+        self.auto_report = None
+        self.temps_heard = None
+
         self.hold_start = None
+        # Sprinter and Marlin both follow a resend request with an ok,
+        # which may arrive in a later read than the request did.  The
+        # lines the firmware took before the bad one are still
+        # acknowledged as they run, after they've been cut from the
+        # send buffer.  Neither sort of ok acknowledges anything still
+        # in the send buffer.
+        self.__resend_ok = False
+        self.__owed_oks = 0
 
     def __get_callback(self, name):
         """Returns named callback function if available, otherwise
@@ -189,12 +353,14 @@ class SprinterProtocol(object):
     def request(self, soup, interrupt=False):
         """Takes a block of text, cleans it, and then adds it to the
         command queue.  If the interrupt argument is true, the soup
-        will be added to the interrupt queue, to be cleaned later."""
+        will be added to the interrupt queue, to be cleaned later.
+        Returns the number of lines queued."""
 
         cache_idle = self.cache.get_idle()
-        self.cache.feed(soup, interrupt)
+        queued = self.cache.feed(soup, interrupt)
         if cache_idle:
             self.__advance(cache_idle)
+        return queued
 
     def get_appetite(self):
         """Returns the number of statements pending to be sent."""
@@ -208,23 +374,22 @@ class SprinterProtocol(object):
 
     def request_temps(self):
         """Requests a temperature report for all connected tools as
-        well as the hot plate, where applicable.  Takes care of
-        automatic tool changes, etc.
-        """
-        ####### FIXME verify that this actually works still?
-        def interrupt():
-            hold = self.tool
-            count = self.__serial.info.tools
-            tools = [(i+self.tool) % count for i in range(count)]
-            soup = []
-            for tool in tools:
-                if tool != hold:
-                    soup.append("T%s" % tool)
-                soup.append("M105")
-            if len(tools) > 1:
-                soup.append("T%s" % hold)
-            return "\n".join(soup)
-        self.request(interrupt())
+        well as the hot plate, where applicable.  Firmware with more
+        than one extruder reports every tool's temperature as T0:,
+        T1: and so on in answer to a single M105, so there is no need
+        to change tools to read them."""
+
+        self.request("M105", interrupt=True)
+
+    def start_auto_report(self, interval):
+        """Asks the firmware to report temperatures every 'interval'
+        seconds by itself, so that they needn't be asked for in the
+        middle of the command stream.  Only for firmware that has the
+        AUTOREPORT_TEMP capability."""
+
+        self.request("M155 S%d" % interval, interrupt=True)
+        self.auto_report = interval
+        self.temps_heard = time.time()
 
     def __advance(self, force=True):
         """Facilitates flow control with printer based on error message
@@ -233,62 +398,82 @@ class SprinterProtocol(object):
         ready = self.__serial.inWaiting() > 0
         cut = 0
         request = None
+        ack_num = None
         if ready:
+            self.__last_heard = time.time()
             results = self.__serial.readlines()
-            cut = 0
-            print "-------------------------------------"
-            print results
+            resend = False
+            self.trace.rx(results)
             for result in results:
-                if result.startswith("ok"):
-                    cut += 1
-                elif result.startswith("Resend"):
-                    try:
-                        request = int(result.split(":")[-1].strip())
-                    except ValueError:
-                        # ok, this is tricky - server sent back
-                        # "Resend:\n" or something similar.  We're
-                        # going to guess and we're going to guess
-                        # wrong.
-                        last = self.cache.send_buffer[:1] or self.cache.backlog[-1]
-                        if last:
-                            request = last[0]
+                for event in tokenize_response(result):
+                    kind = event[0]
+                    if kind == "ok" and event[1] is None and \
+                       (self.__resend_ok or self.__owed_oks):
+                        if self.__resend_ok:
+                            self.__resend_ok = False
                         else:
-                            # This can probably be safely ignored.
-                            request = None
-                    cut = None
-                    break
-            # also call process results for state-related events
-            self.__process_response(results)
-            # debug
-            print "*"
-            print " cut", cut
-            print " req", request
-            print "*"
-            print " cache:"
-            for i in self.cache.send_buffer:
-                print " -", i
+                            self.__owed_oks -= 1
+                    elif kind == "ok" and not resend:
+                        if event[1] is not None:
+                            # ADVANCED_OK; plain oks before this one
+                            # are covered by the line number it reports
+                            ack_num = event[1]
+                            self.cache.report_free_slots(event[2])
+                            cut = 0
+                        else:
+                            cut += 1
+                    elif kind == "resend" and not resend:
+                        resend = True
+                        self.__resend_ok = True
+                        request = event[1]
+                        if request is None:
+                            # ok, this is tricky - server sent back
+                            # "Resend:\n" or something similar.  We're
+                            # going to guess and we're going to guess
+                            # wrong.
+                            if self.cache.send_buffer:
+                                request = self.cache.send_buffer[0][0]
+                            elif self.cache.backlog:
+                                request = self.cache.backlog[-1][0]
+                        if request is not None and self.cache.send_buffer:
+                            taken = request - self.cache.send_buffer[0][0]
+                            taken = min(taken, len(self.cache.send_buffer))
+                            self.__owed_oks = max(taken - cut, 0)
+                        cut = None
+                    else:
+                        # also process state-related events
+                        self.__process_event(event)
+            if self.trace.level >= DEBUG:
+                self.trace.debug("cut %s req %s cache %s" % (
+                    cut, request, [i[0] for i in self.cache.send_buffer]))
+
+        elif self.cache.get_in_flight() and \
+             time.time() - self.__last_heard > STALL_TIMEOUT:
+            # Nothing has been heard in a long while; the printer may
+            # have lost some lines or we may have missed an ok.  If
+            # the lines did arrive, the printer will ask us to resend
+            # from wherever it actually is.
+            self.trace.error("Printer stopped responding, resending.")
+            self.__last_heard = time.time()
+            self.cache.rewind()
 
         if ready or force:
-            next_block = self.cache.nudge(request, cut)
+            if not self.cache.get_in_flight():
+                self.__last_heard = time.time()
+            next_block = self.cache.nudge(request, cut, ack_num)
             if next_block:
                 self.__serial.write(next_block)
+                self.trace.tx(next_block)
+                for command in STATEFUL.findall(next_block):
+                    self.__update_states(command)
 
-    def execute_requests(self, timeout=1):
-        """Facilitates flow control automatically.  If 'timeout' is zero, this
-        will block until the stream is idle again.  Timeout should be
-        given in seconds.
-        """
-
-        mark = time.time()
-        dt = 0
-        while timeout is not None or not self.cache.get_idle():
-            self.__advance()
+    def execute_requests(self):
+        """Facilitates flow control.  Reads whatever the printer has
+        sent back, and writes out whatever it has room for.  This
+        never blocks, and should be called whenever the serial port
+        becomes readable."""
 
-            dt = time.time()-mark
-            if dt > timeout:
-                break
-            else:
-                time.sleep(.1)
+        self.__advance()
             
     def __update_states(self, command):
         """Updates internal states when applicable to a command,
@@ -314,62 +499,82 @@ class SprinterProtocol(object):
         if cmd == "M110":
             self.line = int(params[0][1:]) # parse number from param eg from N333
 
+        # positioning modes
+        if cmd in ("G90", "G91"):
+            self.relative = cmd == "G91"
+        if cmd in ("M82", "M83"):
+            self.relative_extrusion = cmd == "M83"
+
         # change target temperature
-        if cmd == "M104":
-            while len(self.targets["t"]) < self.tool+1:
+        if cmd in ("M104", "M109"):
+            tool = [int(i[1:]) for i in params if i.startswith("T")]
+            tool = tool[0] if tool else self.tool
+            target = [float(i[1:]) for i in params if i.startswith("S")]
+            if not target:
+                return
+            target = target[0]
+            while len(self.targets["t"]) < tool+1:
                 self.targets["t"].append(None)
-            target = [float(i[1:]) for i in params if i.startswith("S")][0]
-            if target <= 18:
-                # if target temperature is less than approximately 65 fahrenheit,
-                # assume that we're turning the tool off
+            if target <= OFF_TEMP:
                 target = None
-            self.targets["t"][self.tool] = target
+            self.targets["t"][tool] = target
             self.on_state_changed()
             
         # change target bed temperature
-        if cmd == "M140":
-            target = [float(i[1:]) for i in params if i.startswith("S")][0]
-            if target <= 18:
-                # if target temperature is less than approximately 65 fahrenheit,
-                # assume that we're turning the tool off
+        if cmd in ("M140", "M190"):
+            target = [float(i[1:]) for i in params if i.startswith("S")]
+            if not target:
+                return
+            target = target[0]
+            if target <= OFF_TEMP:
                 target = None
             self.targets['b'] = target
             self.on_state_changed()
     
-    def __process_response(self, response):
-        """Read from the socket and call events where appropriate."""
-
-        for line in response:
-            simple = line.lower().strip()
-
-            if simple.startswith("echo:"):
-                if simple.count("active extruder:"):
-                    # check to see if we changed tools
-                    self.tool = int(simple.split(":")[-1].strip())
-                    # update the temperature readings to make space
-                    # for new tools
-                    while len(self.temps["t"]) < self.tool+1:
-                        self.temps["t"].append(0)
-
-            elif line.startswith("Error"):
-                pass
-
-            elif line.startswith("DEBUG_"):
-                pass
-
-            else:
-                # check for a state report
-
-                # first check to see if the line contains the tool temp
-                tool_temp = parse_tool_temp(simple)
-                if tool_temp:
-                    self.temps["t"][self.tool] = tool_temp
-                    self.on_state_changed()
-
-                # next check to see if the line contains the bed temp
-                # note that this is usually is on the same line as the
-                # tool temp
-                bed_temp = parse_bed_temp(simple)
-                if bed_temp:
-                    self.temps["b"] = bed_temp
-                    self.on_state_changed()
+    def __process_event(self, event):
+        """Updates states and calls events where appropriate for an
+        event from tokenize_response."""
+
+        kind = event[0]
+        if kind == "error":
+            self.trace.error(event[1])
+
+        elif kind == "extruder":
+            # check to see if we changed tools
+            self.tool = event[1]
+            # update the temperature readings to make space for new
+            # tools
+            while len(self.temps["t"]) < self.tool+1:
+                self.temps["t"].append(0)
+
+        elif kind == "temps":
+            readings = event[1]
+            self.temps_heard = time.time()
+            tools = dict(readings["t"])
+            # a reading without a tool number is for the active tool,
+            # and is repeated by number when there's more than one
+            active = tools.pop(None, None)
+            if active and active[0] and self.tool not in tools:
+                tools[self.tool] = active
+            changed = False
+            for tool, (temp, target) in tools.items():
+                while len(self.temps["t"]) < tool+1:
+                    self.temps["t"].append(0)
+                while len(self.targets["t"]) < tool+1:
+                    self.targets["t"].append(None)
+                self.temps["t"][tool] = temp
+                if target is not None:
+                    self.targets["t"][tool] = \
+                        target if target > OFF_TEMP else None
+                changed = True
+
+            # note that the bed temp is usually on the same line as
+            # the tool temp
+            if readings["b"] and readings["b"][0]:
+                temp, target = readings["b"]
+                self.temps["b"] = temp
+                if target is not None:
+                    self.targets["b"] = target if target > OFF_TEMP else None
+                changed = True
+            if changed:
+                self.on_state_changed()
@@ -0,0 +1,214 @@
+
+
+# This file is part of Switchprint.
+#
+# Switchprint is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Switchprint is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Switchprint.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Capture of serial sessions with real printers, and replay of those
+captures against SprinterProtocol with no hardware attached.
+
+A capture is written in the same format as a trace dump: one line per
+frame, each with a timestamp and 'tx' or 'rx'.  The first line is an
+'info' entry holding what the firmware reported about itself as json,
+so that the protocol may be set up the same way on replay.  Trace
+dumps can be replayed too, in which case the reports are missing."""
+
+
+import re, json, time
+from collections import deque
+from switchprint.workers.drivers.capabilities import FFFInfo
+from protocol import SprinterProtocol
+from serial_trace import format_entries, parse_entries
+
+
+FRAME = re.compile(r"^N(\d+) (.*)\*\d+$")
+
+
+class RecordingConnection(object):
+    """Stands between a SerialConnection and whatever uses it.  While
+    a capture is open, everything written to the connection and read
+    back from it is recorded.  Anything else is passed straight
+    through to the connection."""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.__capture = None
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+    def start_capture(self, path):
+        """Starts recording to the capture file at 'path', replacing
+        any capture in progress."""
+
+        self.stop_capture()
+        self.__capture = open(path, "w")
+        reported = json.dumps(getattr(self.connection, "reported", {}))
+        self.__record("info", reported)
+
+    def stop_capture(self):
+        if self.__capture:
+            self.__capture.close()
+            self.__capture = None
+
+    def __record(self, kind, text):
+        self.__capture.write(format_entries([(time.time(), kind, text)]))
+
+    def write(self, data):
+        if self.__capture:
+            self.__record("tx", data)
+        return self.connection.write(data)
+
+    def readlines(self):
+        lines = self.connection.readlines()
+        if self.__capture and lines:
+            self.__record("rx", "".join(lines))
+        return lines
+
+
+def load_capture(path):
+    """Reads a capture or trace dump into a list of entries."""
+
+    with open(path, "r") as src:
+        return parse_entries(src)
+
+
+def host_commands(entries):
+    """Recovers the commands the host sent during a capture, in order,
+    from its numbered frames.  Resent frames are only counted once."""
+
+    commands = []
+    last_num = 0
+    for stamp, kind, text in entries:
+        if kind != "tx":
+            continue
+        match = FRAME.match(text)
+        if match and int(match.group(1)) > last_num:
+            last_num = int(match.group(1))
+            commands.append(match.group(2))
+    return commands
+
+
+class ReplayConnection(object):
+    """Stands in for a SerialConnection, playing the printer's side of
+    a capture back to the protocol.  Each line the printer sent is
+    held back until the protocol has written as many frames as the
+    host had when the printer sent it, so that replay is deterministic
+    regardless of how fast it runs.  In real time, lines are also held
+    back until as long has passed since the start of the replay as
+    had passed in the capture."""
+
+    def __init__(self, entries, realtime=False):
+        self.reported = {}
+        self.info = FFFInfo()
+        self.realtime = realtime
+        self.expected = [] # frames the host wrote in the capture
+        self.written = [] # frames written during replay
+        self.__responses = deque() # (frames before, offset, line)
+        self.__start = None
+
+        origin = entries[0][0] if entries else 0
+        for stamp, kind, text in entries:
+            if kind == "info":
+                try:
+                    self.reported = json.loads(text)
+                except ValueError:
+                    pass
+            elif kind == "tx":
+                self.expected.append(text)
+            elif kind == "rx":
+                self.__responses.append(
+                    (len(self.expected), stamp - origin, text + "\n"))
+        try:
+            self.info.tools = int(self.reported["extruder_count"])
+        except (KeyError, ValueError):
+            pass
+
+    def __released(self, response):
+        after, offset, line = response
+        if len(self.written) < after:
+            return False
+        if self.realtime:
+            if self.__start is None:
+                self.__start = time.time()
+            return time.time() - self.__start >= offset
+        return True
+
+    def inWaiting(self):
+        if self.__responses and self.__released(self.__responses[0]):
+            return len(self.__responses[0][2])
+        return 0
+
+    def readlines(self):
+        lines = []
+        while self.__responses and self.__released(self.__responses[0]):
+            lines.append(self.__responses.popleft()[2])
+        return lines
+
+    def write(self, data):
+        self.written += data.splitlines()
+        return len(data)
+
+    def finished(self):
+        """Returns True once every response has been read."""
+        return not self.__responses
+
+    def next_delay(self):
+        """Returns how long until the next response is due, or None if
+        it won't be until more frames are written."""
+
+        if not self.__responses:
+            return None
+        after, offset, line = self.__responses[0]
+        if len(self.written) < after:
+            return None
+        if not self.realtime or self.__start is None:
+            return 0
+        return max(offset - (time.time() - self.__start), 0)
+
+    def divergence(self):
+        """Returns the index of the first frame written during replay
+        that differs from the capture, or None if they all match."""
+
+        for index, (got, want) in enumerate(zip(self.written, self.expected)):
+            if got != want:
+                return index
+        if len(self.written) != len(self.expected):
+            return min(len(self.written), len(self.expected))
+        return None
+
+
+def replay(entries, realtime=False):
+    """Replays a capture against a fresh SprinterProtocol, feeding it
+    the commands the host sent and the responses the printer made.
+    Stops once every response has been read, or when the protocol is
+    left waiting on a response the capture doesn't have.  Returns the
+    ReplayConnection, which holds what was written."""
+
+    connection = ReplayConnection(entries, realtime)
+    proto = SprinterProtocol(connection, None)
+    proto.request(host_commands(entries))
+    while True:
+        written = len(connection.written)
+        proto.execute_requests()
+        if connection.finished():
+            break
+        if connection.inWaiting() or len(connection.written) > written:
+            continue
+        delay = connection.next_delay()
+        if delay is None:
+            break
+        time.sleep(delay)
+    return connection
@@ -0,0 +1,114 @@
+
+
+# This file is part of Switchprint.
+#
+# Switchprint is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Switchprint is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Switchprint.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os, time
+from collections import deque
+
+
+# Trace levels.  Each level records everything the levels below it do.
+OFF = 0
+ERROR = 1 # errors reported by the firmware or the driver
+INFO = 2 # every frame sent to and received from the printer
+DEBUG = 3 # protocol internals, eg the send buffer after every read
+
+# Seconds to wait after dumping the trace for an error before doing
+# so again, so that a burst of errors doesn't hammer the disk.
+DUMP_INTERVAL = 60
+
+
+class SerialTrace(object):
+    """Keeps the most recent traffic with a printer in a fixed size
+    ring, so that it may be dumped when something goes wrong.  Each
+    entry is a (timestamp, kind, text) tuple, where kind is one of
+    'tx', 'rx', 'error' or 'debug'.
+
+    Callers should check 'level' themselves before building anything
+    expensive to trace; when tracing is off, that check is all it
+    costs."""
+
+    def __init__(self, size=2000, level=INFO):
+        self.level = level
+        self.entries = deque(maxlen=size)
+        # if set, the trace is written here whenever an error occurs
+        self.dump_path = None
+        self.__last_dump = 0
+
+    def tx(self, data):
+        """Records data written to the printer."""
+        if self.level >= INFO:
+            self.entries.append((time.time(), "tx", data))
+
+    def rx(self, lines):
+        """Records lines read from the printer."""
+        if self.level >= INFO:
+            now = time.time()
+            for line in lines:
+                self.entries.append((now, "rx", line))
+
+    def debug(self, text):
+        if self.level >= DEBUG:
+            self.entries.append((time.time(), "debug", text))
+
+    def error(self, text):
+        """Records an error, and dumps the trace to dump_path if one
+        is set."""
+
+        if self.level >= ERROR:
+            self.entries.append((time.time(), "error", text))
+            if self.dump_path and \
+               time.time() - self.__last_dump > DUMP_INTERVAL:
+                self.__last_dump = time.time()
+                self.dump_to_file(self.dump_path)
+
+    def dump(self):
+        """Returns the trace as text, one entry per line."""
+        return format_entries(self.entries)
+
+    def dump_to_file(self, path):
+        dump_dir = os.path.dirname(path)
+        if dump_dir and not os.path.isdir(dump_dir):
+            os.makedirs(dump_dir)
+        with open(path, "w") as out:
+            out.write(self.dump())
+
+
+def format_entries(entries):
+    """Formats (timestamp, kind, text) entries as text, one line per
+    line of text.  Blocks of several lines written at once share a
+    timestamp."""
+
+    out = []
+    for stamp, kind, text in entries:
+        for line in text.splitlines() or [""]:
+            out.append("%.3f %-5s %s\n" % (stamp, kind, line))
+    return "".join(out)
+
+
+def parse_entries(lines):
+    """Reverses format_entries, for reading trace dumps and serial
+    captures back in.  Returns a list of (timestamp, kind, text)
+    entries, one per line, without line endings."""
+
+    entries = []
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if not line:
+            continue
+        stamp, rest = line.split(" ", 1)
+        entries.append((float(stamp), rest[:5].strip(), rest[6:]))
+    return entries
@@ -0,0 +1,176 @@
+
+
+# This file is part of Switchprint.
+#
+# Switchprint is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Switchprint is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Switchprint.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Coalescing of the temperature reports pushed to the host.
+
+The printer is asked for its temperatures every few seconds and
+answers with readings that wobble by a fraction of a degree, so
+rather than reporting every answer, a report is only sent when a
+value has moved by at least 'threshold' since the last one sent, a
+value appeared or went away, or the printer's state changed, and then
+no more than 'max_rate' times a second.  A report is also sent every
+'heartbeat' seconds regardless, so that subscribers can tell the
+printer is still there.
+
+Each printer also keeps a history of its telemetry, sampled no more
+than once every 'interval' seconds, in a ring of fixed size so that a
+client joining late can still draw a graph."""
+
+
+import time
+from array import array
+from bisect import bisect_right
+
+
+THRESHOLD = 0.5 # degrees
+MAX_RATE = 1.0 # reports per second
+HEARTBEAT = 30 # seconds
+
+HISTORY_SIZE = 2048 # samples
+SAMPLE_INTERVAL = 1.0 # seconds
+
+NAN = float("nan")
+
+
+def telemetry_values(temps, targets):
+    """Flattens SprinterProtocol's temperatures and targets into the
+    dictionary of doubles the telemetry signal carries: "bed" and
+    "bed_target", then "tool0", "tool0_target" and so on.  Targets
+    that were never set are left out."""
+
+    values = {"bed" : float(temps["b"])}
+    if targets["b"] is not None:
+        values["bed_target"] = float(targets["b"])
+    for tool, temp in enumerate(temps["t"]):
+        values["tool%d" % tool] = float(temp)
+    for tool, target in enumerate(targets["t"]):
+        if target is not None:
+            values["tool%d_target" % tool] = float(target)
+    return values
+
+
+class TelemetryGate(object):
+    """Decides when telemetry is worth sending."""
+
+    def __init__(self, threshold=THRESHOLD, max_rate=MAX_RATE,
+                 heartbeat=HEARTBEAT):
+        self.threshold = threshold
+        self.max_rate = max_rate
+        self.heartbeat = heartbeat
+        self.values = None # as last sent
+        self.state = None
+        self.last_sent = None
+
+    def changed(self, values, state, now=None):
+        """Returns True if 'values' and 'state' are worth reporting,
+        compared with what was last sent."""
+
+        now = time.time() if now is None else now
+        if self.values is None or state != self.state:
+            return True
+        if now - self.last_sent >= self.heartbeat:
+            return True
+        if set(values) != set(self.values):
+            return True
+        for key, value in values.items():
+            if abs(value - self.values[key]) >= self.threshold:
+                return True
+        return False
+
+    def wait(self, now=None):
+        """Returns how many seconds until a report may be sent."""
+
+        if self.last_sent is None or not self.max_rate:
+            return 0
+        now = time.time() if now is None else now
+        return max(self.last_sent + 1.0 / self.max_rate - now, 0)
+
+    def until_heartbeat(self, now=None):
+        """Returns how many seconds until the last report is due to be
+        sent again, whether or not anything has changed."""
+
+        if self.last_sent is None:
+            return 0
+        now = time.time() if now is None else now
+        return max(self.last_sent + self.heartbeat - now, 0)
+
+    def sent(self, values, state, now=None):
+        """Records that a report was sent."""
+
+        self.values = dict(values)
+        self.state = state
+        self.last_sent = time.time() if now is None else now
+
+
+class TelemetryHistory(object):
+    """The last 'size' samples of a printer's telemetry.  Each field
+    is kept in its own array of doubles, with NaN where a sample
+    doesn't have it, indexed in step with an array of timestamps."""
+
+    def __init__(self, size=HISTORY_SIZE, interval=SAMPLE_INTERVAL):
+        self.size = size
+        self.interval = interval
+        self.count = 0 # samples ever recorded
+        self.stamps = array("d", [NAN]) * size
+        self.columns = {} # field -> array of values
+
+    def record(self, values, now=None):
+        """Adds a sample, unless the last one was less than 'interval'
+        seconds ago.  Returns True if it was added."""
+
+        now = time.time() if now is None else now
+        if self.count and \
+           now - self.stamps[(self.count - 1) % self.size] < self.interval:
+            return False
+        slot = self.count % self.size
+        self.stamps[slot] = now
+        for field in values:
+            if field not in self.columns:
+                self.columns[field] = array("d", [NAN]) * self.size
+        for field, column in self.columns.items():
+            column[slot] = values.get(field, NAN)
+        self.count += 1
+        return True
+
+    def __segments(self):
+        """Returns the slices of the ring holding samples, oldest
+        first."""
+
+        if self.count <= self.size:
+            return [(0, self.count)]
+        split = self.count % self.size
+        return [(split, self.size), (0, split)]
+
+    def query(self, since=0, fields=None):
+        """Returns the timestamps of the samples taken after 'since',
+        oldest first, and a dictionary of lists of their values for
+        each of 'fields', or every field if 'fields' is empty."""
+
+        fields = fields or self.columns.keys()
+        stamps = []
+        found = dict((field, []) for field in fields)
+        for start, end in self.__segments():
+            start = bisect_right(self.stamps, since, start, end)
+            stamps += self.stamps[start:end].tolist()
+            for field in fields:
+                column = self.columns.get(field)
+                if column is None:
+                    found[field] += [NAN] * (end - start)
+                else:
+                    found[field] += column[start:end].tolist()
+        return stamps, found
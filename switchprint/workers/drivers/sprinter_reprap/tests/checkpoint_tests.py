@@ -0,0 +1,69 @@
+
+
+# This file is part of Switchprint.
+#
+# Switchprint is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Switchprint is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Switchprint.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+from tempfile import mkdtemp
+from ..job import prepare_job
+from ..checkpoint import find_resume_position, resume_gcode
+
+
+def resume_test():
+    tmp = mkdtemp()
+    src_path = os.path.join(tmp, "src.gcode")
+    with open(src_path, "w") as src:
+        src.write("G28\nG92 E0\nG1 Z0.3 F900\n")
+        for i in range(50):
+            src.write("G1 X%d Y%d E%d\n" % (i, i, i))
+        src.write("G1 Z0.6\n")
+        for i in range(50):
+            src.write("G1 X%d Y%d E%d\n" % (i, i, 50+i))
+    job = prepare_job(src_path, os.path.join(tmp, "job.gcode"))
+
+    position = find_resume_position(job, 60)
+    assert position == {"Z" : 0.6, "E" : 55.0, "F" : 900.0}
+
+    checkpoint = {
+        "targets" : {"b" : 60.0, "t" : [210.0, None]},
+        "tool" : 0,
+        "relative" : False,
+        "relative_extrusion" : False,
+        }
+    soup = resume_gcode(checkpoint, position).split("\n")
+    assert soup.index("M190 S60.0") < soup.index("G28 X0 Y0")
+    assert soup.index("M109 T0 S210.0") < soup.index("G28 X0 Y0")
+    assert "M109 T1 S" not in "\n".join(soup)
+    assert soup.index("G92 Z0.6 E55.0") < soup.index("G28 X0 Y0")
+
+    job.remove()
+    os.remove(src_path)
+    os.rmdir(tmp)
+
+
+def resume_spacing_test():
+    tmp = mkdtemp()
+    src_path = os.path.join(tmp, "src.gcode")
+    with open(src_path, "w") as src:
+        src.write("G28\nG1  Z0.3\tF900\nG1 X1  Y1 E1\n")
+    job = prepare_job(src_path, os.path.join(tmp, "job.gcode"))
+
+    position = find_resume_position(job, len(job))
+    assert position == {"Z" : 0.3, "E" : 1.0, "F" : 900.0}
+
+    job.remove()
+    os.remove(src_path)
+    os.rmdir(tmp)
@@ -0,0 +1,124 @@
+
+
+# This file is part of Switchprint.
+#
+# Switchprint is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Switchprint is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Switchprint.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import time
+from .. import connection
+from ..connection import looks_like_garbage, SerialConnection, \
+    ConnectionException
+
+
+def garbage_test():
+    assert not looks_like_garbage("start\necho:Marlin 1.1.9\nok\n")
+    # too little to tell either way
+    assert not looks_like_garbage("\xf0\x80\xff")
+    # what "start\n" looks like read at the wrong rate
+    assert looks_like_garbage("\x80\xf8\x00\xe6\x80\x98\xfe\xf8" * 3)
+    assert looks_like_garbage("ok\n" + "\x80\xf8\x00\xe6\x80\x98\xfe\xf8" * 2)
+
+
+class HaltedPort(object):
+    """A board that boots, and then answers everything with an error,
+    as Marlin does once it has halted."""
+
+    def __init__(self, port, baud, timeout=0):
+        self.waiting = "start\necho:Marlin 1.1.9\n"
+
+    def write(self, data):
+        self.waiting += "Error:Printer halted. kill() called!\n"
+
+    def inWaiting(self):
+        return len(self.waiting)
+
+    def read(self, size):
+        data, self.waiting = self.waiting[:size], self.waiting[size:]
+        return data
+
+    def setDTR(self, level):
+        pass
+
+    def close(self):
+        pass
+
+
+def halted_test():
+    saved = (connection.serial.Serial, connection.QUICK_TIMEOUT,
+             connection.BOOT_TIMEOUT, connection.sys.platform)
+    connection.serial.Serial = HaltedPort
+    connection.QUICK_TIMEOUT = 0.1
+    connection.BOOT_TIMEOUT = 0.3
+    connection.sys.platform = "test" # no stty
+    try:
+        start = time.time()
+        try:
+            SerialConnection("halted", 250000)
+            assert False
+        except ConnectionException:
+            pass
+        # three attempts, each cut short once the boot allowance is up
+        assert time.time() - start < 3
+    finally:
+        (connection.serial.Serial, connection.QUICK_TIMEOUT,
+         connection.BOOT_TIMEOUT, connection.sys.platform) = saved
+
+
+class SilentPort(HaltedPort):
+    """A port with nothing on the other end, or a board that was
+    only ever heard from once."""
+
+    def __init__(self, port, baud, timeout=0):
+        self.waiting = SilentPort.once
+        SilentPort.once = ""
+
+    def write(self, data):
+        pass
+
+
+def silent_test():
+    saved = (connection.serial.Serial, connection.QUICK_TIMEOUT,
+             connection.BOOT_TIMEOUT, connection.sys.platform)
+    connection.serial.Serial = SilentPort
+    connection.QUICK_TIMEOUT = 0.05
+    connection.BOOT_TIMEOUT = 0.5
+    connection.sys.platform = "test" # no stty
+    try:
+        # silent for longer than a boot, so no rate is reset
+        SilentPort.once = ""
+        start = time.time()
+        try:
+            SerialConnection("silent")
+            assert False
+        except ConnectionException:
+            pass
+        assert time.time() - start < 1
+
+        # heard from, so every rate is reset, but detection still
+        # takes no longer than a reset and a boot at each rate
+        SilentPort.once = "start\n"
+        start = time.time()
+        try:
+            SerialConnection("silent")
+            assert False
+        except ConnectionException:
+            pass
+        elapsed = time.time() - start
+        bound = len(connection.BAUDS) * (
+            connection.RESET_TIME + connection.BOOT_TIMEOUT)
+        assert bound - 1 < elapsed < bound + 0.5
+    finally:
+        (connection.serial.Serial, connection.QUICK_TIMEOUT,
+         connection.BOOT_TIMEOUT, connection.sys.platform) = saved
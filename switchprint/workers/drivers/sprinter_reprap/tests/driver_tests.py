@@ -0,0 +1,114 @@
+
+
+# This file is part of Switchprint.
+#
+# Switchprint is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Switchprint is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Switchprint.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from switchprint.workers import drivers
+from ..driver import Driver
+from ..emulator import VirtualPrinter
+
+
+def registry_test():
+    found = drivers.find("hardware", "usbACM")
+    assert found.keys() == ["sprinter_reprap"]
+    assert found["sprinter_reprap"].load() is Driver
+    assert drivers.find("hardware", "parallel") == {}
+    assert drivers.registry() is drivers.registry()
+
+
+class RequestLog(object):
+    def __init__(self):
+        self.requests = []
+
+    def request(self, soup):
+        self.requests.append(soup)
+        return soup.count("\n") + 1
+
+
+def send_batch_test():
+    driver = Driver()
+    driver.monitor = RequestLog()
+    queued = driver.send_batch([
+        ("home", [True, False, False]),
+        ("move", [1, 2.5, 0]),
+        ("gcode", ["G1 X3 ; comment\n\nm400"]),
+        ("set_tool_temp", [1, 200]),
+        ("relative_mode", []),
+        ])
+    # one request, with everything in order
+    assert driver.monitor.requests == [
+        "G28 X0\nG0 X1 Y2.5 Z0\nG1 X3\nM400\nT1\nM104 S200\nG91"]
+    assert queued == 7
+
+    try:
+        driver.send_batch([("move", [1, 1, 1]), ("self_destruct", [])])
+        assert False
+    except ValueError:
+        pass
+    assert len(driver.monitor.requests) == 1
+
+
+def handover_test():
+    printer = VirtualPrinter(baud=57600, tools=2, boot_time=0.05)
+    printer.start()
+    try:
+        # the worker that found the printer lets go of it...
+        finder = Driver()
+        assert finder.auto_detect(printer.port)
+        port, baud = finder.inform_reconnect()
+        finder.release()
+        assert finder.serial is None
+
+        # ...and a host picks it up at the rate the worker found
+        adopter = Driver()
+        assert adopter.adopt(None, port, baud)
+        assert adopter.serial.connection_info() == (printer.port, 57600)
+        assert adopter.get_class_info().tools == 2
+        adopter.release()
+
+        # at the wrong rate, nothing answers and the host refuses it
+        assert not Driver().adopt(None, port, 250000)
+    finally:
+        printer.stop()
+
+
+class Signals(object):
+    uuid = "driver-tests-reconnect"
+
+
+def reconnect_test():
+    printer = VirtualPrinter(baud=57600, boot_time=0.05)
+    printer.start()
+    try:
+        driver = Driver()
+        assert driver.adopt(None, printer.port, 57600)
+        driver.connect_events(Signals())
+        trace = driver.monitor.proto.trace
+        history = driver.monitor.history
+
+        # the main loop lets go of the device, a thread connects to
+        # the new one, and the main loop carries on where it left off
+        driver.prepare_reconnect()
+        assert driver.monitor is None and driver.serial is None
+        driver.informed_reconnect(printer.port, 57600)
+        assert driver.monitor is None
+        driver.connect_events(Signals())
+        assert driver.monitor.proto.trace is trace
+        assert driver.monitor.proto.cache.trace is trace
+        assert driver.monitor.history is history
+        driver.release()
+    finally:
+        printer.stop()
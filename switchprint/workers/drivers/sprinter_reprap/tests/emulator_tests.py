@@ -0,0 +1,193 @@
+
+
+# This file is part of Switchprint.
+#
+# Switchprint is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Switchprint is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Switchprint.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import time
+import serial
+from .. import connection as connection_module
+from ..emulator import VirtualPrinter
+from ..connection import SerialConnection
+from ..protocol import SprinterProtocol
+
+
+def read_until(port, text, timeout=2):
+    """Reads what the emulator sends until 'text' turns up, or
+    'timeout' seconds pass."""
+
+    data = ""
+    give_up = time.time() + timeout
+    while text not in data and time.time() < give_up:
+        data += port.read(port.inWaiting())
+        time.sleep(0.01)
+    return data
+
+
+def checksum(line):
+    return reduce(lambda a, b: a ^ b, map(ord, line), 0)
+
+
+def stream(proto, timeout=10):
+    """Runs the protocol until everything requested is acknowledged."""
+
+    give_up = time.time() + timeout
+    while proto.buffer_status() != "idle" and time.time() < give_up:
+        proto.execute_requests()
+        time.sleep(0.001)
+    return proto.buffer_status() == "idle"
+
+
+def banner_test():
+    printer = VirtualPrinter(tools=2, boot_time=0.05)
+    printer.start()
+    try:
+        port = serial.Serial(printer.port, 250000, timeout=0)
+        assert "start" in read_until(port, "start\n")
+        port.write("M115\n")
+        answer = read_until(port, "ok\n")
+        assert "FIRMWARE_NAME:Marlin" in answer
+        assert "EXTRUDER_COUNT:2" in answer
+        assert printer.boots == 1
+        port.close()
+
+        # at the wrong rate, what comes back makes no sense
+        port = serial.Serial(printer.port, 115200, timeout=0)
+        assert "start" not in read_until(port, "start\n", 0.5)
+        port.close()
+    finally:
+        printer.stop()
+
+
+def checksum_test():
+    printer = VirtualPrinter(boot_time=0.05)
+    printer.start()
+    try:
+        port = serial.Serial(printer.port, 250000, timeout=0)
+        read_until(port, "start\n")
+        port.write("N1 G1 X1*0\n")
+        assert "Resend: 1" in read_until(port, "ok\n")
+        assert printer.errors == 1
+        port.write("N1 G1 X1*%d\n" % checksum("N1 G1 X1"))
+        assert "ok" in read_until(port, "ok\n")
+        assert printer.last_line == 1
+        port.close()
+    finally:
+        printer.stop()
+
+
+def auto_detect_test():
+    printer = VirtualPrinter(baud=250000, tools=2, boot_time=0.05)
+    printer.start()
+    try:
+        # the emulator talks garbage at 115200 baud, so detection
+        # should move straight on to 250000
+        start = time.time()
+        connection = SerialConnection(printer.port)
+        assert time.time() - start < 1
+        assert connection.connection_info() == (printer.port, 250000)
+        assert connection.reported["firmware_name"].startswith("marlin")
+        assert connection.reported["heated_bed"]
+        assert connection.info.tools == 2
+        connection.close()
+    finally:
+        printer.stop()
+
+
+def profile_test():
+    printer = VirtualPrinter(baud=57600, tools=2, boot_time=0.05)
+    printer.start()
+    try:
+        connection = SerialConnection(printer.port)
+        profile = connection.profile()
+        connection.close()
+        assert profile["baud"] == 57600
+
+        # with a profile, only a single M115 should be needed
+        start = time.time()
+        connection = SerialConnection(printer.port, profile=profile)
+        assert time.time() - start < 1
+        assert connection.confirmed
+        assert connection.connection_info() == (printer.port, 57600)
+        assert connection.info.tools == 2
+        connection.close()
+
+        # a profile for some other printer falls back to detection
+        profile["reported"]["firmware_name"] = "sprinter"
+        connection = SerialConnection(printer.port, profile=profile)
+        assert not connection.confirmed
+        assert connection.connection_info() == (printer.port, 57600)
+        connection.close()
+    finally:
+        printer.stop()
+
+
+def auto_report_test():
+    printer = VirtualPrinter(tools=2, boot_time=0.05, auto_report=True)
+    printer.start()
+    try:
+        connection = SerialConnection(printer.port, 250000)
+        capabilities = connection.reported["capabilities"]
+        assert capabilities["autoreport_temp"] == 1
+        proto = SprinterProtocol(connection, None)
+        proto.request("M104 S200")
+        proto.start_auto_report(1)
+        assert stream(proto)
+        heard = proto.temps_heard
+        give_up = time.time() + 3
+        while proto.temps_heard == heard and time.time() < give_up:
+            proto.execute_requests()
+            time.sleep(0.01)
+        assert proto.temps_heard > heard
+        assert proto.temps["t"][0] > 20
+        assert printer.report_interval == 1
+        connection.close()
+    finally:
+        printer.stop()
+
+
+def slow_boot_test():
+    # The board takes too long to answer for the quick passes, so it
+    # is only found by the pass that resets it first.  A pty has no
+    # DTR line, which mustn't stop that pass from probing.
+    printer = VirtualPrinter(boot_time=0.5)
+    printer.start()
+    saved = connection_module.QUICK_TIMEOUT
+    connection_module.QUICK_TIMEOUT = 0.1
+    try:
+        connection = SerialConnection(printer.port, 250000)
+        assert connection.connection_info() == (printer.port, 250000)
+        connection.close()
+    finally:
+        connection_module.QUICK_TIMEOUT = saved
+        printer.stop()
+
+
+def noisy_print_test():
+    printer = VirtualPrinter(boot_time=0.05, seed=1)
+    printer.start()
+    try:
+        connection = SerialConnection(printer.port, 250000)
+        proto = SprinterProtocol(connection, None)
+        # roughly one line in seven gets corrupted
+        printer.noise = 0.005
+        commands = ["G1 X%d Y%d E%d" % (i, i, i) for i in range(500)]
+        proto.request("\n".join(commands))
+        assert stream(proto)
+        assert printer.errors > 0
+        assert printer.last_line == len(commands)
+        connection.close()
+    finally:
+        printer.stop()
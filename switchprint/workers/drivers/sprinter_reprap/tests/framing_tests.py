@@ -0,0 +1,54 @@
+
+
+# This file is part of Switchprint.
+#
+# Switchprint is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Switchprint is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Switchprint.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from .. import framing
+
+
+def reference_wrap(num, line):
+    numbered = "N{0} {1}".format(num, line.strip())
+    checksum = reduce(lambda x, y:x^y, map(ord, numbered))
+    return numbered + "*{0}\n".format(checksum)
+
+
+def framing_matches_reference_test():
+    lines = ["G1 X%d.5 Y%d E0.0%d" % (i, i*3, i) for i in range(200)]
+    # the first batch is small enough to skip numpy, the second isn't
+    for batch in (lines[:10], lines):
+        for num, encoded in enumerate(framing.encode(batch)):
+            expected = reference_wrap(num+1, batch[num])
+            assert framing.frame(num+1, *encoded) == expected
+
+
+def framing_without_numpy_test():
+    lines = ["G1 X%d.5 Y%d E0.0%d" % (i, i*3, i) for i in range(200)]
+    hold = framing.numpy
+    framing.numpy = None
+    try:
+        encoded = framing.encode(lines)
+    finally:
+        framing.numpy = hold
+    assert encoded == framing.encode(lines)
+
+
+def framing_unicode_test():
+    # commands that arrive over dbus are unicode
+    lines = ["G1 X%d.5 Y%d E0.0%d" % (i, i*3, i) for i in range(200)]
+    for batch in (lines[:10], lines):
+        encoded = framing.encode([unicode(line) for line in batch])
+        assert encoded == framing.encode(batch)
+        assert all([type(body) is str for body, body_sum in encoded])
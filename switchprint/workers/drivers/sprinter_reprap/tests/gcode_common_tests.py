@@ -0,0 +1,72 @@
+
+
+# This file is part of Switchprint.
+#
+# Switchprint is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Switchprint is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Switchprint.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from ..gcode_common import tokenize_response, parse_capabilities
+
+
+def tokenize_ack_test():
+    assert tokenize_response("ok\n") == [("ok", None, None)]
+    assert tokenize_response("ok N12 P15 B3\n") == [("ok", 12, 3)]
+    assert tokenize_response("okay\n") == [("other", "okay")]
+
+
+def tokenize_resend_test():
+    assert tokenize_response("Resend: 5\n") == [("resend", 5)]
+    assert tokenize_response("rs N7\n") == [("resend", 7)]
+    assert tokenize_response("Resend:\n") == [("resend", None)]
+
+
+def tokenize_temps_test():
+    events = tokenize_response(
+        "ok T:200.0 /205.0 B:60.0 /60.0 T0:200.0 /205.0 T1:180 /185 @:0 B@:0\n")
+    assert events[0] == ("ok", None, None)
+    assert events[1] == ("temps", {
+        "t" : {None : (200.0, 205.0), 0 : (200.0, 205.0), 1 : (180.0, 185.0)},
+        "b" : (60.0, 60.0)})
+    # Sprinter doesn't report targets, and M109 reports E instead of B
+    assert tokenize_response("ok T:24 B:23\n")[1] == (
+        "temps", {"t" : {None : (24.0, None)}, "b" : (23.0, None)})
+    assert tokenize_response("T:200.0 E:0 W:?\n") == [
+        ("temps", {"t" : {None : (200.0, None)}, "b" : None})]
+
+
+def tokenize_echo_test():
+    assert tokenize_response("echo:Active Extruder: 1\n") == [("extruder", 1)]
+    assert tokenize_response("echo:busy: processing\n") == [
+        ("busy", "busy: processing")]
+    assert tokenize_response("echo:SD init fail\n") == [
+        ("echo", "SD init fail")]
+    assert tokenize_response("Error:Printer halted. kill() called!\n") == [
+        ("error", "Error:Printer halted. kill() called!")]
+
+
+def capabilities_test():
+    reported = parse_capabilities(
+        "echo:Marlin 1.1.9\n"
+        "FIRMWARE_NAME:Marlin 1.1.9 (Github) PROTOCOL_VERSION:1.0 "
+        "MACHINE_TYPE:Virtual EXTRUDER_COUNT:2\n"
+        "Cap:EEPROM:1\n"
+        "Cap:AUTOREPORT_TEMP:1\n")
+    assert reported["firmware_name"] == "marlin 1.1.9 (github)"
+    assert reported["extruder_count"] == 2
+    assert reported["capabilities"] == {"eeprom" : 1, "autoreport_temp" : 1}
+
+    reported = parse_capabilities("FIRMWARE_NAME:Sprinter MACHINE_TYPE:Mendel")
+    assert reported["machine_type"] == "mendel"
+    assert reported["extruder_count"] == 1
+    assert reported["capabilities"] == {}
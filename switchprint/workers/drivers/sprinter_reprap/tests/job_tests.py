@@ -0,0 +1,107 @@
+
+
+# This file is part of Switchprint.
+#
+# Switchprint is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Switchprint is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Switchprint.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+from tempfile import mkdtemp
+from .. import job as job_module
+from ..job import prepare_job, build_job, PreparedJob, remove_job
+
+
+def prepared_job_test():
+    tmp = mkdtemp()
+    src_path = os.path.join(tmp, "src.gcode")
+    with open(src_path, "w") as src:
+        src.write("; a comment\n")
+        for i in range(1000):
+            src.write("g1 x%d y%d ; move\n\n" % (i, i))
+    job = prepare_job(src_path, os.path.join(tmp, "job.gcode"))
+
+    assert len(job) == 1000
+    assert job.line(0) == "G1 X0 Y0"
+    assert job.line(999) == "G1 X999 Y999"
+    assert job.offset(1) == len("G1 X0 Y0\n")
+    assert job.offset(1000) == job.size
+    block = job.lines(998, 100)
+    assert block == "G1 X998 Y998\nG1 X999 Y999\n"
+    assert job.lines(1000, 100) == ""
+
+    job.remove()
+    assert os.listdir(tmp) == ["src.gcode"]
+    os.remove(src_path)
+    os.rmdir(tmp)
+
+
+def incremental_job_test():
+    tmp = mkdtemp()
+    src_path = os.path.join(tmp, "src.gcode")
+    job_path = os.path.join(tmp, "job.gcode")
+    with open(src_path, "w") as src:
+        for i in range(1000):
+            src.write("G1 X%d Y%d\n" % (i, i))
+
+    hold = job_module.CHUNK_SIZE
+    job_module.CHUNK_SIZE = 1024
+    try:
+        builder = build_job(src_path, job_path)
+        progress = builder.next()
+        job = PreparedJob(job_path)
+        # only the first chunk is available so far
+        assert 0 < len(job) < 1000
+        assert 0 < progress < 1
+        assert job.line(0) == "G1 X0 Y0"
+        first = len(job)
+        progress = builder.next()
+        job.refresh()
+        assert len(job) > first
+        for progress in builder:
+            pass
+        job.refresh()
+        assert progress == 1.0
+        assert len(job) == 1000
+        assert job.line(999) == "G1 X999 Y999"
+    finally:
+        job_module.CHUNK_SIZE = hold
+
+    job.remove()
+    os.remove(src_path)
+    os.rmdir(tmp)
+
+
+def unreadable_job_test():
+    tmp = mkdtemp()
+    job_path = os.path.join(tmp, "job.gcode")
+    open(job_path, "w").close()
+
+    # the source vanished before the job was started
+    try:
+        build_job(os.path.join(tmp, "gone.gcode"), job_path).next()
+        assert False
+    except OSError:
+        pass
+    assert os.listdir(tmp) == []
+
+    # the source can't be opened once the job's files exist
+    try:
+        build_job(tmp, job_path).next()
+        assert False
+    except IOError:
+        pass
+    assert os.listdir(tmp) == []
+
+    remove_job(job_path)
+    os.rmdir(tmp)
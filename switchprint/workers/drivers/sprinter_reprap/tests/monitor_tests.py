@@ -0,0 +1,98 @@
+
+
+# This file is part of Switchprint.
+#
+# Switchprint is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Switchprint is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Switchprint.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from ..monitor import SprinterMonitor
+from ..replay import ReplayConnection
+
+
+class SilentPrinter(ReplayConnection):
+    """A printer that never says anything."""
+
+    def __init__(self):
+        ReplayConnection.__init__(self, [])
+
+    def fileno(self):
+        return 0
+
+
+class Signals(object):
+    uuid = "monitor-tests"
+
+    def __init__(self):
+        self.telemetry = []
+
+    def on_telemetry(self, printer_state, values):
+        self.telemetry.append((printer_state, values))
+
+    def on_report(self, blob):
+        pass
+
+
+class StubTimer(object):
+    """Stands in for a Timeout, remembering when it was set for
+    rather than firing."""
+
+    def __init__(self):
+        self.seconds = None
+
+    def set(self, seconds):
+        self.seconds = seconds
+
+    def clear(self):
+        self.seconds = None
+
+
+def heartbeat_test():
+    signals = Signals()
+    monitor = SprinterMonitor(SilentPrinter(), signals)
+    monitor.report_timer = StubTimer()
+
+    # the first report goes out, and the next is due a heartbeat later
+    monitor.report_status()
+    assert len(signals.telemetry) == 1
+    assert monitor.report_timer.seconds == monitor.telemetry.heartbeat
+
+    # nothing has changed, but the heartbeat is still kept
+    monitor.report_timer.clear()
+    monitor.report_status()
+    assert len(signals.telemetry) == 1
+    heartbeat = monitor.telemetry.heartbeat
+    assert heartbeat - 1 < monitor.report_timer.seconds <= heartbeat
+
+    # once it is due, the same values are reported again
+    monitor.telemetry.last_sent -= heartbeat
+    monitor.report_status()
+    assert len(signals.telemetry) == 2
+    monitor.close()
+
+
+def history_test():
+    signals = Signals()
+    monitor = SprinterMonitor(SilentPrinter(), signals)
+    monitor.history_timer = StubTimer()
+    monitor.report_timer = StubTimer()
+
+    # sampled on a timer of its own, even though nothing is reported
+    monitor.report_status()
+    assert monitor.history.count == 0
+    monitor.sample_history()
+    assert monitor.history.count == 1
+    assert monitor.history_timer.seconds == monitor.history.interval
+    stamps, values = monitor.history.query(fields=["queue_depth"])
+    assert len(stamps) == 1 and values["queue_depth"][0] >= 0
+    monitor.close()
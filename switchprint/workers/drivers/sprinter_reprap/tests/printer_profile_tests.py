@@ -0,0 +1,46 @@
+
+
+# This file is part of Switchprint.
+#
+# Switchprint is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Switchprint is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Switchprint.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+from tempfile import mkdtemp
+from switchprint import common
+from ..printer_profile import load_profile, save_profile, clear_profile, \
+    profile_path
+
+
+def round_trip_test():
+    env = vars(common)["__ENV"]
+    old_config, env["config"] = env["config"], mkdtemp()
+    try:
+        device = "Arduino__www.arduino.cc__0043_7523733353635160E0A1"
+        assert load_profile(device) is None
+        save_profile(device, {"baud" : 250000, "uuid" : "abc",
+                              "reported" : {"firmware_name" : "marlin"}})
+        profile = load_profile(device)
+        assert profile["baud"] == 250000
+        assert profile["uuid"] == "abc"
+        assert profile["device"] == device
+        assert load_profile("/devices/pci0000:00/usb1/1-2") is None
+
+        with open(profile_path(device), "w") as out:
+            out.write("{\"baud\"")
+        assert load_profile(device) is None
+        clear_profile(device)
+        assert not os.path.exists(profile_path(device))
+    finally:
+        env["config"] = old_config
@@ -21,6 +21,7 @@ import time
 from threading import Thread
 from switchprint.workers.drivers.capabilities import FFFInfo
 from ..protocol import StreamCache, SprinterProtocol
+from ..serial_trace import SerialTrace
 
 
 def corrupted_backlog_req_test():
@@ -40,3 +41,188 @@ def corrupted_backlog_req_test():
     
     
 
+
+
+def backlog_resend_test():
+    cache = StreamCache()
+    cache.feed("G0 X100 Y100\nG0 X200 Y100\n"*2000)
+    for i in range(1000):
+        cache.nudge(erase=3)
+    # the backlog should never grow past its limit
+    assert len(cache.backlog) == 500
+    first_num = cache.send_buffer[0][0]
+    # request a line that was recently acked; it should be pulled
+    # back out of the backlog rather than lost
+    got = cache.nudge(req_num=first_num-2)
+    assert cache.send_buffer[0][0] == first_num-2
+    assert got.startswith("N{0} ".format(first_num-2))
+    assert len(cache.backlog) == 498
+
+
+def resend_warning_test():
+    trace = SerialTrace()
+    cache = StreamCache(trace=trace)
+    cache.feed("G0 X100 Y100\n"*100)
+    for i in range(20):
+        cache.nudge(erase=3)
+    first_num = cache.send_buffer[0][0]
+    cache.nudge(req_num=first_num-2)
+    cache.nudge(req_num=first_num-50)
+    # both go in the trace, rather than on stdout
+    errors = [i[2] for i in trace.entries if i[1] == "error"]
+    assert len(errors) == 2
+    assert "out of sync" in errors[0]
+    assert "corrupted" in errors[1]
+
+
+def flow_control_window_test():
+    cache = StreamCache()
+    cache.feed("G0 X100 Y100\n"*20)
+    # the default window lets four lines out at a time
+    got = cache.nudge()
+    assert got.count("\n") == 4
+    # nothing new is written until something is acknowledged
+    assert cache.nudge() is None
+    got = cache.nudge(erase=1)
+    assert got.startswith("N5 ") and got.count("\n") == 1
+    # ADVANCED_OK reports grow the window to the firmware's buffer
+    cache.report_free_slots(7)
+    got = cache.nudge(ack_num=2)
+    assert got.startswith("N6 ") and got.count("\n") == 5
+    assert len(cache.send_buffer) == 8
+
+
+def flow_control_bytes_test():
+    cache = StreamCache()
+    cache.set_rx_size(64)
+    cache.feed("G1 X1 Y1\n"*20)
+    got = cache.nudge()
+    # each wrapped line takes at most 16 bytes of the buffer
+    assert len(got) <= 64
+    assert got.count("\n") == 4
+
+
+def acked_count_test():
+    cache = StreamCache()
+    cache.feed("G1 X1\n"*10)
+    cache.feed("M105", interrupt=True)
+    cache.nudge()
+    assert cache.fed == 10 and cache.acked == 0
+    # the interrupt goes out first, and doesn't count
+    cache.nudge(erase=3)
+    assert cache.acked == 2
+    cache.nudge(erase=4)
+    assert cache.acked == 6
+    # resending from the backlog takes the acknowledgements back
+    cache.nudge(req_num=6)
+    assert cache.acked == 4
+
+
+class ScriptedSerial(object):
+    """Answers reads with whatever the test queues up."""
+
+    def __init__(self):
+        self.info = FFFInfo()
+        self.reported = {}
+        self.written = ""
+        self.responses = []
+
+    def write(self, data):
+        self.written += data
+
+    def inWaiting(self):
+        return len(self.responses)
+
+    def readlines(self):
+        lines, self.responses = self.responses, []
+        return lines
+
+
+def multi_tool_temps_test():
+    serial = ScriptedSerial()
+    serial.info.tools = 2
+    proto = SprinterProtocol(serial, None)
+    proto.request_temps()
+    # one M105, and no tool changes
+    assert serial.written.count("\n") == 1 and "M105" in serial.written
+    serial.responses = [
+        "ok T:210.2 /210.0 B:60.1 /60.0 T0:210.2 /210.0 "
+        "T1:180.5 /0.0 @:64 B@:0\n"]
+    proto.execute_requests()
+    assert proto.temps["t"] == [210.2, 180.5]
+    assert proto.targets["t"] == [210.0, None]
+    assert proto.temps["b"] == 60.1 and proto.targets["b"] == 60.0
+
+    # single tool firmware leaves out the tool number
+    serial.responses = [" T:205.0 /210.0 B:59.0 /60.0 @:0 B@:0\n"]
+    proto.execute_requests()
+    assert proto.temps["t"] == [205.0, 180.5]
+
+
+def unicode_feed_test():
+    reference = StreamCache()
+    reference.feed("G1 X1\nG1 X2\n")
+    cache = StreamCache()
+    cache.feed(u"G1 X1\nG1 X2\n")
+    assert cache.nudge() == reference.nudge()
+
+
+def split_resend_ok_test():
+    serial = ScriptedSerial()
+    proto = SprinterProtocol(serial, None)
+    proto.request("G1 X1\n"*8)
+    serial.responses = ["Error:checksum mismatch, Last Line: 0\n",
+                        "Resend: 1\n"]
+    proto.execute_requests()
+    # the ok that goes with the resend comes in a later read, and
+    # mustn't be taken for line 1's
+    serial.responses = ["ok\n"]
+    proto.execute_requests()
+    assert proto.cache.send_buffer[0][0] == 1
+    assert proto.cache.acked == 0
+    serial.responses = ["ok\n"]
+    proto.execute_requests()
+    assert proto.cache.send_buffer[0][0] == 2
+    assert proto.cache.acked == 1
+
+
+def resend_ok_test():
+    serial = ScriptedSerial()
+    proto = SprinterProtocol(serial, None)
+    proto.request("G1 X1\n"*8)
+    assert serial.written.count("\n") == 4
+    # line 1 was taken but hasn't run yet when line 2 arrives garbled
+    serial.responses = ["Error:checksum mismatch, Last Line: 1\n",
+                        "Resend: 2\n"]
+    proto.execute_requests()
+    assert proto.cache.send_buffer[0][0] == 2
+    # the ok that goes with the resend, then the one for line 1
+    serial.responses = ["ok\n", "ok\n"]
+    proto.execute_requests()
+    assert proto.cache.send_buffer[0][0] == 2
+    assert proto.cache.acked == 1
+    serial.responses = ["ok\n"]
+    proto.execute_requests()
+    assert proto.cache.send_buffer[0][0] == 3
+
+
+def owed_ok_test():
+    serial = ScriptedSerial()
+    proto = SprinterProtocol(serial, None)
+    proto.request("G1 X1\n"*8)
+    # lines 1 and 2 were taken, line 3 arrived garbled
+    serial.responses = ["Error:checksum mismatch, Last Line: 2\n",
+                        "Resend: 3\n", "ok\n"]
+    proto.execute_requests()
+    assert proto.cache.send_buffer[0][0] == 3
+    assert proto.cache.acked == 2
+    # lines 1 and 2 are acknowledged as they run, which says nothing
+    # about the lines being resent
+    serial.responses = ["ok\n", "ok\n"]
+    proto.execute_requests()
+    assert proto.cache.send_buffer[0][0] == 3
+    assert proto.cache.acked == 2
+    serial.responses = ["ok\n"]
+    proto.execute_requests()
+    assert proto.cache.send_buffer[0][0] == 4
+    assert proto.cache.acked == 3
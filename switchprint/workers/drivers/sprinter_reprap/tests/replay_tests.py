@@ -0,0 +1,45 @@
+
+
+# This file is part of Switchprint.
+#
+# Switchprint is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Switchprint is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Switchprint.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+from ..replay import load_capture, host_commands, replay
+
+
+CAPTURES = os.path.join(os.path.dirname(__file__), "captures")
+
+
+def resend_replay_test():
+    entries = load_capture(os.path.join(CAPTURES, "resend.log"))
+    commands = host_commands(entries)
+    assert len(commands) == 34 and commands[12] == "M105"
+    connection = replay(entries)
+    assert connection.reported["extruder_count"] == 1
+    assert connection.finished()
+    # both checksum errors are answered with the same resends
+    assert connection.divergence() is None
+    assert connection.written.count("N7 G1 X3 Y6 E0.30*83") == 2
+    # the capture lasted a few milliseconds, so this is quick
+    assert replay(entries, realtime=True).divergence() is None
+
+
+def diverged_replay_test():
+    entries = load_capture(os.path.join(CAPTURES, "resend.log"))
+    # if the protocol stops resending, the replay shows where
+    entries = [i for i in entries if not i[2].startswith("Resend")]
+    connection = replay(entries)
+    assert connection.divergence() == 8
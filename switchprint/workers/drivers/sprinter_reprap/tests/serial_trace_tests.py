@@ -0,0 +1,49 @@
+
+
+# This file is part of Switchprint.
+#
+# Switchprint is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Switchprint is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Switchprint.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from ..serial_trace import SerialTrace, OFF, ERROR, DEBUG
+
+
+def bounded_trace_test():
+    trace = SerialTrace(size=3)
+    trace.tx("N1 G28*18\nN2 M105*37\n")
+    for i in range(5):
+        trace.rx(["ok %d" % i])
+    trace.debug("not kept at the default level")
+    assert len(trace.entries) == 3
+    lines = trace.dump().splitlines()
+    assert [i.split()[-1] for i in lines] == ["2", "3", "4"]
+
+    trace.level = DEBUG
+    trace.debug("kept")
+    assert trace.entries[-1][1:] == ("debug", "kept")
+
+
+def trace_level_test():
+    trace = SerialTrace()
+    trace.level = OFF
+    trace.tx("N1 G28*18\n")
+    trace.error("ignored")
+    assert not trace.entries
+
+    trace.level = ERROR
+    trace.rx(["ok"])
+    trace.error("Line Number is not Last Line Number+1")
+    assert len(trace.entries) == 1
+    assert trace.dump().split(None, 2)[1:] == [
+        "error", "Line Number is not Last Line Number+1\n"]
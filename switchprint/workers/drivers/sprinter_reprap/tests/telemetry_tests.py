@@ -0,0 +1,76 @@
+
+
+# This file is part of Switchprint.
+#
+# Switchprint is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Switchprint is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Switchprint.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from ..telemetry import TelemetryGate, TelemetryHistory, telemetry_values
+
+
+def values_test():
+    values = telemetry_values({"b" : 60.2, "t" : [210, 25]},
+                              {"b" : 60, "t" : [210, None]})
+    assert values == {"bed" : 60.2, "bed_target" : 60.0,
+                      "tool0" : 210.0, "tool0_target" : 210.0,
+                      "tool1" : 25.0}
+
+
+def coalesce_test():
+    gate = TelemetryGate(threshold=0.5, max_rate=2, heartbeat=30)
+    values = {"bed" : 60.0, "tool0" : 210.0}
+    assert gate.changed(values, "idle", now=0)
+    assert gate.wait(now=0) == 0
+    gate.sent(values, "idle", now=0)
+
+    # wobble is left out, but not real changes
+    assert not gate.changed({"bed" : 60.3, "tool0" : 209.8}, "idle", now=1)
+    assert gate.changed({"bed" : 60.3, "tool0" : 209.4}, "idle", now=1)
+    assert gate.changed(values, "printing", now=1)
+    assert gate.changed(dict(values, bed_target=60.0), "idle", now=1)
+    assert gate.changed(values, "idle", now=30)
+
+    # no more than twice a second
+    assert gate.wait(now=0.2) == 0.3
+    assert gate.wait(now=0.6) == 0
+
+    # and again after a while, even if nothing changes
+    assert gate.until_heartbeat(now=10) == 20
+    assert gate.until_heartbeat(now=31) == 0
+
+
+def history_test():
+    history = TelemetryHistory(size=4, interval=1)
+    assert history.query() == ([], {})
+    history.record({"bed" : 20.0}, now=1)
+    assert not history.record({"bed" : 21.0}, now=1.5)
+    for now in range(2, 7):
+        history.record({"bed" : 20.0 + now, "tool0" : 100.0 + now}, now=now)
+
+    # only the last four samples are kept
+    stamps, values = history.query()
+    assert stamps == [3, 4, 5, 6]
+    assert values["bed"] == [23, 24, 25, 26]
+    assert values["tool0"] == [103, 104, 105, 106]
+
+    stamps, values = history.query(since=4, fields=["tool0", "tool1"])
+    assert stamps == [5, 6]
+    assert values["tool0"] == [105, 106]
+    assert [i != i for i in values["tool1"]] == [True, True]
+
+    history = TelemetryHistory(size=4, interval=1)
+    history.record({"bed" : 20.0}, now=1)
+    history.record({"tool0" : 30.0}, now=2)
+    stamps, values = history.query()
+    assert values["bed"][0] == 20 and values["bed"][1] != values["bed"][1]
@@ -0,0 +1,186 @@
+
+
+# This file is part of Switchprint.
+#
+# Switchprint is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Switchprint is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Switchprint.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Printer host processes.
+
+Normally each printer gets a process of its own: the on_connect
+worker that found it goes on to run its PrintServer.  When the daemon
+is started with --hosts, it also starts that many printer hosts, each
+of which runs any number of PrintServers on one main loop and one bus
+connection, each printer still under its own bus name.  A worker that
+finds a new printer then lets go of the device and hands it to the
+host with the fewest printers, which reconnects at the rate the worker
+found instead of probing all over again.  If that fails, the worker
+keeps the printer itself as before.
+
+Connecting to a device blocks for as long as the firmware takes to
+answer, so a host does it in a thread of its own, and only gives the
+printer a PrintServer on the main loop once it is connected.  The
+other printers on the host are served meanwhile."""
+
+
+import sys, json
+from threading import Thread
+import gobject
+import dbus, dbus.service
+from dbus.mainloop.glib import DBusGMainLoop
+from common import host_name, host_path, list_hosts, list_printers, \
+    name_from_uuid
+from server import PrintServer
+from switchprint.workers import drivers
+from switchprint import common
+
+
+class HandoverError(Exception):
+    """Raised when a printer could be neither handed to a host nor
+    reconnected by the worker that found it."""
+    pass
+
+
+class PrinterHost(dbus.service.Object):
+    """Runs the PrintServers for the printers handed to it."""
+
+    def __init__(self, index):
+        self.index = int(index)
+        self.servers = {} # uuid -> PrintServer
+        self.adopting = 0 # printers still being connected to
+        bus_name = dbus.service.BusName(
+            host_name(self.index), bus=common.get_bus())
+        dbus.service.Object.__init__(self, bus_name, host_path(self.index))
+        print "Printer Host Online:", self.index
+
+    @dbus.service.method('org.voxelpress.hardware', out_signature='i')
+    def printer_count(self):
+        return len(self.servers) + self.adopting
+
+    @dbus.service.method('org.voxelpress.hardware',
+                         in_signature='sssss', out_signature='b',
+                         async_callbacks=("reply", "error"))
+    def adopt_printer(self, driver_name, device_path, printer_uuid,
+                      device_id, reconnect_args, reply, error):
+        """Takes over a printer found by a worker, which has let go of
+        the device.  'reconnect_args' is what the worker's driver
+        returned from inform_reconnect, as json.  Replies False if the
+        device couldn't be connected to, and fails if the printer
+        couldn't be served once it was; either way the device is let
+        go of again for the worker to take back."""
+
+        entry = drivers.registry().drivers.get(str(driver_name))
+        if entry is None:
+            reply(False)
+            return
+        driver = entry.load()()
+        device_path = str(device_path)
+        args = [str(device_id) or None] + json.loads(reconnect_args)
+
+        def connect():
+            try:
+                connected = driver.adopt(*args)
+            except Exception as exception:
+                print "Unable to adopt %s: %s" % (device_path, exception)
+                connected = False
+            if connected:
+                gobject.idle_add(adopted)
+            else:
+                gobject.idle_add(failed)
+
+        def adopted():
+            self.adopting -= 1
+            driver.uuid = str(printer_uuid)
+            server = None
+            try:
+                server = PrintServer(device_path, driver.uuid, driver)
+
+                # notify the main process that a new printer exists
+                switchboard = common.get_bus().get_object(
+                    "org.voxelpress.hardware", "/org/voxelpress/hardware")
+                switchboard.worker_new_printer(driver.uuid, device_path)
+            except Exception as exception:
+                print "Unable to serve %s: %s" % (device_path, exception)
+                if server is not None:
+                    server.remove_from_connection()
+                driver.release()
+                error(exception)
+                return False
+            self.servers[driver.uuid] = server
+            reply(True)
+            return False
+
+        def failed():
+            self.adopting -= 1
+            reply(False)
+            return False
+
+        self.adopting += 1
+        worker = Thread(target=connect)
+        worker.daemon = True
+        worker.start()
+
+
+def hand_to_host(driver_name, device_path, printer_uuid, device_id, driver):
+    """Called by a worker with a newly found printer.  Hands it to the
+    least busy printer host, if there are any.  Returns True if one
+    took it, in which case the worker has nothing more to do, or False
+    if the worker should serve the printer itself.  Raises
+    HandoverError if the host couldn't connect to the device and the
+    worker couldn't get it back either."""
+
+    # do this before creating any bus object!
+    DBusGMainLoop(set_as_default=True)
+    bus = common.get_bus()
+    if list_printers().count(name_from_uuid(printer_uuid)):
+        # already online, and start_server_loop will tell it so
+        return False
+    loads = []
+    for index in list_hosts():
+        try:
+            host = bus.get_object(host_name(index), host_path(index))
+            loads.append((int(host.printer_count()), index, host))
+        except dbus.DBusException:
+            continue
+    if not loads:
+        return False
+    count, index, host = min(loads)
+    reconnect_args = json.dumps(driver.inform_reconnect())
+    driver.release()
+    try:
+        adopted = host.adopt_printer(
+            driver_name, device_path, str(printer_uuid), device_id or "",
+            reconnect_args, timeout=60)
+    except dbus.DBusException:
+        adopted = False
+    if adopted:
+        return True
+    if not driver.adopt(device_id, *json.loads(reconnect_args)):
+        raise HandoverError("Unable to reconnect to %s" % device_path)
+    return False
+
+
+def host(index):
+    """Runs printer host number 'index'."""
+
+    # do this before creating any bus object!
+    gobject.threads_init()
+    main_loop = gobject.MainLoop()
+    DBusGMainLoop(set_as_default=True)
+    printer_host = PrinterHost(index)
+    main_loop.run()
+
+
+if __name__ == "__main__":
+    host(*sys.argv[1:])
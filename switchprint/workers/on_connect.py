@@ -20,21 +20,39 @@ import sys
 from switchprint.workers.common import assign_uuid
 from switchprint.workers import drivers
 from switchprint.workers.server import start_server_loop
+from switchprint.workers.host import hand_to_host, HandoverError
 
 
 def on_connect(handler, *event_args):
     """Worker subprocess to handle on_connect events generated by
-    hardware monitors."""
+    hardware monitors.  Returns False if no driver claimed the
+    device."""
 
-    for driver_name, driver_data in drivers.find("hardware", handler).items():
-        driver = driver_data["driver"]()
+    for driver_name, entry in drivers.find("hardware", handler).items():
+        driver = entry.load()()
         if handler == "usbACM":
             device_path, serial_port, device_info = event_args
-            if driver.auto_detect(serial_port):
+            # udev's ID_SERIAL names the device itself where it has
+            # one, but not every board reports a serial number
+            device_id = device_info
+            if device_info in ("None", ""):
+                device_id = device_path
+            if driver.auto_detect(serial_port, device_id):
                 printer_uuid = assign_uuid(driver, device_path, device_info)
                 print "Device Connected:", printer_uuid
-                start_server_loop(device_path, printer_uuid, driver)
+                try:
+                    handed = hand_to_host(driver_name, device_path,
+                                          printer_uuid, device_id, driver)
+                except HandoverError as error:
+                    # the printer is left unregistered, and the device
+                    # may be probed again
+                    print error
+                    return False
+                if not handed:
+                    start_server_loop(device_path, printer_uuid, driver)
+                return True
+    return False
                 
 
 if __name__ == "__main__":
-    on_connect(*sys.argv[1:])
+    sys.exit(0 if on_connect(*sys.argv[1:]) else 1)
@@ -17,6 +17,7 @@
 
 
 import json, pickle
+from threading import Thread
 import gobject
 import dbus, dbus.service
 from dbus.mainloop.glib import DBusGMainLoop
@@ -32,6 +33,7 @@ class PrintServer(dbus.service.Object):
         self.__device_path = device_path
         self.__driver = driver
         self.status = None
+        self.uuid = str(printer_uuid)
 
         self.__path = path_from_uuid(printer_uuid)
         self.__name = name_from_uuid(printer_uuid)
@@ -73,6 +75,33 @@ class PrintServer(dbus.service.Object):
         ## DEBUG
         # print "Pushing blob to applicable hosts:\n",blob
 
+    @dbus.service.signal(dbus_interface='org.voxelpress.hardware', signature='sa{sd}')
+    def on_telemetry(self, printer_state, values):
+        """The printer's temperatures as doubles, by name: "bed",
+        "bed_target", "tool0", "tool0_target" and so on, with targets
+        left out until they are set.  Only sent when something has
+        changed enough to matter, and no more often than the rate set
+        with set_telemetry.  Prefer this to on_report."""
+
+    @dbus.service.method('org.voxelpress.hardware', in_signature='das',
+                         out_signature='ada{sad}')
+    def get_history(self, since, fields):
+        """Returns the printer's recent telemetry in one go: the
+        timestamps of the samples taken after 'since', and their
+        values for each of 'fields' (every field if empty), with NaN
+        where a sample lacks one.  Fields are those of on_telemetry,
+        plus "queue_depth" and "progress"."""
+        stamps, values = self.__driver.get_history(
+            since, [str(field) for field in fields])
+        return (dbus.Array(stamps, signature="d"),
+                dbus.Dictionary(values, signature="sad"))
+
+    @dbus.service.method('org.voxelpress.hardware', in_signature='dd')
+    def set_telemetry(self, max_rate, threshold):
+        """Sets how many times a second telemetry may be sent at most,
+        and how far a value must move before it is sent again."""
+        self.__driver.set_telemetry(max_rate, threshold)
+
     @dbus.service.signal(dbus_interface='org.voxelpress.hardware', signature='s')
     def on_state_change(self, state):
         """Signals when the printer's status changes."""
@@ -90,12 +119,51 @@ class PrintServer(dbus.service.Object):
         else:
             return False
 
-    @dbus.service.method('org.voxelpress.hardware', in_signature='ss')
-    def force_reconnect(self, device_path, reconnect_args):
-        self.__device_path = device_path
-        self.__driver.informed_reconnect(*json.loads(reconnect_args))
-        self.on_state_change("ready")
-        print "Printer Reconnected:", self.__name
+    @dbus.service.method('org.voxelpress.hardware', out_signature='s')
+    def get_state(self):
+        return self.status
+
+    @dbus.service.method('org.voxelpress.hardware', out_signature='s')
+    def get_device_path(self):
+        return self.__device_path
+
+    @dbus.service.method('org.voxelpress.hardware', in_signature='ss',
+                         async_callbacks=("reply", "error"))
+    def force_reconnect(self, device_path, reconnect_args, reply, error):
+        """Moves the printer to the device a worker found it on again.
+        Connecting blocks for as long as the firmware takes to answer,
+        so it is done in a thread of its own, and the driver is only
+        attached to the main loop again once it is connected.  Any
+        other printers on the loop are served meanwhile."""
+
+        self.__device_path = str(device_path)
+        args = json.loads(reconnect_args)
+
+        def connect():
+            try:
+                self.__driver.informed_reconnect(*args)
+            except Exception as exception:
+                gobject.idle_add(failed, exception)
+            else:
+                gobject.idle_add(reconnected)
+
+        def reconnected():
+            self.__driver.connect_events(self)
+            self.on_state_change("ready")
+            print "Printer Reconnected:", self.__name
+            reply()
+            return False
+
+        def failed(exception):
+            print "Unable to reconnect %s: %s" % (self.__name, exception)
+            self.on_state_change("offline")
+            error(exception)
+            return False
+
+        self.__driver.prepare_reconnect()
+        worker = Thread(target=connect)
+        worker.daemon = True
+        worker.start()
         
     @dbus.service.method('org.voxelpress.hardware', in_signature='s', out_signature='s')
     def debug(self, command):
@@ -129,10 +197,39 @@ class PrintServer(dbus.service.Object):
     def set_bed_temp(self, target):
         self.__driver.set_bed_temp(target)
 
+    @dbus.service.method('org.voxelpress.hardware', in_signature='a(sav)',
+                         out_signature='i')
+    def send_batch(self, commands):
+        """Queues many commands in one call.  Each is a control method
+        of this object by name with its arguments, eg ("move", [1, 2,
+        0]), or ("gcode", [text]).  Returns the number of lines
+        queued."""
+        return self.__driver.send_batch(
+            [(str(name), list(args)) for name, args in commands])
+
     @dbus.service.method('org.voxelpress.hardware', out_signature='s')
     def get_class_info(self):
         return pickle.dumps(self.__driver.get_class_info())
 
+    @dbus.service.method('org.voxelpress.hardware', out_signature='s')
+    def dump_trace(self):
+        """Returns the recent traffic with the printer as text."""
+        return self.__driver.dump_trace()
+
+    @dbus.service.method('org.voxelpress.hardware', in_signature='i')
+    def set_trace_level(self, level):
+        self.__driver.set_trace_level(level)
+
+    @dbus.service.method('org.voxelpress.hardware', in_signature='s')
+    def start_capture(self, path):
+        """Records the session with the printer to a file which may be
+        replayed without it."""
+        self.__driver.start_capture(path)
+
+    @dbus.service.method('org.voxelpress.hardware')
+    def stop_capture(self):
+        self.__driver.stop_capture()
+
 
     #### FIXME: The following "pdq" method and signals were added to
     #### facilitate a demonstration and enable rudementry printing
@@ -143,6 +240,12 @@ class PrintServer(dbus.service.Object):
     def pdq_request_print(self, file_path):
         self.__driver.pdq_request_print(file_path)
 
+    @dbus.service.method('org.voxelpress.hardware', out_signature='b')
+    def pdq_resume_print(self):
+        """Resumes an interrupted print job from its last checkpoint.
+        Returns False if there was nothing to resume."""
+        return self.__driver.pdq_resume_print()
+
     @dbus.service.signal(dbus_interface='org.voxelpress.hardware', signature='s')
     def on_pdq_print_progress(self, state):
         """Signals the current status of the print job."""
@@ -159,6 +262,7 @@ class PrintServer(dbus.service.Object):
 def start_server_loop(device_path, printer_uuid, driver):
 
     # do this before creating any bus object!
+    gobject.threads_init()
     main_loop = gobject.MainLoop()
     DBusGMainLoop(set_as_default=True)
 
@@ -167,15 +271,19 @@ def start_server_loop(device_path, printer_uuid, driver):
     check_name = name_from_uuid(printer_uuid)
     if printers.count(check_name):
         reconnect_args = json.dumps(driver.inform_reconnect())
+        driver.release()
         path = "/" + check_name.replace(".", "/")
         prox = bus.get_object(check_name, path)
-        prox.force_reconnect(device_path, reconnect_args)
+        prox.force_reconnect(device_path, reconnect_args, timeout=60)
+        switchboard = bus.get_object(
+            "org.voxelpress.hardware", "/org/voxelpress/hardware")
+        switchboard.worker_reconnected_printer(str(printer_uuid), device_path)
     else:
         server = PrintServer(device_path, printer_uuid, driver)
 
         # notify the main process that a new printer exists
         switchboard = bus.get_object(
             "org.voxelpress.hardware", "/org/voxelpress/hardware")
-        switchboard.worker_new_printer(str(printer_uuid))
+        switchboard.worker_new_printer(str(printer_uuid), device_path)
         main_loop.run()
 
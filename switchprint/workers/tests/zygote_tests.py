@@ -0,0 +1,75 @@
+
+
+# This file is part of Switchprint.
+#
+# Switchprint is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Switchprint is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Switchprint.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os, sys, time, signal
+from .. import zygote
+from ..zygote import Zygote
+
+
+def fake_handlers():
+    return {
+        "done" : lambda: None,
+        "refuse" : lambda: False,
+        "exit" : lambda code: sys.exit(int(code)),
+        "hang" : lambda: time.sleep(30),
+        }
+
+
+def start_zygote():
+    """Forks a zygote that runs the handlers above, rather than the
+    real workers."""
+
+    saved = zygote.handlers
+    zygote.handlers = fake_handlers
+    try:
+        return Zygote()
+    finally:
+        zygote.handlers = saved
+
+
+def zygote_test():
+    forked = start_zygote()
+    try:
+        assert forked.create("done").wait() == 0
+        assert forked.create("refuse").wait() == 1
+        assert forked.create("exit", "3").wait() == 3
+        hung = forked.create("hang")
+        assert hung.poll() is None
+        hung.kill()
+        assert hung.wait() == -signal.SIGKILL
+    finally:
+        forked.stop()
+    # once it is stopped, there is nothing to fork workers from
+    assert not forked.alive()
+    assert forked.create("done") is None
+
+
+def dead_zygote_test():
+    forked = start_zygote()
+    hung = forked.create("hang")
+    try:
+        os.kill(forked.pid, signal.SIGKILL)
+        os.waitpid(forked.pid, 0)
+        assert forked.create("done") is None
+        # with the zygote went any word of its children
+        assert hung.wait() == -signal.SIGKILL
+    finally:
+        try:
+            os.kill(hung.pid, signal.SIGKILL)
+        except OSError:
+            pass
@@ -0,0 +1,227 @@
+
+
+# This file is part of Switchprint.
+#
+# Switchprint is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Switchprint is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Switchprint.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""A zygote process for worker subprocesses.
+
+Starting a fresh interpreter for every hotplug event means importing
+dbus, gobject, pyserial and every driver again each time.  Instead,
+the daemon forks a zygote before it connects to the bus, which
+imports all of that once and then forks a child for each event.  The
+zygote tells the daemon the pid of each child it forks, and its exit
+status once it exits, over a socket; the daemon's side of a child is
+a WorkerProcess, which behaves enough like a subprocess.Popen for the
+probe scheduler."""
+
+
+import os, sys, json, errno, select, signal, socket, traceback
+
+
+# How often, in seconds, the zygote reaps children that have exited.
+REAP_INTERVAL = 0.2
+
+
+def handlers():
+    """Imports what the workers need, and returns their entry points
+    by event name."""
+
+    from switchprint.workers import drivers
+    from switchprint.workers.on_connect import on_connect
+    from switchprint.workers.host import host
+    for entry in drivers.registry().drivers.values():
+        entry.load()
+    return {
+        "on_connect" : on_connect,
+        "host" : host,
+        }
+
+
+def run_child(handler, args):
+    """Runs in the forked child, and never returns."""
+
+    status = 1
+    try:
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        result = handler(*args)
+        status = 0 if result in (None, True) else 1
+    except SystemExit as exit:
+        status = exit.code if isinstance(exit.code, int) else 1
+    except:
+        traceback.print_exc()
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(status)
+
+
+def serve(sock):
+    """The zygote's main loop.  Returns once the daemon closes its end
+    of the socket."""
+
+    events = handlers()
+    pending = ""
+    while True:
+        try:
+            readable = select.select([sock], [], [], REAP_INTERVAL)[0]
+        except select.error as error:
+            if error.args[0] == errno.EINTR:
+                continue
+            raise
+        if readable:
+            data = sock.recv(4096)
+            if not data:
+                return
+            pending += data
+            while "\n" in pending:
+                line, pending = pending.split("\n", 1)
+                request, event, args = json.loads(line)
+                pid = os.fork()
+                if pid == 0:
+                    sock.close()
+                    run_child(events[event], args)
+                sock.sendall(json.dumps(
+                    {"request" : request, "pid" : pid}) + "\n")
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError:
+                break
+            if not pid:
+                break
+            if os.WIFSIGNALED(status):
+                code = -os.WTERMSIG(status)
+            else:
+                code = os.WEXITSTATUS(status)
+            sock.sendall(json.dumps({"pid" : pid, "status" : code}) + "\n")
+
+
+class WorkerProcess(object):
+    """The daemon's handle on a worker forked by the zygote."""
+
+    def __init__(self, zygote, pid):
+        self.pid = pid
+        self.returncode = None
+        self.__zygote = zygote
+
+    def poll(self):
+        self.__zygote.read()
+        return self.returncode
+
+    def wait(self):
+        while self.returncode is None:
+            if not self.__zygote.read(block=True):
+                # the zygote is gone, and with it any word of the child
+                self.returncode = -signal.SIGKILL
+        return self.returncode
+
+    def kill(self):
+        if self.returncode is None:
+            os.kill(self.pid, signal.SIGKILL)
+
+
+class Zygote(object):
+    """Forks the zygote process, and hands it events to fork workers
+    for.  Must be created before the daemon connects to the bus or
+    starts its main loop, so that none of that is inherited."""
+
+    def __init__(self):
+        ours, theirs = socket.socketpair()
+        self.pid = os.fork()
+        if self.pid == 0:
+            ours.close()
+            status = 0
+            try:
+                serve(theirs)
+            except:
+                traceback.print_exc()
+                status = 1
+            os._exit(status)
+        theirs.close()
+        self.__sock = ours
+        self.__pending = ""
+        self.__requests = 0
+        self.__started = {} # request -> pid
+        self.__children = {} # pid -> WorkerProcess
+        self.__exited = {} # pid -> status, for children not yet known
+
+    def alive(self):
+        return self.__sock is not None
+
+    def create(self, event, *args):
+        """Has the zygote fork a worker for 'event'.  Returns a
+        WorkerProcess, or None if the zygote has died."""
+
+        if not self.alive():
+            return None
+        self.__requests += 1
+        request = self.__requests
+        try:
+            self.__sock.sendall(json.dumps([request, event, args]) + "\n")
+        except socket.error:
+            self.__close()
+            return None
+        while request not in self.__started:
+            if not self.read(block=True):
+                return None
+        child = WorkerProcess(self, self.__started.pop(request))
+        self.__children[child.pid] = child
+        if child.pid in self.__exited:
+            child.returncode = self.__exited.pop(child.pid)
+            del self.__children[child.pid]
+        return child
+
+    def read(self, block=False):
+        """Handles whatever the zygote has sent.  Returns False if the
+        zygote has died."""
+
+        if not self.alive():
+            return False
+        if not select.select([self.__sock], [], [], None if block else 0)[0]:
+            return True
+        try:
+            data = self.__sock.recv(4096)
+        except socket.error:
+            data = ""
+        if not data:
+            self.__close()
+            return False
+        self.__pending += data
+        while "\n" in self.__pending:
+            line, self.__pending = self.__pending.split("\n", 1)
+            message = json.loads(line)
+            if "request" in message:
+                self.__started[message["request"]] = message["pid"]
+                continue
+            child = self.__children.pop(message["pid"], None)
+            if child:
+                child.returncode = message["status"]
+            else:
+                self.__exited[message["pid"]] = message["status"]
+        return True
+
+    def __close(self):
+        self.__sock.close()
+        self.__sock = None
+        for child in self.__children.values():
+            if child.returncode is None:
+                child.returncode = -signal.SIGKILL
+        self.__children = {}
+
+    def stop(self):
+        if self.alive():
+            self.__close()
+            os.waitpid(self.pid, 0)